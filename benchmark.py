@@ -0,0 +1,437 @@
+"""
+Load test for the workspace hot paths.
+
+Seeds a throwaway data directory (users.db, projects/ and visibility grants), then drives a
+weighted mix of requests through the app and reports throughput and p50/p95/p99 latency per
+route. Results can be saved as a baseline and compared with later runs.
+
+    python benchmark.py run --users 50 --projects 500 --requests 5000 --save before.json
+    python benchmark.py run --users 50 --projects 500 --requests 5000 --compare before.json
+    python benchmark.py compare before.json after.json
+
+By default requests go through the Flask test client in this process, so no server or network
+is needed. To measure a real server instead:
+
+    python benchmark.py seed --data-dir /tmp/bench
+    WORKSHOP_DATA_DIR=/tmp/bench python main.py serve --workers 2
+    python benchmark.py run --data-dir /tmp/bench --reuse --url http://127.0.0.1:8000
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BENCH_PASSWORD = 'bench'
+MEDIA_NAME = 'clip.bin'
+UPLOAD_SIZE = 256 * 1024
+SAVE_CHUNKS = 3
+WORDS = ('alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega river stone cloud '
+         'garden window paper signal orbit harbor lantern meadow copper violet').split()
+
+# Relative weights of the actions each virtual user picks from
+READ_MIX = {
+    'library': 20,
+    'search_projects': 15,
+    'load_project': 15,
+    'workspace_range': 15,
+}
+WRITE_MIX = dict(READ_MIX, heartbeat=20, save_project=10, upload_file=5)
+
+
+# ===================== Seeding =====================
+def project_name(index):
+    return f'bench-{WORDS[index % len(WORDS)]}-{index:05d}'
+
+
+def document(rng, paragraphs):
+    body = '\n'.join('<p>' + ' '.join(rng.choice(WORDS) for _ in range(60)) + '</p>' for _ in range(paragraphs))
+    return f"<!DOCTYPE html>\n<html>\n<head>\n  <meta charset='UTF-8'>\n</head>\n<body>\n{body}\n</body>\n</html>\n"
+
+
+def seed(data_dir, users, projects, grants, media_size, seed_value):
+    """Creates users, projects and grants in data_dir. Returns the plan the load generator uses."""
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+    os.makedirs(data_dir)
+    main = load_app(data_dir)
+    rng = random.Random(seed_value)
+
+    names = [project_name(i) for i in range(projects)]
+    media = rng.randbytes(media_size)
+    for index, name in enumerate(names):
+        path = os.path.join(main.PROJECTS_DIR, name)
+        os.makedirs(path)
+        with open(os.path.join(path, 'index.html'), 'w', encoding='utf-8') as f:
+            f.write(document(rng, rng.randint(5, 40)))
+        if index % 10 == 0:
+            with open(os.path.join(path, MEDIA_NAME), 'wb') as f:
+                f.write(media)
+
+    accounts = []
+    with main.app.app_context():
+        main.db.create_all()
+        main.db.session.add(main.User(username='bench_admin', password=BENCH_PASSWORD, role='admin'))
+        for index in range(users):
+            role = 'viewer' if index % 5 == 4 else 'user'
+            accounts.append({'username': f'bench_user{index:04d}', 'role': role,
+                             'home': names[index % len(names)]})
+            main.db.session.add(main.User(username=accounts[-1]['username'], password=BENCH_PASSWORD, role=role))
+        main.db.session.commit()
+        user_ids = {u.username: u.id for u in main.User.query.all()}
+
+        rows = []
+        for name in rng.sample(names, min(grants, len(names))):
+            path = os.path.join(main.PROJECTS_DIR, name)
+            if rng.random() < 0.6:
+                rows.append(main.ProjectVisibility(project_path=path, role=rng.choice(('viewer', 'user'))))
+            else:
+                for account in rng.sample(accounts, min(3, len(accounts))):
+                    rows.append(main.ProjectVisibility(project_path=path, role=account['role'],
+                                                       user_id=user_ids[account['username']]))
+        # Everyone can edit their home project, so saves and uploads exercise the success path
+        for account in accounts:
+            if account['role'] == 'user':
+                rows.append(main.ProjectVisibility(project_path=os.path.join(main.PROJECTS_DIR, account['home']),
+                                                   role='user', user_id=user_ids[account['username']]))
+        main.db.session.add_all(rows)
+        main.db.session.commit()
+    main.ChangeStamp('acl').bump()
+
+    plan = {'accounts': accounts, 'projects': names,
+            'media_projects': names[::10], 'media_size': media_size}
+    with open(os.path.join(data_dir, 'benchmark_plan.json'), 'w', encoding='utf-8') as f:
+        json.dump(plan, f)
+    return plan
+
+
+def load_app(data_dir):
+    """Imports main.py with its data directory pointed at data_dir."""
+    os.environ['WORKSHOP_DATA_DIR'] = data_dir
+    if 'main' in sys.modules:
+        main = sys.modules['main']
+        if main.DATA_DIR != os.path.abspath(data_dir):
+            raise RuntimeError('main.py is already loaded with another data directory')
+        return main
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main
+
+
+# ===================== Transports =====================
+class TestClientTransport:
+    """Sends requests through the Flask test client; one instance per virtual user (own cookies)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, files=None, headers=None):
+        if files:
+            data = dict(data or {})
+            for field, (filename, content) in files.items():
+                data[field] = (io.BytesIO(content), filename)
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, files=None, headers=None):
+        response = self.session.request(method, self.base_url + path, data=data, headers=headers,
+                                        files=files or None,
+                                        allow_redirects=False)
+        return response.status_code, len(response.content)
+
+
+# ===================== Load generation =====================
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.bytes_in = defaultdict(int)
+
+    def record(self, route, seconds, status, size):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+            self.bytes_in[route] += size
+
+
+class VirtualUser:
+    def __init__(self, transport, account, plan, recorder, rng):
+        self.transport = transport
+        self.account = account
+        self.plan = plan
+        self.recorder = recorder
+        self.rng = rng
+        mix = WRITE_MIX if account['role'] == 'user' else READ_MIX
+        self.actions = list(mix)
+        self.weights = [mix[action] for action in self.actions]
+
+    def call(self, route, method, path, record=True, **kwargs):
+        started = time.perf_counter()
+        status, size = self.transport.request(method, path, **kwargs)
+        if record:
+            self.recorder.record(route, time.perf_counter() - started, status, size)
+        return status
+
+    def login(self, record=True):
+        self.call('login', 'POST', '/login', record=record,
+                  data={'username': self.account['username'], 'password': BENCH_PASSWORD})
+        # Take the edit lease of the home project so saves and uploads are accepted
+        self.call('load_project', 'GET', f"/load_project?project_name={self.account['home']}", record=record)
+
+    def step(self, record=True):
+        action = self.rng.choices(self.actions, self.weights)[0]
+        getattr(self, action)(record)
+
+    def library(self, record):
+        self.call('library', 'GET', f'/library?page={self.rng.randint(1, 3)}', record)
+
+    def search_projects(self, record):
+        word = self.rng.choice(WORDS)[:self.rng.randint(2, 4)]
+        self.call('search_projects', 'GET', f'/search_projects?query=bench-{word}', record)
+
+    def load_project(self, record):
+        name = self.rng.choice(self.plan['projects'])
+        self.call('load_project', 'GET', f'/load_project?project_name={name}', record)
+
+    def heartbeat(self, record):
+        self.call('heartbeat', 'POST', '/heartbeat', record, data={'project_name': self.account['home']})
+
+    def save_project(self, record):
+        content = document(self.rng, self.rng.randint(5, 40))
+        size = -(-len(content) // SAVE_CHUNKS)
+        for number in range(1, SAVE_CHUNKS + 1):
+            self.call('save_project', 'POST', '/save_project', record, data={
+                'project_name': self.account['home'],
+                'content': content[(number - 1) * size:number * size],
+                'chunk_number': str(number),
+                'total_chunks': str(SAVE_CHUNKS),
+            })
+
+    def upload_file(self, record):
+        self.call('upload_file', 'POST', '/upload_file', record,
+                  data={'project_name': self.account['home']},
+                  files={'file': (f"bench-{self.rng.randint(0, 9)}.png", self.rng.randbytes(UPLOAD_SIZE))})
+
+    def workspace_range(self, record):
+        name = self.rng.choice(self.plan['media_projects'])
+        start = self.rng.randrange(self.plan['media_size'])
+        end = min(start + self.rng.choice((4096, 65536, 1048576)), self.plan['media_size']) - 1
+        self.call('workspace_range', 'GET', f'/workspace/{name}/{MEDIA_NAME}', record,
+                  headers={'Range': f'bytes={start}-{end}'})
+
+
+def run_load(plan, transport_factory, requests_total, concurrency, warmup, seed_value):
+    recorder = Recorder()
+    rng = random.Random(seed_value)
+    accounts = plan['accounts']
+    virtual_users = [VirtualUser(transport_factory(), accounts[i % len(accounts)], plan, recorder,
+                                 random.Random(rng.random())) for i in range(concurrency)]
+    counter = iter(range(requests_total))
+    counter_lock = threading.Lock()
+
+    def worker(user):
+        user.login()
+        for _ in range(warmup):
+            user.step(record=False)
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            user.step()
+
+    threads = [threading.Thread(target=worker, args=(user,)) for user in virtual_users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+# ===================== Reporting =====================
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed, meta):
+    routes = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        statuses = recorder.statuses[route]
+        routes[route] = {
+            'count': len(values),
+            'errors': sum(count for status, count in statuses.items() if status >= 400),
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'rps': len(values) / elapsed if elapsed else 0.0,
+            'mean_ms': 1000 * sum(values) / len(values),
+            'p50_ms': 1000 * percentile(values, 0.50),
+            'p95_ms': 1000 * percentile(values, 0.95),
+            'p99_ms': 1000 * percentile(values, 0.99),
+            'bytes_in': recorder.bytes_in[route],
+        }
+    total = sum(route['count'] for route in routes.values())
+    return {
+        'meta': dict(meta, elapsed_s=elapsed, total_requests=total, rps=total / elapsed if elapsed else 0.0),
+        'routes': routes,
+    }
+
+
+def print_report(result):
+    meta = result['meta']
+    print(f"{meta['total_requests']} requests in {meta['elapsed_s']:.2f}s "
+          f"({meta['rps']:.1f} req/s, concurrency {meta['concurrency']}, transport {meta['transport']})")
+    print(f"{'route':<18}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for route, stats in result['routes'].items():
+        print(f"{route:<18}{stats['count']:>8}{stats['errors']:>8}{stats['rps']:>10.1f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def compare(baseline, current, threshold):
+    """Prints per-route changes; returns the routes whose p95 or throughput regressed by more than threshold."""
+    regressions = []
+    print(f"{'route':<18}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}{'req/s':>20}")
+
+    def cell(old, new):
+        change = (new - old) / old * 100 if old else 0.0
+        return f"{old:.1f}->{new:.1f} {change:+.0f}%"
+
+    for route in sorted(set(baseline['routes']) | set(current['routes'])):
+        old, new = baseline['routes'].get(route), current['routes'].get(route)
+        if old is None or new is None:
+            print(f"{route:<18} only in {'current' if old is None else 'baseline'}")
+            continue
+        print(f"{route:<18}" + ''.join(f"{cell(old[key], new[key]):>20}" for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')))
+        if old['p95_ms'] and new['p95_ms'] > old['p95_ms'] * (1 + threshold):
+            regressions.append(route)
+        elif old['rps'] and new['rps'] < old['rps'] * (1 - threshold):
+            regressions.append(route)
+    if regressions:
+        print(f"Regressed by more than {threshold:.0%}: {', '.join(regressions)}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ===================== Command line =====================
+def command_run(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='workshop-bench-')
+    plan_path = os.path.join(data_dir, 'benchmark_plan.json')
+    if args.reuse and os.path.exists(plan_path):
+        with open(plan_path, encoding='utf-8') as f:
+            plan = json.load(f)
+    else:
+        plan = seed(data_dir, args.users, args.projects, args.grants, args.media_size, args.seed)
+
+    if args.url:
+        transport_factory = lambda: HttpTransport(args.url)
+    else:
+        main = load_app(data_dir)
+        transport_factory = lambda: TestClientTransport(main.app)
+
+    recorder, elapsed = run_load(plan, transport_factory, args.requests, args.concurrency, args.warmup, args.seed)
+    result = summarize(recorder, elapsed, {
+        'users': len(plan['accounts']), 'projects': len(plan['projects']), 'grants': args.grants,
+        'requests': args.requests, 'concurrency': args.concurrency, 'seed': args.seed,
+        'transport': args.url or 'in-process', 'git': git_revision(),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    print_report(result)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f'Saved to {args.save}')
+    if not args.data_dir and not args.url:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        if compare(baseline, result, args.threshold):
+            return 1
+    return 0
+
+
+def command_seed(args):
+    plan = seed(args.data_dir, args.users, args.projects, args.grants, args.media_size, args.seed)
+    print(f"Seeded {len(plan['accounts'])} users and {len(plan['projects'])} projects into {args.data_dir}")
+    return 0
+
+
+def command_compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    return 1 if compare(baseline, current, args.threshold) else 0
+
+
+def main_cli(argv):
+    parser = argparse.ArgumentParser(description='Workspace load test')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_seed_arguments(command):
+        command.add_argument('--users', type=int, default=50)
+        command.add_argument('--projects', type=int, default=500)
+        command.add_argument('--grants', type=int, default=200, help='number of projects with visibility grants')
+        command.add_argument('--media-size', type=int, default=4 * 1024 * 1024, help='size of the file served with ranges')
+        command.add_argument('--seed', type=int, default=1)
+
+    seed_command = commands.add_parser('seed', help='only seed a data directory')
+    add_seed_arguments(seed_command)
+    seed_command.add_argument('--data-dir', required=True)
+    seed_command.set_defaults(handler=command_seed)
+
+    run = commands.add_parser('run', help='seed a data directory and run the load mix')
+    add_seed_arguments(run)
+    run.add_argument('--requests', type=int, default=5000, help='measured actions across all virtual users')
+    run.add_argument('--concurrency', type=int, default=16, help='number of virtual users running at once')
+    run.add_argument('--warmup', type=int, default=5, help='unmeasured actions per virtual user')
+    run.add_argument('--data-dir', help='directory to seed (default: a temporary one, removed afterwards)')
+    run.add_argument('--reuse', action='store_true', help='keep an already seeded --data-dir')
+    run.add_argument('--url', help='base URL of a running server instead of the in-process test client')
+    run.add_argument('--save', help='write the results as a JSON baseline')
+    run.add_argument('--compare', help='baseline JSON to compare the results with')
+    run.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    run.set_defaults(handler=command_run)
+
+    diff = commands.add_parser('compare', help='compare two saved results')
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=0.2)
+    diff.set_defaults(handler=command_compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli(sys.argv[1:]))
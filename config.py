@@ -30,8 +30,10 @@ FONT_FAMILY = ("Segoe UI", "Arial")
 # --- Global Variables ---
 DEFAULT_CONFIG = {
     "username": "admin", "password": secrets.token_urlsafe(12),
-    "role": "admin", "ngrok_token": ""
+    "role": "admin", "ngrok_token": "",
+    "server": "waitress", "workers": 1, "threads": 64
 }
+SERVER_CHOICES = ("waitress", "dev")
 flask_process = None
 ngrok_process = None
 config = {}
@@ -114,7 +116,10 @@ def run_flask():
 
     try:
         flask_process = subprocess.Popen(
-            [sys.executable, "main.py"],
+            [sys.executable, "main.py", "serve",
+             "--server", config.get("server", DEFAULT_CONFIG["server"]),
+             "--workers", str(config.get("workers", DEFAULT_CONFIG["workers"])),
+             "--threads", str(config.get("threads", DEFAULT_CONFIG["threads"]))],
             stdout=log_file_handle,
             stderr=log_file_handle,
             creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
@@ -130,6 +135,23 @@ def run_flask():
         messagebox.showerror("Error", f"An unexpected error occurred while starting Flask: {e}")
         stop_flask()
 
+def reload_flask():
+    """Restarts the workspace workers without dropping connections (picks up code and settings changes)."""
+    if not flask_process or flask_process.poll() is not None:
+        messagebox.showinfo("Info", "Workspace is not running.")
+        return
+    if config.get("server", DEFAULT_CONFIG["server"]) == "dev":
+        # The development server cannot reload in place
+        stop_flask()
+        run_flask()
+        return
+    subprocess.Popen(
+        [sys.executable, "main.py", "reload"],
+        stdout=log_file_handle,
+        stderr=log_file_handle,
+        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    )
+
 def handle_flask_failure():
     """Shows an error message when the workspace fails to start."""
     stop_flask()
@@ -205,7 +227,10 @@ def save_admin_config():
     if not messagebox.askyesno("Confirmation", "This will save the administrator configuration and reset all workspace data (sessions, uploaded files, etc.).\n\nContinue?"):
         return
 
-    new_config = {"username": username_entry.get(), "password": password_var.get(), "role": "admin", "ngrok_token": token_entry.get()}
+    new_config = {"username": username_entry.get(), "password": password_var.get(), "role": "admin", "ngrok_token": token_entry.get(),
+                  "server": config.get("server", DEFAULT_CONFIG["server"]),
+                  "workers": config.get("workers", DEFAULT_CONFIG["workers"]),
+                  "threads": config.get("threads", DEFAULT_CONFIG["threads"])}
     save_config(new_config)
     stop_flask()
     if os.path.exists(INSTANCE_DIR):
@@ -222,6 +247,25 @@ def save_ngrok_token_and_notify():
     save_config(config)
     messagebox.showinfo("Saved", "Ngrok token saved successfully.")
 
+def save_server_settings():
+    if not os.path.exists(CONFIG_FILE):
+        messagebox.showwarning("Save Admin First", "Please save the main Administrator Configuration before saving the server settings.")
+        app.show_frame("config")
+        return
+
+    try:
+        workers, threads = int(workers_var.get()), int(threads_var.get())
+    except (tk.TclError, ValueError):
+        messagebox.showerror("Error", "Workers and threads must be whole numbers.")
+        return
+    if workers < 1 or threads < 1:
+        messagebox.showerror("Error", "Workers and threads must be at least 1.")
+        return
+
+    config.update({"server": server_var.get(), "workers": workers, "threads": threads})
+    save_config(config)
+    messagebox.showinfo("Saved", "Server settings saved. They take effect the next time the workspace is started.")
+
 def on_closing():
     if messagebox.askokcancel("Exit", "Are you sure you want to exit? All running processes will be stopped."):
         if flask_process: flask_process.terminate()
@@ -295,6 +339,7 @@ class ControlPage(ThemedPage):
         flask_frame.pack(pady=10, anchor="w")
         ttk.Button(flask_frame, text="▶ Start Workspace", command=run_flask, style='Primary.TButton').pack(side="left", padx=0)
         ttk.Button(flask_frame, text="⏹ Stop Workspace", command=stop_flask).pack(side="left", padx=10)
+        ttk.Button(flask_frame, text="🔄 Reload Workspace", command=reload_flask).pack(side="left", padx=0)
 
         ttk.Separator(main_frame).pack(fill="x", pady=20)
         ttk.Label(main_frame, text="🔓 Ngrok Access", style='Header.TLabel').pack(pady=(0, 10), anchor="w")
@@ -326,7 +371,7 @@ class ControlPage(ThemedPage):
 class ConfigPage(ThemedPage):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
-        global username_entry, password_var, token_entry
+        global username_entry, password_var, token_entry, server_var, workers_var, threads_var
 
         main_frame = ttk.Frame(self, padding=25)
         main_frame.pack(fill="both", expand=True)
@@ -357,6 +402,28 @@ class ConfigPage(ThemedPage):
         token_entry.pack(fill="x", pady=2)
         ttk.Button(main_frame, text="💾 Save Token", command=save_ngrok_token_and_notify).pack(pady=10, anchor="w")
 
+        ttk.Separator(main_frame).pack(fill="x", pady=20)
+        ttk.Label(main_frame, text="⚙ Server", style='Header.TLabel').pack(pady=(0, 15), anchor="w")
+        server_frame = ttk.Frame(main_frame)
+        server_frame.pack(anchor="w")
+
+        ttk.Label(server_frame, text="Server").grid(row=0, column=0, sticky="w")
+        server_var = tk.StringVar(value=config.get("server", DEFAULT_CONFIG["server"]))
+        ttk.Combobox(server_frame, textvariable=server_var, values=SERVER_CHOICES, state="readonly", width=10).grid(row=1, column=0, padx=(0, 10), sticky="w")
+
+        ttk.Label(server_frame, text="Workers").grid(row=0, column=1, sticky="w")
+        workers_var = tk.IntVar(value=config.get("workers", DEFAULT_CONFIG["workers"]))
+        ttk.Spinbox(server_frame, from_=1, to=16, textvariable=workers_var, width=6).grid(row=1, column=1, padx=(0, 10), sticky="w")
+
+        ttk.Label(server_frame, text="Threads per worker").grid(row=0, column=2, sticky="w")
+        threads_var = tk.IntVar(value=config.get("threads", DEFAULT_CONFIG["threads"]))
+        ttk.Spinbox(server_frame, from_=1, to=256, textvariable=threads_var, width=6).grid(row=1, column=2, sticky="w")
+
+        ttk.Button(main_frame, text="💾 Save Server Settings", command=save_server_settings).pack(pady=10, anchor="w")
+        ttk.Label(main_frame, text="Every open editor keeps one thread busy, up to all but a quarter (at least 8) of the threads\n"
+                                   "of each worker; further editors poll instead. Plan workers x threads for the expected tabs.\n"
+                                   "'dev' is the single-process development server.", font=(FONT_FAMILY[0], 8)).pack(anchor="w")
+
 # ========== APPLICATION STARTUP ==========
 if __name__ == "__main__":
     if os.path.exists(CONFIG_FILE):
@@ -368,7 +435,7 @@ if __name__ == "__main__":
     root = tk.Tk()
     root.title("Workspace Manager")
     # Slightly increase the window height so the new button fits without scrolling
-    root.geometry("620x600")
+    root.geometry("620x760")
     app = Application(master=root)
     root.protocol("WM_DELETE_WINDOW", on_closing)
     root.mainloop()
\ No newline at end of file
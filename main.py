@@ -2,10 +2,20 @@ import sys
 from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, flash
 import os
 import json
+import base64
 import shutil
 import re
 import time
 import subprocess
+import signal
+import socket
+import argparse
+import threading
+import itertools
+import queue
+import sqlite3
+from contextlib import contextmanager
+from collections import OrderedDict, defaultdict, Counter, deque, namedtuple
 from google import genai
 from datetime import datetime, timedelta
 from flask import session
@@ -19,8 +29,21 @@ from wtforms.validators import DataRequired, Length
 from functools import wraps
 from flask import send_from_directory, abort
 from werkzeug.utils import secure_filename
-from flask import Response, stream_with_context
+from werkzeug.security import safe_join
+from flask import Response, stream_with_context, send_file, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import os, mimetypes
+import gzip
+import zlib
+import struct
+import zipfile
+from urllib.parse import quote
+import hashlib
+import hmac
+import html
+from html.parser import HTMLParser
+from sortedcontainers import SortedList
 
 # Decorator for checking roles
 def roles_required(*allowed_roles):
@@ -35,7 +58,9 @@ def roles_required(*allowed_roles):
     return decorator
 
 # Initializing the Flask application
-app = Flask(__name__)
+# WORKSHOP_DATA_DIR moves instance/ (users.db and the caches) and projects/ to another directory
+DATA_DIR = os.path.abspath(os.environ['WORKSHOP_DATA_DIR']) if os.environ.get('WORKSHOP_DATA_DIR') else None
+app = Flask(__name__, instance_path=os.path.join(DATA_DIR, 'instance') if DATA_DIR else None)
 app.secret_key = 'supersecretkey' 
 
 # DB configuration for storing users
@@ -56,7 +81,7 @@ class User(db.Model, UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 # ===================== Form for creating a user (admin panel) =====================
 ROLES = ["viewer", "user", "admin"]
@@ -71,7 +96,7 @@ class CreateUserForm(FlaskForm):
 # Use the directory where main.py is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
-PROJECTS_DIR = os.path.join(BASE_DIR, 'projects')
+PROJECTS_DIR = os.path.join(DATA_DIR or BASE_DIR, 'projects')
 
 # Setting up the templates folder
 app.template_folder = TEMPLATE_DIR
@@ -81,20 +106,793 @@ os.makedirs(PROJECTS_DIR, exist_ok=True)
 os.makedirs(TEMPLATE_DIR, exist_ok=True)
 
 # ===================== Functions for working with favorite projects =====================
-def load_favorites():
-    fav_path = os.path.join(PROJECTS_DIR, '.favorites.json')
-    if os.path.exists(fav_path):
-        with open(fav_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
-
-def save_favorites(favorites):
-    fav_path = os.path.join(PROJECTS_DIR, '.favorites.json')
-    with open(fav_path, 'w', encoding='utf-8') as f:
-        json.dump(favorites, f, ensure_ascii=False)
+# Favorites are shared by everyone (projects/.favorites.json, a list) unless
+# WORKSHOP_FAVORITES_PER_USER=1, which keeps one list per user id in .favorites.users.json.
+app.config.setdefault('FAVORITES_PER_USER', os.environ.get('WORKSHOP_FAVORITES_PER_USER') == '1')
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def locked_file(path):
+    """Exclusive lock on path across processes, held for the duration of the block."""
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FavoritesStore:
+    """
+    Favorite lists cached in memory as insertion-ordered dicts (ordered sets), reloaded only when
+    the file's mtime or size changes. Changes are queued as operations; one thread at a time
+    writes them, taking every operation queued so far, so concurrent requests share one write.
+    The writer re-reads the file under a lock file before applying its operations, so changes
+    made by other processes are not lost, and replaces the file atomically.
+    """
+
+    def __init__(self, projects_dir, per_user=False):
+        self.projects_dir = projects_dir
+        self.per_user = per_user
+        self.path = os.path.join(projects_dir, '.favorites.users.json' if per_user else '.favorites.json')
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._lists = {}
+        self._file_key = None
+        self._pending = []
+        self._queued = 0
+        self._written = 0
+
+    def scope(self, user):
+        return str(user.id) if self.per_user and user is not None else None
+
+    # --- file ---
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if self.per_user:
+            return {scope: dict.fromkeys(names) for scope, names in data.items()}
+        return {None: dict.fromkeys(data)}
+
+    def _write(self, lists):
+        data = {scope: list(names) for scope, names in lists.items() if names}
+        if not self.per_user:
+            data = data.get(None, [])
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _refresh(self):
+        """Must be called with the lock held."""
+        key = self._stat_key()
+        if key != self._file_key:
+            self._lists = self._read()
+            for op in self._pending:
+                self._apply(self._lists, op)
+            self._file_key = key
+
+    @staticmethod
+    def _apply(lists, op):
+        kind, scope, name, new_name = op
+        if kind == 'add':
+            lists.setdefault(scope, {})[name] = None
+        elif kind == 'remove':
+            lists.get(scope, {}).pop(name, None)
+        else:
+            # Renames and deletions apply to every list
+            for scope, names in lists.items():
+                if name in names:
+                    if kind == 'rename':
+                        lists[scope] = {new_name if n == name else n: None for n in names}
+                    else:
+                        del names[name]
+
+    # --- queries ---
+    def get(self, user=None):
+        with self._lock:
+            self._refresh()
+            return list(self._lists.get(self.scope(user), ()))
+
+    def names(self, user=None):
+        with self._lock:
+            self._refresh()
+            return set(self._lists.get(self.scope(user), ()))
+
+    def contains(self, user, name):
+        with self._lock:
+            self._refresh()
+            return name in self._lists.get(self.scope(user), ())
+
+    def shared(self):
+        """Favorites that order everyone's library; empty when favorites are per user."""
+        return set() if self.per_user else self.names()
+
+    # --- changes ---
+    def add_op(self, user, name):
+        return ('add', self.scope(user), name, None)
+
+    def remove_op(self, user, name):
+        return ('remove', self.scope(user), name, None)
+
+    @staticmethod
+    def rename_op(old_name, new_name):
+        return ('rename', None, old_name, new_name)
+
+    @staticmethod
+    def discard_op(name):
+        return ('discard', None, name, None)
+
+    def set_favorite(self, user, name, favorite):
+        self.update([self.add_op(user, name) if favorite else self.remove_op(user, name)])
+
+    def renamed(self, old_name, new_name):
+        self.update([self.rename_op(old_name, new_name)])
+
+    def removed(self, name):
+        self.update([self.discard_op(name)])
+
+    def update(self, ops):
+        """Applies ops and returns once they are on disk."""
+        if not ops:
+            return
+        with self._lock:
+            self._refresh()
+            for op in ops:
+                self._apply(self._lists, op)
+            self._pending.extend(ops)
+            self._queued += 1
+            ticket = self._queued
+        with self._write_lock:
+            with self._lock:
+                if self._written >= ticket:
+                    return  # another thread wrote our operations along with its own
+                batch, self._pending = self._pending, []
+                written = self._queued
+            try:
+                with locked_file(self.path + '.lock'):
+                    lists = self._read()
+                    for op in batch:
+                        self._apply(lists, op)
+                    self._write(lists)
+                    key = self._stat_key()
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch
+                    self._file_key = None
+                raise
+            with self._lock:
+                for op in self._pending:
+                    self._apply(lists, op)
+                self._lists = lists
+                self._file_key = key
+                self._written = written
+
+
+favorites_store = FavoritesStore(PROJECTS_DIR, app.config['FAVORITES_PER_USER'])
+
+# ===================== Project catalog =====================
+class ProjectEntry:
+    __slots__ = ('name', 'mtime', 'size', 'favorite')
+
+    def __init__(self, name, mtime, size, favorite):
+        self.name = name
+        self.mtime = mtime
+        self.size = size
+        self.favorite = favorite
+
+    def to_dict(self):
+        return {'name': self.name, 'mtime': self.mtime, 'size': self.size, 'favorite': self.favorite}
+
+
+class ProjectCatalog:
+    """
+    Cached list of projects kept in two sorted orders: library order (favorites first, then by
+    name) and plain name order for search. The directory is only rescanned when its mtime
+    changes (projects created, renamed or deleted, also by other processes); the routes
+    that change projects update the catalog directly.
+    """
+
+    def __init__(self, projects_dir):
+        self.projects_dir = projects_dir
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._library_order = SortedList(key=lambda e: (not e.favorite, e.name.lower(), e.name))
+        self._name_order = SortedList(key=lambda e: e.name)
+        self._dir_mtime = None
+        self._favorites_mtime = None
+
+    def _stat_entry(self, name, favorite):
+        try:
+            st = os.stat(os.path.join(self.projects_dir, name, DOCUMENT_NAME))
+            return ProjectEntry(name, st.st_mtime, st.st_size, favorite)
+        except OSError:
+            return ProjectEntry(name, 0, 0, favorite)
+
+    def _add(self, entry):
+        self._entries[entry.name] = entry
+        self._library_order.add(entry)
+        self._name_order.add(entry)
+
+    def _remove(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._library_order.remove(entry)
+            self._name_order.remove(entry)
+        return entry
+
+    def _favorites_path(self):
+        return favorites_store.path
+
+    def _refresh(self):
+        try:
+            dir_mtime = os.stat(self.projects_dir).st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        try:
+            favorites_mtime = os.stat(self._favorites_path()).st_mtime_ns
+        except FileNotFoundError:
+            favorites_mtime = None
+
+        if favorites_mtime != self._favorites_mtime:
+            self._favorites_mtime = favorites_mtime
+            self._apply_favorites(favorites_store.shared())
+        if dir_mtime == self._dir_mtime:
+            return
+        self._dir_mtime = dir_mtime
+
+        names = set()
+        if dir_mtime is not None:
+            with os.scandir(self.projects_dir) as it:
+                names = {e.name for e in it if e.is_dir() and not e.name.startswith('.')}
+        for name in set(self._entries) - names:
+            self._remove(name)
+        if names - set(self._entries):
+            favorites = favorites_store.shared()
+            for name in names - set(self._entries):
+                self._add(self._stat_entry(name, name in favorites))
+
+    def _apply_favorites(self, favorites):
+        for entry in list(self._entries.values()):
+            if entry.favorite != (entry.name in favorites):
+                self._remove(entry.name)
+                entry.favorite = not entry.favorite
+                self._add(entry)
+
+    # --- queries ---
+    def library_page(self, allowed, start, count, favorites=None):
+        """
+        Entries in library order passing allowed(name); returns (page, has_more).
+        With per-user favorites, pass the user's set to put those first instead of the shared ones.
+        """
+        with self._lock:
+            self._refresh()
+            if favorites is None:
+                return self._page(self._library_order, allowed, start, count)
+            first = sorted((self._entries[name] for name in favorites if name in self._entries),
+                           key=lambda e: (e.name.lower(), e.name))
+            rest = (entry for entry in self._library_order if entry.name not in favorites)
+            return self._page(itertools.chain(first, rest), allowed, start, count)
+
+    def search(self, query, allowed, start, count):
+        """Entries in name order whose name contains query (case-insensitive)."""
+        with self._lock:
+            self._refresh()
+            return self._page(self._name_order, lambda name: query in name.lower() and allowed(name), start, count)[0]
+
+    @staticmethod
+    def _page(entries, allowed, start, count):
+        page, seen = [], 0
+        for entry in entries:
+            if not allowed(entry.name):
+                continue
+            if seen >= start + count:
+                return page, True
+            if seen >= start:
+                page.append(entry)
+            seen += 1
+        return page, False
+
+    def favorites(self):
+        with self._lock:
+            self._refresh()
+            return {name for name, entry in self._entries.items() if entry.favorite}
+
+    def names(self):
+        with self._lock:
+            self._refresh()
+            return list(self._entries)
+
+    # --- hooks for routes that change projects ---
+    def added(self, name):
+        with self._lock:
+            self._remove(name)
+            self._add(self._stat_entry(name, name in favorites_store.shared()))
+
+    def updated(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                fresh = self._stat_entry(name, entry.favorite)
+                entry.mtime, entry.size = fresh.mtime, fresh.size
+
+    def renamed(self, old_name, new_name):
+        with self._lock:
+            entry = self._remove(old_name)
+            self._remove(new_name)
+            favorite = entry.favorite if entry else False
+            self._add(self._stat_entry(new_name, favorite))
+
+    def removed(self, name):
+        with self._lock:
+            self._remove(name)
+
+    def set_favorite(self, name, favorite):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.favorite != favorite:
+                self._remove(name)
+                entry.favorite = favorite
+                self._add(entry)
+
+
+project_catalog = ProjectCatalog(PROJECTS_DIR)
+
+
+# ===================== Revisioned project store =====================
+# index.html is only rewritten as a full snapshot every SNAPSHOT_INTERVAL revisions.
+# In between, each save appends a small delta record to .revisions.log, and readers
+# get the document materialized from the snapshot plus the pending deltas.
+# With WORKSHOP_COMPRESS_DOCUMENTS=1 snapshots are written gzip-compressed (under the same
+# name); snapshots are recognised by their magic bytes, so plain and compressed ones can mix.
+DOCUMENT_NAME = 'index.html'
+REVISION_LOG_NAME = '.revisions.log'
+SNAPSHOT_INTERVAL = 50
+DOCUMENT_CACHE_SIZE = 64
+DOCUMENT_COMPRESSION_LEVEL = 6
+DOCUMENT_BLOCK_MIN_BYTES = 16 * 1024
+DOCUMENT_FIRST_SCREEN_BYTES = 64 * 1024
+DOCUMENT_BLOCK_BATCH_BYTES = 256 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+app.config.setdefault('COMPRESS_DOCUMENTS', os.environ.get('WORKSHOP_COMPRESS_DOCUMENTS') == '1')
+
+
+class RevisionConflict(Exception):
+    """The patch was made against a revision that is no longer current."""
+
+    def __init__(self, message, revision):
+        super().__init__(message)
+        self.revision = revision
+
+
+class _Document:
+    __slots__ = ('content', 'revision', 'snapshot_revision', 'pending', 'log_bytes', 'stamp',
+                 'stored', 'gzipped', 'blocks')
+
+
+# A run of top-level nodes of a document: [start, end) in code points, offset/length in UTF-8 bytes
+DocumentBlock = namedtuple('DocumentBlock', ['id', 'start', 'end', 'offset', 'length'])
+VOID_ELEMENTS = frozenset({'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                           'meta', 'param', 'source', 'track', 'wbr'})
+
+
+class _BlockSplitter(HTMLParser):
+    """Collects the offsets between the top-level nodes of an HTML fragment."""
+
+    def __init__(self, content):
+        super().__init__(convert_charrefs=False)
+        self.content = content
+        self.line_starts = [0] + [m.end() for m in re.finditer('\n', content)]
+        self.depth = 0
+        self.boundaries = []
+
+    def _position(self):
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if self.depth == 0:
+            start = self._position()
+            self.boundaries.append(start)
+            if tag in VOID_ELEMENTS:
+                self.boundaries.append(start + len(self.get_starttag_text()))
+        if tag not in VOID_ELEMENTS:
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self.depth == 0:
+            start = self._position()
+            self.boundaries += [start, start + len(self.get_starttag_text())]
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS or self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            self.boundaries.append(self.content.find('>', self._position()) + 1)
+
+
+def split_document_blocks(content, min_bytes=DOCUMENT_BLOCK_MIN_BYTES):
+    """
+    Splits content at top-level node boundaries into DocumentBlocks of at least min_bytes (except
+    the last). Concatenating the blocks gives back content, and every block is well-formed HTML
+    on its own as far as the document is.
+    """
+    points = []
+    if len(content.encode('utf-8')) >= min_bytes:
+        splitter = _BlockSplitter(content)
+        try:
+            splitter.feed(content)
+            splitter.close()
+            points = sorted({p for p in splitter.boundaries if 0 < p < len(content)})
+        except Exception:
+            pass
+    blocks = []
+    start = offset = size = 0
+    previous = 0
+    for point in points + [len(content)]:
+        size += len(content[previous:point].encode('utf-8'))
+        previous = point
+        if size >= min_bytes or point == len(content):
+            if point > start:
+                block_id = hashlib.sha1(content[start:point].encode('utf-8')).hexdigest()[:12]
+                blocks.append(DocumentBlock(block_id, start, point, offset, size))
+            start, offset, size = point, offset + size, 0
+    return blocks
+
+
+def apply_text_ops(content, ops):
+    """
+    Apply a list of [start, end, text] splices (code point offsets) to content.
+    Each op is applied to the result of the previous one.
+    """
+    if not isinstance(ops, list):
+        raise ValueError('Patch must be a list of operations')
+    for op in ops:
+        if not isinstance(op, (list, tuple)) or len(op) != 3:
+            raise ValueError('Each operation must be [start, end, text]')
+        start, end, text = op
+        if not isinstance(start, int) or not isinstance(end, int) or not isinstance(text, str):
+            raise ValueError('Invalid operation types')
+        if start < 0 or end < start or end > len(content):
+            raise ValueError('Operation is out of bounds')
+        content = content[:start] + text + content[end:]
+    return content
+
+
+class ProjectStore:
+    """
+    Storage engine for project documents.
+    Keeps recently used documents materialized in memory (LRU) and notices changes
+    made by other processes through the size/mtime of the snapshot and the log.
+    """
+
+    def __init__(self, projects_dir, snapshot_interval=SNAPSHOT_INTERVAL, cache_size=DOCUMENT_CACHE_SIZE,
+                 compress=False):
+        self.projects_dir = projects_dir
+        self.snapshot_interval = snapshot_interval
+        self.cache_size = cache_size
+        self.compress = compress
+        self._docs = OrderedDict()
+        self._lock = threading.RLock()
+
+    # --- paths ---
+    def document_path(self, project_name):
+        return os.path.join(self.projects_dir, project_name, DOCUMENT_NAME)
+
+    def _log_path(self, project_name):
+        return os.path.join(self.projects_dir, project_name, REVISION_LOG_NAME)
+
+    def project_from_path(self, path):
+        """Returns the project name if path is a project's index.html, otherwise None."""
+        path = os.path.abspath(path)
+        if os.path.basename(path) != DOCUMENT_NAME:
+            return None
+        project_dir = os.path.dirname(path)
+        if os.path.dirname(project_dir) != os.path.abspath(self.projects_dir):
+            return None
+        return os.path.basename(project_dir)
+
+    def _stamp(self, project_name):
+        st = os.stat(self.document_path(project_name))
+        try:
+            log_st = os.stat(self._log_path(project_name))
+            log_stamp = (log_st.st_mtime_ns, log_st.st_size)
+        except FileNotFoundError:
+            log_stamp = None
+        return (st.st_mtime_ns, st.st_size, log_stamp)
+
+    # --- loading ---
+    def _load(self, project_name):
+        stamp = self._stamp(project_name)
+        doc = self._docs.get(project_name)
+        if doc is not None and doc.stamp == stamp:
+            self._docs.move_to_end(project_name)
+            return doc
+
+        with open(self.document_path(project_name), 'rb') as f:
+            stored = f.read()
+        if stored.startswith(GZIP_MAGIC):
+            content = gzip.decompress(stored).decode('utf-8')
+        else:
+            content, stored = stored.decode('utf-8'), None
+        snapshot_revision, revision, pending, log_bytes = 0, 0, 0, 0
+        try:
+            with open(self._log_path(project_name), 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            lines = []
+        if lines and lines[0]:
+            try:
+                header = json.loads(lines[0])
+                snapshot_revision = revision = int(header['snapshot'])
+                snapshot_size = header.get('size')
+            except (ValueError, KeyError, TypeError):
+                header, snapshot_size = None, None
+            # The log only applies to the snapshot it was started for
+            if header is not None and snapshot_size == stamp[1] and len(lines) > 1:
+                log_bytes = len(lines[0]) + 1
+                # The last piece has no newline: a torn (or still running) append, never applied
+                for line in lines[1:-1]:
+                    if line:
+                        try:
+                            record = json.loads(line)
+                            content, revision = apply_text_ops(content, record['ops']), int(record['rev'])
+                        except (ValueError, KeyError, TypeError):
+                            self._quarantine_log(project_name, revision)
+                            break
+                        pending += 1
+                    log_bytes += len(line) + 1
+
+        doc = _Document()
+        doc.content = content
+        doc.revision = revision
+        doc.snapshot_revision = snapshot_revision
+        doc.pending = pending
+        doc.log_bytes = log_bytes
+        doc.stamp = stamp
+        doc.stored = stored
+        doc.gzipped = None
+        doc.blocks = None
+        self._docs[project_name] = doc
+        while len(self._docs) > self.cache_size:
+            self._docs.popitem(last=False)
+        return doc
+
+    def _quarantine_log(self, project_name, revision):
+        """Keeps a copy of a log with an unreadable record; the next save cuts the log off there."""
+        log_path = self._log_path(project_name)
+        quarantine_path = f'{log_path}.{revision}.corrupt'
+        app.logger.error("Revision log of %s is damaged after revision %s, later records are ignored "
+                         "(copy kept in %s)", project_name, revision, quarantine_path)
+        if not os.path.exists(quarantine_path):
+            shutil.copyfile(log_path, quarantine_path)
+
+    # --- writing ---
+    def _write_snapshot(self, project_name, doc):
+        """Writes the materialized content as a new snapshot and starts a fresh log."""
+        document_path = self.document_path(project_name)
+        tmp_path = document_path + '.tmp'
+        data = doc.content.encode('utf-8')
+        doc.stored = gzip.compress(data, DOCUMENT_COMPRESSION_LEVEL, mtime=0) if self.compress else None
+        doc.gzipped = None
+        doc.blocks = None
+        with open(tmp_path, 'wb') as f:
+            f.write(doc.stored or data)
+        os.replace(tmp_path, document_path)
+        self._reset_log(project_name, doc)
+
+    def _reset_log(self, project_name, doc):
+        size = os.path.getsize(self.document_path(project_name))
+        header = json.dumps({'snapshot': doc.revision, 'size': size}) + '\n'
+        log_path = self._log_path(project_name)
+        with open(log_path + '.tmp', 'w', encoding='utf-8', newline='') as f:
+            f.write(header)
+        os.replace(log_path + '.tmp', log_path)
+        doc.snapshot_revision = doc.revision
+        doc.pending = 0
+        doc.log_bytes = len(header)
+        doc.stamp = self._stamp(project_name)
+
+    def read(self, project_name):
+        """Returns (content, revision) of the current document."""
+        with self._lock:
+            doc = self._load(project_name)
+            return doc.content, doc.revision
+
+    def read_gzip(self, project_name):
+        """
+        Returns (gzip bytes, revision) of the current document. A compressed snapshot with no
+        pending deltas is returned exactly as stored; otherwise the content is compressed once
+        per revision and kept with the cached document.
+        """
+        with self._lock:
+            doc = self._load(project_name)
+            if doc.pending == 0 and doc.stored is not None:
+                return doc.stored, doc.revision
+            if doc.gzipped is not None:
+                return doc.gzipped, doc.revision
+            content, revision = doc.content, doc.revision
+        gzipped = gzip.compress(content.encode('utf-8'), DOCUMENT_COMPRESSION_LEVEL, mtime=0)
+        with self._lock:
+            if doc.revision == revision and doc.content is content:
+                doc.gzipped = gzipped
+        return gzipped, revision
+
+    def blocks(self, project_name):
+        """Returns (content, revision, blocks) of the current document; blocks are split once per revision."""
+        with self._lock:
+            doc = self._load(project_name)
+            content, revision, blocks = doc.content, doc.revision, doc.blocks
+        if blocks is None:
+            blocks = split_document_blocks(content)
+            with self._lock:
+                if doc.content is content:
+                    doc.blocks = blocks
+        return content, revision, blocks
+
+    def revision(self, project_name):
+        with self._lock:
+            return self._load(project_name).revision
+
+    def stamp(self, project_name):
+        """Like version(), but from the files' metadata alone, without loading the document."""
+        return self._stamp(project_name)
+
+    def version(self, project_name):
+        """A value that changes whenever the document does (also through other processes)."""
+        with self._lock:
+            doc = self._load(project_name)
+            return (doc.revision,) + doc.stamp
+
+    def apply_patch(self, project_name, base_revision, ops, expected_length=None):
+        """
+        Applies ops to the document if base_revision is current and returns the new revision.
+        Raises RevisionConflict if the base is outdated or the result has an unexpected length.
+        """
+        with self._lock:
+            doc = self._load(project_name)
+            if base_revision != doc.revision:
+                raise RevisionConflict('The document has changed since it was loaded', doc.revision)
+            content = apply_text_ops(doc.content, ops)
+            if expected_length is not None and len(content) != expected_length:
+                raise RevisionConflict('Patch result does not match the expected length', doc.revision)
+            if not doc.log_bytes:
+                # No log for this snapshot yet (e.g. a project saved before revisions existed)
+                self._reset_log(project_name, doc)
+
+            doc.content = content
+            doc.gzipped = None
+            doc.blocks = None
+            doc.revision += 1
+            record = json.dumps({'rev': doc.revision, 'ops': ops}, ensure_ascii=False) + '\n'
+            record_bytes = len(record.encode('utf-8'))
+            # Snapshot when enough deltas piled up, or when replaying the log would cost
+            # more than reading a fresh snapshot
+            if (doc.pending + 1 >= self.snapshot_interval
+                    or doc.log_bytes + record_bytes > doc.stamp[1]):
+                self._write_snapshot(project_name, doc)
+            else:
+                if doc.stamp[2][1] != doc.log_bytes:
+                    # Cut off a torn or damaged tail, so the record does not land behind it
+                    os.truncate(self._log_path(project_name), doc.log_bytes)
+                with open(self._log_path(project_name), 'a', encoding='utf-8', newline='') as f:
+                    f.write(record)
+                doc.pending += 1
+                doc.log_bytes += record_bytes
+                doc.stamp = self._stamp(project_name)
+            return doc.revision
+
+    def write(self, project_name, content):
+        """Replaces the whole document with content and returns the new revision."""
+        with self._lock:
+            try:
+                doc = self._load(project_name)
+            except FileNotFoundError:
+                doc = None
+            revision = doc.revision + 1 if doc else 0
+            project_dir = os.path.join(self.projects_dir, project_name)
+            os.makedirs(project_dir, exist_ok=True)
+            doc = doc or _Document()
+            doc.content = content
+            doc.revision = revision
+            self._write_snapshot(project_name, doc)
+            self._docs[project_name] = doc
+            return revision
+
+    def write_chunk(self, project_name, chunk_number, total_chunks, content):
+        """
+        Receives one chunk of a full save. Chunks are collected in a side file which
+        replaces the snapshot atomically once the last chunk arrives.
+        Returns the new revision after the last chunk, otherwise None.
+        """
+        if total_chunks <= 1:
+            return self.write(project_name, content)
+        with self._lock:
+            project_dir = os.path.join(self.projects_dir, project_name)
+            os.makedirs(project_dir, exist_ok=True)
+            part_path = self.document_path(project_name) + '.part'
+            mode = 'w' if chunk_number == 1 else 'a'
+            with open(part_path, mode, encoding='utf-8', newline='') as f:
+                f.write(content)
+            if chunk_number != total_chunks:
+                return None
+
+            try:
+                revision = self._load(project_name).revision + 1
+            except FileNotFoundError:
+                revision = 0
+            if self.compress:
+                tmp_path = self.document_path(project_name) + '.tmp'
+                with open(part_path, 'rb') as src, open(tmp_path, 'wb') as raw, \
+                        gzip.GzipFile(filename='', fileobj=raw, mode='wb',
+                                      compresslevel=DOCUMENT_COMPRESSION_LEVEL, mtime=0) as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(tmp_path, self.document_path(project_name))
+                os.remove(part_path)
+            else:
+                os.replace(part_path, self.document_path(project_name))
+            self._docs.pop(project_name, None)
+            doc = _Document()
+            doc.revision = revision
+            self._reset_log(project_name, doc)
+            return revision
+
+    def forget(self, project_name):
+        """Drops the cached document (after rename or delete)."""
+        with self._lock:
+            self._docs.pop(project_name, None)
+
+
+project_store = ProjectStore(PROJECTS_DIR, compress=app.config['COMPRESS_DOCUMENTS'])
+
+
+def read_document(path):
+    """Reads an index.html by absolute path, going through the project store when possible."""
+    project_name = project_store.project_from_path(path)
+    if project_name is not None:
+        return project_store.read(project_name)[0]
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
 
 # ===================== API for working with projects =====================
 
+PROJECT_NAME_PATTERN = re.compile(r'^[a-zA-Zа-яА-ЯёЁ0-9_ \-]+$')
+
+
+def is_project_name(name):
+    """True if name can only refer to a project directory, not to .uploads, .trash or a path below them."""
+    return bool(name) and not name.startswith('.') and not any(c in name for c in '/\\\0')
+
 # Only for users with "user" and "admin" roles (viewer does not have access)
 @app.route('/rename_project', methods=['POST'])
 @login_required
@@ -104,7 +902,9 @@ def rename_project():
     new_name = request.form.get('new_name')
     if not old_name or not new_name:
         return jsonify({'success': False, 'error': 'Both names are required'}), 400
-    if not re.match(r'^[a-zA-Zа-яА-ЯёЁ0-9_ \-]+$', new_name):
+    if not is_project_name(old_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
+    if not PROJECT_NAME_PATTERN.match(new_name):
         return jsonify({
             'success': False,
             'error': 'Invalid characters. Allowed: letters, numbers, spaces, - and _'
@@ -117,10 +917,15 @@ def rename_project():
         return jsonify({'success': False, 'error': 'A project with this name already exists'}), 409
     try:
         os.rename(old_path, new_path)
-        # Updating the favorites list
-        favorites = load_favorites()
-        updated_favorites = [new_name if name == old_name else name for name in favorites]
-        save_favorites(updated_favorites)
+        project_store.forget(old_name)
+        lease_manager.forget(old_name)
+        # Visibility records are keyed by the project path
+        ProjectVisibility.query.filter_by(project_path=old_path).update({'project_path': new_path})
+        db.session.commit()
+        acl_index.rename_project(old_path, new_path)
+        project_catalog.renamed(old_name, new_name)
+        content_index.rename_project(old_name, new_name)
+        favorites_store.renamed(old_name, new_name)
         return jsonify({'success': True, 'new_name': new_name})
     except Exception as e:
         return jsonify({'success': False, 'error': f'Server error: {str(e)}'}), 500
@@ -134,21 +939,19 @@ def favorite_project():
     action = request.form.get('action')
     if not project_name or action not in ['add', 'remove']:
         return jsonify({'success': False, 'error': 'Invalid parameters'})
-    favorites = load_favorites()
-    if action == 'add':
-        if project_name not in favorites:
-            favorites.append(project_name)
-    elif action == 'remove':
-        if project_name in favorites:
-            favorites.remove(project_name)
-    save_favorites(favorites)
-    return jsonify({'success': True, 'favorites': favorites})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
+    favorite = action == 'add'
+    favorites_store.set_favorite(current_user, project_name, favorite)
+    if not favorites_store.per_user:
+        project_catalog.set_favorite(project_name, favorite)
+    return jsonify({'success': True, 'favorites': favorites_store.get(current_user)})
 
 # No role restrictions (viewing favorites)
 @app.route('/load_favorites', methods=['GET'])
 @login_required
 def load_favorites_route():
-    return jsonify({'success': True, 'favorites': load_favorites()})
+    return jsonify({'success': True, 'favorites': favorites_store.get(current_user)})
 
 # Deleting projects – only for **admin**
 @app.route('/delete_project', methods=['POST'])
@@ -158,16 +961,21 @@ def delete_project():
     project_name = request.form.get('project_name')
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
     project_path = os.path.join(PROJECTS_DIR, project_name)
     if not os.path.exists(project_path):
         return jsonify({'success': False, 'error': 'Project not found'})
     try:
-        shutil.rmtree(project_path)
-        # Updating favorites
-        favorites = load_favorites()
-        if project_name in favorites:
-            favorites.remove(project_name)
-            save_favorites(favorites)
+        blob_store.remove_tree(project_path)
+        project_store.forget(project_name)
+        lease_manager.forget(project_name)
+        ProjectVisibility.query.filter_by(project_path=project_path).delete()
+        db.session.commit()
+        acl_index.remove_project(project_path)
+        project_catalog.removed(project_name)
+        content_index.remove_project(project_name)
+        favorites_store.removed(project_name)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -206,6 +1014,9 @@ def create_project():
 </body>
 </html>""")
 
+        project_catalog.added(project_name)
+        content_index.schedule(project_name)
+
         # Return the project name to the frontend so it can be opened
         return jsonify({'success': True, 'project': project_name})
     
@@ -213,36 +1024,815 @@ def create_project():
         # If something went wrong — return an error
         return jsonify({'success': False, 'error': str(e)})
 
-# Global dictionary for storing information on project editing
-active_project_edits = {}
+# ===================== Batch operations =====================
+# POST /batch applies a list of operations as one unit: every operation is checked first, the
+# database changes go into a single transaction, favorites are written once, and renamed or
+# deleted directories are moved back if the commit fails. Deleted projects are first moved to
+# a trash directory and only removed from disk once the commit succeeded.
+BATCH_MAX_OPERATIONS = 500
+BATCH_TRASH_DIR = os.path.join(PROJECTS_DIR, '.trash')
+
+
+class BatchError(Exception):
+    pass
+
+
+class ProjectBatch:
+    def __init__(self, user):
+        self.user = user
+        self._favorite_ops = []
+        self._favorites = {}    # project name -> favorite after the operations so far
+        self._exists = {}       # project name -> existence after the operations so far
+        self._moves = []        # (source, target) directory renames, applied in order
+        self._trash = []        # trash paths removed after the commit
+        self._hooks = []        # cache updates run after the commit
+
+    # --- state as seen by later operations ---
+    def exists(self, name):
+        if name not in self._exists:
+            self._exists[name] = os.path.isdir(os.path.join(PROJECTS_DIR, name))
+        return self._exists[name]
+
+    def is_favorite(self, name):
+        if name not in self._favorites:
+            self._favorites[name] = favorites_store.contains(self.user, name)
+        return self._favorites[name]
+
+    def _project(self, op, key='project_name'):
+        name = op.get(key)
+        if not isinstance(name, str) or not name:
+            raise BatchError(f'{key} required')
+        if not is_project_name(name):
+            raise BatchError('Invalid project name')
+        if not self.exists(name):
+            raise BatchError(f'Project {name} not found')
+        return name
+
+    # --- operations ---
+    def grant(self, op):
+        project_file = os.path.join(PROJECTS_DIR, self._project(op))
+        role = op.get('role')
+        user_id = op.get('user_id')
+        if role not in ['viewer', 'user', 'admin']:
+            raise BatchError('Invalid role')
+        if user_id:
+            user = db.session.get(User, user_id)
+            if not user:
+                raise BatchError('User not found')
+            if ProjectVisibility.query.filter_by(project_path=project_file, role=role, user_id=user.id).first():
+                raise BatchError('Such access is already assigned')
+            db.session.add(ProjectVisibility(project_path=project_file, role=role, user=user))
+            self._hooks.append(lambda: acl_index.add_grant(project_file, role, user.id))
+            return {'message': 'Individual access added'}
+        ProjectVisibility.query.filter_by(project_path=project_file, user_id=None).delete()
+        db.session.add(ProjectVisibility(project_path=project_file, role=role, user=None))
+        self._hooks.append(lambda: acl_index.set_role_grant(project_file, role))
+        return {'message': 'Role-based visibility updated'}
+
+    def revoke(self, op):
+        project_file = os.path.join(PROJECTS_DIR, self._project(op))
+        vis = ProjectVisibility.query.filter_by(
+            project_path=project_file, role=op.get('role'), user_id=op.get('user_id')).first()
+        if not vis:
+            raise BatchError('Such access not found')
+        role, user_id = vis.role, vis.user_id
+        db.session.delete(vis)
+        self._hooks.append(lambda: acl_index.remove_grant(project_file, role, user_id))
+        return {'message': 'Access removed'}
+
+    def favorite(self, op):
+        name = op.get('project_name')
+        action = op.get('action')
+        if not isinstance(name, str) or not name or action not in ['add', 'remove']:
+            raise BatchError('Invalid parameters')
+        if not is_project_name(name):
+            raise BatchError('Invalid project name')
+        favorite = action == 'add'
+        if favorite != self.is_favorite(name):
+            self._favorites[name] = favorite
+            self._favorite_ops.append(favorites_store.add_op(self.user, name) if favorite
+                                      else favorites_store.remove_op(self.user, name))
+            if not favorites_store.per_user:
+                self._hooks.append(lambda: project_catalog.set_favorite(name, favorite))
+        return {'favorite': favorite}
+
+    def delete(self, op):
+        if self.user.role != 'admin':
+            raise BatchError('Only admins can delete projects')
+        name = self._project(op)
+        project_path = os.path.join(PROJECTS_DIR, name)
+        trash_path = os.path.join(BATCH_TRASH_DIR, f'{os.getpid()}-{time.time_ns()}-{len(self._moves)}')
+        self._moves.append((project_path, trash_path))
+        self._trash.append(trash_path)
+        self._exists[name] = False
+        ProjectVisibility.query.filter_by(project_path=project_path).delete()
+        self._favorites[name] = False
+        self._favorite_ops.append(favorites_store.discard_op(name))
+
+        def forget():
+            project_store.forget(name)
+            lease_manager.forget(name)
+            acl_index.remove_project(project_path)
+            project_catalog.removed(name)
+            content_index.remove_project(name)
+        self._hooks.append(forget)
+        return {}
+
+    def rename(self, op):
+        old_name = self._project(op, 'old_name')
+        new_name = op.get('new_name')
+        if not isinstance(new_name, str) or not PROJECT_NAME_PATTERN.match(new_name):
+            raise BatchError('Invalid characters. Allowed: letters, numbers, spaces, - and _')
+        if self.exists(new_name):
+            raise BatchError('A project with this name already exists')
+        old_path = os.path.join(PROJECTS_DIR, old_name)
+        new_path = os.path.join(PROJECTS_DIR, new_name)
+        self._moves.append((old_path, new_path))
+        self._exists[old_name] = False
+        self._exists[new_name] = True
+        ProjectVisibility.query.filter_by(project_path=old_path).update({'project_path': new_path})
+        self._favorites[new_name] = self.is_favorite(old_name)
+        self._favorites[old_name] = False
+        self._favorite_ops.append(favorites_store.rename_op(old_name, new_name))
+
+        def moved():
+            project_store.forget(old_name)
+            lease_manager.forget(old_name)
+            acl_index.rename_project(old_path, new_path)
+            project_catalog.renamed(old_name, new_name)
+            content_index.rename_project(old_name, new_name)
+        self._hooks.append(moved)
+        return {'new_name': new_name}
+
+    OPERATIONS = {'grant': grant, 'revoke': revoke, 'favorite': favorite, 'delete': delete, 'rename': rename}
+
+    # --- execution ---
+    def run(self, operations):
+        """Returns (applied, results); nothing is applied unless every operation is valid."""
+        results = []
+        failed = False
+        try:
+            for op in operations:
+                handler = self.OPERATIONS.get(op.get('op')) if isinstance(op, dict) else None
+                if handler is None:
+                    results.append({'success': False, 'error': 'Unknown operation'})
+                    failed = True
+                    continue
+                # Operations validate before they stage anything, so a rejected one leaves no partial rows
+                try:
+                    results.append({'success': True, **handler(self, op)})
+                except BatchError as e:
+                    results.append({'success': False, 'error': str(e)})
+                    failed = True
+            if failed:
+                db.session.rollback()
+                return False, results
+            self._commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for hook in self._hooks:
+            hook()
+        for trash_path in self._trash:
+            blob_store.remove_tree(trash_path, ignore_errors=True)
+        return True, results
+
+    def _commit(self):
+        done = []
+        try:
+            for source, target in self._moves:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(source, target)
+                done.append((source, target))
+            db.session.commit()
+        except Exception:
+            for source, target in reversed(done):
+                os.rename(target, source)
+            raise
+        favorites_store.update(self._favorite_ops)
+
+
+@app.route('/batch', methods=['POST'])
+@login_required
+@roles_required("user", "admin")
+def batch_operations():
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'Operations list required'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    try:
+        applied, results = ProjectBatch(current_user).run(operations)
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Server error: {str(e)}'}), 500
+    if not applied:
+        return jsonify({'success': False, 'error': 'Batch rejected, nothing was applied', 'results': results}), 400
+    return jsonify({'success': True, 'results': results})
+
+
+# ===================== Edit leases =====================
+# Who is editing a project and who is waiting. The lease state lives in a pluggable
+# backend: "memory" for a single process, "sqlite" (WAL) to share it between worker processes.
 EDIT_TIMEOUT = timedelta(seconds=30)
+LEASE_REAPER_INTERVAL = 2  # seconds
 
-def can_user_edit_project(user, project_name):
-    project_path = os.path.join(PROJECTS_DIR, project_name)
-    visibilities = ProjectVisibility.query.filter_by(project_path=project_path).all()
+# Edit-lock events pushed to /edit_events subscribers
+EDIT_STREAM_TICK = 5  # seconds between keepalives (and lease refreshes) on an open stream
+EDIT_DISCONNECT_GRACE = timedelta(seconds=10)  # time to reconnect before a dropped stream loses its place
+# Every open stream holds a server thread. A process serves at most EDIT_STREAM_LIMIT of them and
+# answers 503 beyond that, so the client falls back to /heartbeat polling. `serve` derives the
+# limit from --threads, keeping EDIT_STREAM_RESERVED_THREADS (or a quarter) for other routes.
+EDIT_STREAM_RESERVED_THREADS = 8
+app.config.setdefault('EDIT_STREAM_LIMIT', int(os.environ['WORKSHOP_EDIT_STREAM_LIMIT'])
+                      if os.environ.get('WORKSHOP_EDIT_STREAM_LIMIT') else None)
 
-    # admin can always edit
-    if user.role == 'admin':
-        return True
 
-    # if there are no records — user can edit
-    if not visibilities and user.role == 'user':
-        return True
+def edit_stream_limit(threads):
+    return max(threads - max(EDIT_STREAM_RESERVED_THREADS, threads // 4), 0)
 
-    # if the user is explicitly mentioned — they can edit
-    if any(v.user_id == user.id for v in visibilities):
-        return True
+app.config.setdefault('EDIT_LEASE_BACKEND', os.environ.get('WORKSHOP_LEASE_BACKEND', 'memory'))
+app.config.setdefault('EDIT_LEASE_DB', os.environ.get('WORKSHOP_LEASE_DB', os.path.join(app.instance_path, 'edit_leases.db')))
+
+
+class EditEventBus:
+    """Fan-out of edit-lock events to the streams subscribed to a project."""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, project_name):
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers[project_name].add(q)
+        return q
+
+    def unsubscribe(self, project_name, q):
+        with self._lock:
+            subscribers = self._subscribers.get(project_name)
+            if subscribers is not None:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[project_name]
+
+    def projects(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, project_name, event, **data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(project_name, ()))
+        for q in subscribers:
+            q.put((event, data))
+
+
+edit_events = EditEventBus()
+
+
+class WaitingQueue(OrderedDict):
+    """
+    The editing queue (user -> last heartbeat, in arrival order). Counts joins and departures so
+    that heartbeat-only updates are cheap to tell apart, and caches queue positions between them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.changes = 0
+        self._positions = None
+        super().__init__(*args, **kwargs)
+
+    def _changed(self):
+        self.changes += 1
+        self._positions = None
 
-    # if there is an admin among the records — user cannot edit
-    if any(v.role == 'admin' for v in visibilities):
-        return False
+    def __setitem__(self, user, heartbeat):
+        if user not in self:
+            self.changes += 1
+            if self._positions is not None:
+                self._positions[user] = len(self) + 1  # joins go to the end
+        super().__setitem__(user, heartbeat)
 
-    # if there is a user or viewer — user can edit
-    if user.role == 'user':
-        if any(v.user_id is None and v.role in ['user', 'viewer'] for v in visibilities):
+    def __delitem__(self, user):
+        self._changed()
+        super().__delitem__(user)
+
+    def popitem(self, last=True):
+        self._changed()
+        return super().popitem(last)
+
+    def position(self, user):
+        """1-based place of user in the queue, or None."""
+        if self._positions is None:
+            self._positions = {name: index for index, name in enumerate(self, 1)}
+        return self._positions.get(user)
+
+
+class EditLease:
+    """Lease of one project: the editor and the queue (user -> last heartbeat, in arrival order)."""
+    __slots__ = ('editor', 'last_heartbeat', 'waiting')
+
+    def __init__(self, editor, last_heartbeat, waiting=None):
+        self.editor = editor
+        self.last_heartbeat = last_heartbeat
+        self.waiting = waiting if waiting is not None else WaitingQueue()
+
+    def shape(self):
+        """Everything except heartbeats; a change here is worth telling subscribers about."""
+        return (self.editor, id(self.waiting), self.waiting.changes)
+
+    def snapshot(self):
+        return (self.editor, self.last_heartbeat, tuple(self.waiting.items()))
+
+
+class LeaseTransaction:
+    """Handed out by a backend: modify .lease (or set it to None to drop it) and queue events."""
+    __slots__ = ('lease', 'events')
+
+    def __init__(self, lease):
+        self.lease = lease
+        self.events = []
+
+
+class InProcessLeaseBackend:
+    """Leases in a dict guarded by a lock. Only correct when a single process serves the app."""
+
+    def __init__(self):
+        self._leases = {}
+        self._versions = defaultdict(int)
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def transaction(self, project_name, readonly=False):
+        with self._lock:
+            lease = self._leases.get(project_name)
+            before = lease.shape() if lease else None
+            txn = LeaseTransaction(lease)
+            yield txn
+            if txn.lease is None:
+                self._leases.pop(project_name, None)
+            else:
+                self._leases[project_name] = txn.lease
+            if (txn.lease.shape() if txn.lease else None) != before:
+                self._versions[project_name] += 1
+
+    def projects(self):
+        with self._lock:
+            return list(self._leases)
+
+    def version(self, project_name):
+        with self._lock:
+            return self._versions[project_name]
+
+    def queue_lengths(self):
+        with self._lock:
+            return {name: len(lease.waiting) for name, lease in self._leases.items()}
+
+
+class SQLiteLeaseBackend:
+    """
+    Leases in a SQLite database in WAL mode, shared by all worker processes on the host.
+    Each transaction takes the write lock (BEGIN IMMEDIATE), so read-modify-write is atomic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute("""CREATE TABLE IF NOT EXISTS edit_lease (
+            project TEXT PRIMARY KEY, editor TEXT NOT NULL, last_heartbeat REAL NOT NULL)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS edit_waiter (
+            project TEXT NOT NULL, user TEXT NOT NULL, seq INTEGER NOT NULL,
+            last_heartbeat REAL NOT NULL, PRIMARY KEY (project, user))""")
+        conn.execute("CREATE TABLE IF NOT EXISTS edit_version (project TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, project_name, readonly=False):
+        conn = self._connection()
+        conn.execute('BEGIN' if readonly else 'BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT editor, last_heartbeat FROM edit_lease WHERE project = ?',
+                               (project_name,)).fetchone()
+            lease = None
+            next_seq = 0
+            if row:
+                waiting = WaitingQueue()
+                for user, hb, seq in conn.execute(
+                        'SELECT user, last_heartbeat, seq FROM edit_waiter WHERE project = ? ORDER BY seq',
+                        (project_name,)):
+                    waiting[user] = hb
+                    next_seq = seq + 1
+                lease = EditLease(row[0], row[1], waiting)
+            before = lease.snapshot() if lease else None
+            before_shape = lease.shape() if lease else None
+            txn = LeaseTransaction(lease)
+            yield txn
+
+            after = txn.lease.snapshot() if txn.lease else None
+            if readonly or after == before:
+                conn.execute('COMMIT')
+                return
+            if txn.lease is None:
+                conn.execute('DELETE FROM edit_waiter WHERE project = ?', (project_name,))
+                conn.execute('DELETE FROM edit_lease WHERE project = ?', (project_name,))
+            else:
+                if before is None or before[:2] != after[:2]:
+                    conn.execute('INSERT OR REPLACE INTO edit_lease (project, editor, last_heartbeat) VALUES (?, ?, ?)',
+                                 (project_name, txn.lease.editor, txn.lease.last_heartbeat))
+                self._write_waiters(conn, project_name, dict(before[2]) if before else {},
+                                    txn.lease.waiting, next_seq)
+            if (txn.lease.shape() if txn.lease else None) != before_shape:
+                conn.execute("""INSERT INTO edit_version (project, version) VALUES (?, 1)
+                    ON CONFLICT(project) DO UPDATE SET version = version + 1""", (project_name,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _write_waiters(conn, project_name, before, waiting, next_seq):
+        """Writes only the queue rows that changed; new waiters go to the end of the queue."""
+        kept = [user for user in before if user in waiting]
+        if list(itertools.islice(waiting, len(kept))) != kept:
+            # Someone left and rejoined within the transaction: renumber the whole queue
+            conn.execute('DELETE FROM edit_waiter WHERE project = ?', (project_name,))
+            before = {}
+        gone = [(project_name, user) for user in before if user not in waiting]
+        if gone:
+            conn.executemany('DELETE FROM edit_waiter WHERE project = ? AND user = ?', gone)
+        for user, hb in waiting.items():
+            if user not in before:
+                conn.execute('INSERT OR REPLACE INTO edit_waiter (project, user, seq, last_heartbeat) VALUES (?, ?, ?, ?)',
+                             (project_name, user, next_seq, hb))
+                next_seq += 1
+            elif before[user] != hb:
+                conn.execute('UPDATE edit_waiter SET last_heartbeat = ? WHERE project = ? AND user = ?',
+                             (hb, project_name, user))
+
+    def projects(self):
+        return [row[0] for row in self._connection().execute('SELECT project FROM edit_lease')]
+
+    def version(self, project_name):
+        row = self._connection().execute('SELECT version FROM edit_version WHERE project = ?',
+                                         (project_name,)).fetchone()
+        return row[0] if row else 0
+
+    def queue_lengths(self):
+        conn = self._connection()
+        lengths = {row[0]: 0 for row in conn.execute('SELECT project FROM edit_lease')}
+        for project, count in conn.execute('SELECT project, COUNT(*) FROM edit_waiter GROUP BY project'):
+            lengths[project] = count
+        return lengths
+
+
+LEASE_BACKENDS = {
+    'memory': lambda: InProcessLeaseBackend(),
+    'sqlite': lambda: SQLiteLeaseBackend(app.config['EDIT_LEASE_DB']),
+}
+
+
+class LeaseManager:
+    """The edit-lock rules, applied atomically through the configured backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.timeout = EDIT_TIMEOUT.total_seconds()
+
+    @contextmanager
+    def _transaction(self, project_name, readonly=False):
+        with self.backend.transaction(project_name, readonly) as txn:
+            yield txn
+        for event, data in txn.events:
+            edit_events.publish(project_name, event, **data)
+
+    def _promote_next_editor(self, txn, now, fallback=None):
+        """Hands the lock over after the editor timed out or left. Returns the new editor."""
+        lease = txn.lease
+        previous = lease.editor
+        new_editor = fallback
+        while lease.waiting:
+            user, hb = lease.waiting.popitem(last=False)
+            if now - hb < self.timeout:  # skip waiters the reaper has not pruned yet
+                new_editor = user
+                break
+        if new_editor is None:
+            return None
+        lease.editor = new_editor
+        lease.last_heartbeat = now
+        if new_editor != previous:
+            txn.events.append(('editor_left', {'editor': previous}))
+            txn.events.append(('handover', {'editor': new_editor}))
+        return new_editor
+
+    def _prune_waiting(self, txn, now):
+        waiting = txn.lease.waiting
+        expired = [user for user, hb in waiting.items() if now - hb >= self.timeout]
+        for user in expired:
+            del waiting[user]
+        if expired:
+            txn.events.append(('queue', {}))
+
+    @staticmethod
+    def _state(lease, username, notify=False, became_editor_after_queue=False):
+        editor = lease.editor if lease else None
+        position = lease.waiting.position(username) if lease else None
+        return {
+            'success': True,
+            'can_edit': editor is not None and editor == username,
+            'editor': editor,
+            'notify': notify,
+            'in_queue': position is not None,
+            'queue_position': position,
+            'became_editor_after_queue': became_editor_after_queue
+        }
+
+    def state(self, project_name, username):
+        with self._transaction(project_name, readonly=True) as txn:
+            return self._state(txn.lease, username)
+
+    def touch(self, project_name, username, create=True):
+        """
+        Registers activity of a user who has edit rights: takes the lock if it is free or expired,
+        otherwise keeps the user in the editing queue.
+        Returns the state for the user, or None if there is no lease and create is False.
+        """
+        now = time.time()
+        with self._transaction(project_name) as txn:
+            if txn.lease is None:
+                if not create:
+                    return None
+                # No active editor — we become one immediately, without a queue
+                txn.lease = EditLease(username, now)
+                txn.events.append(('handover', {'editor': username}))
+                return self._state(txn.lease, username)
+
+            lease = txn.lease
+            notify_client = False
+            became_editor_after_queue = False
+
+            # Check if the editor's timeout has expired
+            if lease.editor != username and now - lease.last_heartbeat > self.timeout:
+                was_waiting = username in lease.waiting
+                new_editor = self._promote_next_editor(txn, now, fallback=username)
+                became_editor_after_queue = (new_editor == username and was_waiting)
+                notify_client = (new_editor == username)
+
+            if lease.editor == username:
+                # We are the editor
+                lease.last_heartbeat = now
+            elif username in lease.waiting:
+                lease.waiting[username] = now
+            else:
+                # Not the editor and not queued yet
+                lease.waiting[username] = now
+                notify_client = True
+
+            # Inactive users are cleared from the queue by the reaper
+            return self._state(lease, username, notify_client, became_editor_after_queue)
+
+    def refresh_editor(self, project_name, username):
+        """Extends the lease if username holds the lock. Returns False otherwise."""
+        with self._transaction(project_name) as txn:
+            if txn.lease is None or txn.lease.editor != username:
+                return False
+            txn.lease.last_heartbeat = time.time()
             return True
 
-    return False  # in all other cases, it is not allowed
+    def leave(self, project_name, username, grace=0):
+        """Marks username as gone: their lock or queue place expires after grace seconds."""
+        expires_at = time.time() - self.timeout + grace
+        with self._transaction(project_name) as txn:
+            lease = txn.lease
+            if lease is None:
+                return
+            if lease.editor == username:
+                lease.last_heartbeat = min(lease.last_heartbeat, expires_at)
+            if username in lease.waiting:
+                lease.waiting[username] = min(lease.waiting[username], expires_at)
+
+    def expire(self, project_name):
+        """Hands the lock over if the editor's lease expired; drops leases nobody holds any more."""
+        now = time.time()
+        with self._transaction(project_name) as txn:
+            lease = txn.lease
+            if lease is None:
+                return
+            self._prune_waiting(txn, now)
+            if now - lease.last_heartbeat > self.timeout:
+                if lease.waiting:
+                    self._promote_next_editor(txn, now)
+                else:
+                    txn.lease = None
+                    txn.events.append(('editor_left', {'editor': lease.editor}))
+
+    def reap(self):
+        for project_name in self.backend.projects():
+            self.expire(project_name)
+
+    def forget(self, project_name):
+        with self._transaction(project_name) as txn:
+            txn.lease = None
+
+
+def create_lease_manager():
+    backend = app.config['EDIT_LEASE_BACKEND']
+    if backend not in LEASE_BACKENDS:
+        raise ValueError(f'Unknown edit lease backend: {backend}')
+    return LeaseManager(LEASE_BACKENDS[backend]())
+
+
+lease_manager = create_lease_manager()
+
+
+def configure_lease_backend(backend):
+    """Switches the lease backend, e.g. to 'sqlite' before starting several workers."""
+    global lease_manager
+    app.config['EDIT_LEASE_BACKEND'] = backend
+    lease_manager = create_lease_manager()
+
+
+# ===================== Change stamps =====================
+class ChangeStamp:
+    """
+    A marker file under instance/ whose mtime is bumped on every change, so that in-memory
+    caches in other worker processes notice the change with a single stat().
+    """
+
+    def __init__(self, name):
+        self.path = os.path.join(app.instance_path, f'.{name}.stamp')
+
+    def bump(self):
+        return self._advance()[1]
+
+    def bump_from(self, seen):
+        """
+        bump() for a cache that was current at stamp `seen`: returns the new stamp, or None if
+        another process bumped in between, so the cache has to be reloaded.
+        """
+        previous, stamp = self._advance()
+        return stamp if previous == seen else None
+
+    def _advance(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with locked_file(self.path + '.lock'):
+            try:
+                previous = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                open(self.path, 'a').close()
+                previous = 0
+            stamp = max(time.time_ns(), previous + 1)
+            os.utime(self.path, ns=(stamp, stamp))
+        if has_request_context():
+            g.setdefault('change_stamps', {})[self.path] = stamp
+        return previous, stamp
+
+    def current(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def current_for_request(self):
+        """current(), but stat()ed only once per request; outside a request it is current()."""
+        if not has_request_context():
+            return self.current()
+        stamps = g.setdefault('change_stamps', {})
+        if self.path not in stamps:
+            stamps[self.path] = self.current()
+        return stamps[self.path]
+
+
+# ===================== User cache =====================
+USER_CACHE_TTL = 300
+
+
+class UserSnapshot(namedtuple('UserSnapshot', ['id', 'username', 'role']), UserMixin):
+    """A read-only copy of a User row; this is what current_user is on authenticated requests."""
+    __slots__ = ()
+
+
+class UserCache:
+    """
+    Maps user ids to snapshots for USER_CACHE_TTL seconds, so authenticated requests do not query
+    the users table. Creating or deleting a user bumps a change stamp that clears every process's cache.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stamp = ChangeStamp('users')
+        self._seen_stamp = None
+
+    def get(self, user_id):
+        now = time.monotonic()
+        stamp = self._stamp.current()
+        with self._lock:
+            if stamp != self._seen_stamp:
+                self._entries.clear()
+                self._seen_stamp = stamp
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        user = db.session.get(User, user_id)
+        # Unknown ids are cached too: a stale session cookie should not cost a query per request
+        snapshot = UserSnapshot(user.id, user.username, user.role) if user else None
+        with self._lock:
+            if self._seen_stamp == stamp:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+        return snapshot
+
+    def invalidate(self):
+        self._stamp.bump()
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+# ===================== Background workers =====================
+# Threads do not survive fork(), so every worker process starts its own on its first request.
+BACKGROUND_WORKERS = []
+_background_pid = None
+_background_lock = threading.Lock()
+
+
+def background_worker(func):
+    """Registers a function to run in a daemon thread in every serving process."""
+    BACKGROUND_WORKERS.append(func)
+    return func
+
+
+def start_background_workers():
+    global _background_pid
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        _background_pid = os.getpid()
+    for func in BACKGROUND_WORKERS:
+        threading.Thread(target=func, name=func.__name__, daemon=True).start()
+
+
+@app.before_request
+def ensure_background_workers():
+    if _background_pid != os.getpid():
+        start_background_workers()
+
+
+@background_worker
+def lease_reaper():
+    """Expires leases without waiting for a request, and relays lease changes made by other processes."""
+    seen_versions = {}
+    while True:
+        time.sleep(LEASE_REAPER_INTERVAL)
+        try:
+            lease_manager.reap()
+            for project_name in edit_events.projects():
+                version = lease_manager.backend.version(project_name)
+                if seen_versions.get(project_name, version) != version:
+                    edit_events.publish(project_name, 'changed')
+                seen_versions[project_name] = version
+        except Exception as e:
+            app.logger.error("Lease reaper error: %s", e)
+
+
+def edit_state(project_name, username):
+    return lease_manager.state(project_name, username)
+
+
+def touch_edit_session(project_name, username, create=True):
+    return lease_manager.touch(project_name, username, create)
+
+
+def expire_edit_session(project_name):
+    lease_manager.expire(project_name)
+
+
+def leave_edit_session(project_name, username):
+    """
+    Called when a user's last stream for the project closed. The user keeps their place
+    for EDIT_DISCONNECT_GRACE so that a reconnecting EventSource does not lose the lock.
+    """
+    lease_manager.leave(project_name, username, EDIT_DISCONNECT_GRACE.total_seconds())
+
+
+def can_user_edit_project(user, project_name):
+    """
+    admin can always edit; without records a user can edit; an explicit grant allows editing;
+    an admin record locks everyone else out; otherwise a user may edit if there is a
+    role-based user or viewer record. Resolved through the ACL index (see acl_index).
+    """
+    return acl_index.can_edit(os.path.join(PROJECTS_DIR, project_name), user)
 
 @app.route('/load_project', methods=['GET'])
 @login_required
@@ -250,107 +1840,44 @@ def load_project():
     project_name = request.args.get('project_name')
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
 
     project_file = os.path.join(PROJECTS_DIR, project_name, 'index.html')
     if not os.path.exists(project_file):
         return jsonify({'success': False, 'error': 'Project not found'})
 
+    lazy = request.args.get('blocks') == '1'
     try:
-        with open(project_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        if lazy:
+            content, revision, blocks = project_store.blocks(project_name)
+        else:
+            content, revision = project_store.read(project_name)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
     user = current_user
-    now = datetime.now()
-    username = user.username
 
-    has_edit_rights = can_user_edit_project(user, project_name)
-    can_edit = False
-    editor_username = None
-    notify_client = False
-    in_queue = False
-    became_editor_after_queue = False  # New flag
-
-    if not has_edit_rights:
+    if not can_user_edit_project(user, project_name):
         # User cannot edit — observer mode, not added to the queue
-        return jsonify({
-            'success': True,
-            'content': content,
-            'can_edit': False,
-            'editor': active_project_edits.get(project_name, {}).get('editor', None),
-            'notify': False,
-            'in_queue': False,
-            'became_editor_after_queue': False
-        })
-
-    # Has editing rights
-    if project_name not in active_project_edits:
-        # No active editor — we become one immediately, without a queue
-        active_project_edits[project_name] = {
-            'editor': username,
-            'last_heartbeat': now,
-            'waiting': []
-        }
-        can_edit = True
-        editor_username = username
-        # Do not notify — the user immediately became the editor
-        became_editor_after_queue = False
+        state = edit_state(project_name, None)
+        state['in_queue'] = False
     else:
-        record = active_project_edits[project_name]
-        editor_username = record['editor']
-
-        # Check if the editor's timeout has expired
-        if now - record['last_heartbeat'] > EDIT_TIMEOUT:
-            if record['waiting']:
-                new_editor = record['waiting'].pop(0)['user']
-                became_editor_after_queue = (new_editor == username)
-            else:
-                new_editor = username
-                became_editor_after_queue = False
-            record['editor'] = new_editor
-            record['last_heartbeat'] = now
-            editor_username = new_editor
-            notify_client = (new_editor == username)
-        else:
-            became_editor_after_queue = False
-
-        record = active_project_edits[project_name]  # update the record after changes
-
-        if record['editor'] == username:
-            # We are the editor
-            record['last_heartbeat'] = now
-            can_edit = True
-        else:
-            # We are not the editor, possibly in the queue
-            already_waiting = any(entry['user'] == username for entry in record['waiting'])
-            if not already_waiting:
-                record['waiting'].append({'user': username, 'last_heartbeat': now})
-                notify_client = True
-                in_queue = True
-            else:
-                for entry in record['waiting']:
-                    if entry['user'] == username:
-                        entry['last_heartbeat'] = now
-                        break
-                in_queue = True
-            can_edit = False
-
-        # Clearing the queue of inactive users
-        record['waiting'] = [
-            entry for entry in record['waiting']
-            if now - entry['last_heartbeat'] < EDIT_TIMEOUT
-        ]
-
-    return jsonify({
-        'success': True,
-        'content': content,
-        'can_edit': can_edit,
-        'editor': editor_username,
-        'notify': notify_client,
-        'in_queue': in_queue,
-        'became_editor_after_queue': became_editor_after_queue
-    })
+        state = touch_edit_session(project_name, user.username)
+
+    # content=0: the client fetches the document from /project_document (or, with blocks=1, the
+    # first screenful from /project_blocks), both of which can send it compressed
+    if lazy:
+        # blocks=1: the block list and how many blocks make up the first screenful
+        loaded = blocks_within(blocks, DOCUMENT_FIRST_SCREEN_BYTES)
+        state['blocks'] = [block_info(block) for block in blocks]
+        state['loaded'] = loaded
+        if request.args.get('content') != '0':
+            state['content'] = content[:blocks[loaded - 1].end] if loaded else content
+    elif request.args.get('content') != '0':
+        state['content'] = content
+    state['revision'] = revision
+    return jsonify(state)
 
 
 @app.route('/heartbeat', methods=['POST'])
@@ -359,82 +1886,132 @@ def heartbeat():
     project_name = request.form.get('project_name')
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
 
     user = current_user
-    username = user.username
-    now = datetime.now()
-
-    if project_name not in active_project_edits:
-        return jsonify({'success': False, 'error': 'Project not loaded'})
 
     if not can_user_edit_project(user, project_name):
         # No rights — just an observer, not in the queue
-        record = active_project_edits[project_name]
-        return jsonify({
-            'success': True,
-            'can_edit': False,
-            'editor': record.get('editor'),
-            'notify': False,
-            'in_queue': False,
-            'became_editor_after_queue': False
-        })
+        state = edit_state(project_name, None)
+        state['in_queue'] = False
+        return jsonify(state)
 
-    record = active_project_edits[project_name]
-    notify_client = False
-    in_queue = False
-    became_editor_after_queue = False
+    # An expired lease may already have been reaped; the heartbeat then takes the free lock
+    return jsonify(touch_edit_session(project_name, user.username))
 
-    # Checking for editor timeout
-    editor_timed_out = now - record['last_heartbeat'] > EDIT_TIMEOUT
-    editor_username = record['editor']
 
-    if editor_timed_out:
-        if record['waiting']:
-            new_editor = record['waiting'].pop(0)['user']
-            became_editor_after_queue = (new_editor == username)
-        else:
-            new_editor = username
-            became_editor_after_queue = False
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        record['editor'] = new_editor
-        record['last_heartbeat'] = now
-        editor_username = new_editor
-        notify_client = (new_editor == username)
-    else:
-        became_editor_after_queue = False
-        if record['editor'] == username:
-            # User is still the active editor
-            record['last_heartbeat'] = now
-        else:
-            # User is not the editor — possibly in the queue
-            found = False
-            for entry in record['waiting']:
-                if entry['user'] == username:
-                    entry['last_heartbeat'] = now
-                    found = True
-                    break
-            if not found:
-                record['waiting'].append({'user': username, 'last_heartbeat': now})
-                notify_client = True
-            in_queue = True
 
-    # Clearing the queue of inactive users
-    record['waiting'] = [
-        entry for entry in record['waiting']
-        if now - entry['last_heartbeat'] < EDIT_TIMEOUT
-    ]
+# Open stream connections per (project, username), so that closing one tab does not release the lock
+_edit_streams = defaultdict(int)
+_edit_stream_total = 0
+_edit_streams_lock = threading.Lock()
+
+
+def acquire_edit_stream(stream_key):
+    """Counts a new stream for stream_key. False if this process already serves EDIT_STREAM_LIMIT streams."""
+    global _edit_stream_total
+    limit = app.config['EDIT_STREAM_LIMIT']
+    with _edit_streams_lock:
+        if limit is not None and _edit_stream_total >= limit:
+            return False
+        _edit_stream_total += 1
+        _edit_streams[stream_key] += 1
+        return True
+
 
-    can_edit = (record['editor'] == username)
+def release_edit_stream(stream_key):
+    """Returns True if that was the last open stream for stream_key."""
+    global _edit_stream_total
+    with _edit_streams_lock:
+        _edit_stream_total -= 1
+        _edit_streams[stream_key] -= 1
+        if _edit_streams[stream_key] > 0:
+            return False
+        del _edit_streams[stream_key]
+        return True
+
+
+@app.route('/edit_events', methods=['GET'])
+@login_required
+def edit_events_stream():
+    """
+    Server-Sent Events replacement for /heartbeat polling. While the stream is open it keeps
+    the user's lock or queue place alive, and pushes 'handover', 'queue' and 'editor_left' events.
+    """
+    project_name = request.args.get('project_name')
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
+    if not os.path.isdir(os.path.join(PROJECTS_DIR, project_name)):
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
 
-    return jsonify({
-        'success': True,
-        'can_edit': can_edit,
-        'editor': record['editor'],
-        'notify': notify_client,
-        'in_queue': in_queue,
-        'became_editor_after_queue': became_editor_after_queue
-    })
+    # Resolve everything needed up front: the generator outlives the request context
+    username = current_user.username
+    has_edit_rights = can_user_edit_project(current_user, project_name)
+    stream_key = (project_name, username)
+    if not acquire_edit_stream(stream_key):
+        response = jsonify({'success': False, 'error': 'Too many open event streams, use /heartbeat'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(EDIT_STREAM_TICK)
+        return response
+    subscription = edit_events.subscribe(project_name)
+    closed = threading.Event()
+
+    def close_stream():
+        # From the generator's finally, or from the response's close() if it never started
+        if closed.is_set():
+            return
+        closed.set()
+        edit_events.unsubscribe(project_name, subscription)
+        if release_edit_stream(stream_key) and has_edit_rights:
+            leave_edit_session(project_name, username)
+
+    def current_state():
+        if has_edit_rights:
+            return touch_edit_session(project_name, username)
+        state = edit_state(project_name, None)
+        state['in_queue'] = False
+        return state
 
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            last_state = current_state()
+            yield _sse('state', last_state)
+            while True:
+                try:
+                    event, data = subscription.get(timeout=EDIT_STREAM_TICK)
+                except queue.Empty:
+                    event, data = None, None
+                expire_edit_session(project_name)
+                state = current_state()
+                # Personal notifications: this user gained or lost the lock
+                flipped = state['can_edit'] != last_state['can_edit']
+                if flipped:
+                    state['notify'] = True
+                    state['became_editor_after_queue'] = state['can_edit'] and last_state['in_queue']
+                if event == 'editor_left':
+                    yield _sse('editor_left', dict(state, left=data.get('editor')))
+                elif flipped or state['editor'] != last_state['editor']:
+                    yield _sse('handover', state)
+                elif state['queue_position'] != last_state['queue_position']:
+                    yield _sse('queue', state)
+                else:
+                    yield ': keepalive\n\n'
+                last_state = state
+        finally:
+            close_stream()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.call_on_close(close_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # Endpoint to get project content without changing the lock (for auto-refresh for those waiting)
@@ -444,18 +2021,130 @@ def get_project_content():
     project_name = request.args.get('project_name')
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
     
     project_file = os.path.join(PROJECTS_DIR, project_name, 'index.html')
     if not os.path.exists(project_file):
         return jsonify({'success': False, 'error': 'Project not found'})
     
     try:
-        with open(project_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return jsonify({'success': True, 'content': content})
+        content, revision = project_store.read(project_name)
+        return jsonify({'success': True, 'content': content, 'revision': revision})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
-        
+
+
+def document_response(project_name):
+    """
+    The current document as text/html with its revision in X-Revision. Clients that accept gzip
+    get the compressed bytes as the store keeps them, everyone else the decoded text.
+    """
+    version = project_store.version(project_name)
+    gzipped = accepts_gzip()
+    etag = hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:20] + ('-gz' if gzipped else '')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif gzipped:
+        body, revision = project_store.read_gzip(project_name)
+        response = Response(body, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        content, revision = project_store.read(project_name)
+        response = Response(content, mimetype='text/html')
+    if response.status_code == 304 or revision == version[0]:
+        response.set_etag(etag)
+    if response.status_code != 304:
+        response.headers['X-Revision'] = str(revision)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/project_document', methods=['GET'])
+@login_required
+def project_document():
+    project_name = request.args.get('project_name')
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
+    if not os.path.exists(project_store.document_path(project_name)):
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    if not can_access(os.path.join(PROJECTS_DIR, project_name), current_user):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    try:
+        return document_response(project_name)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+def block_info(block):
+    return {'id': block.id, 'offset': block.offset, 'length': block.length}
+
+
+def compressed_json(payload):
+    """jsonify(payload), gzip-compressed for clients that accept it."""
+    response = jsonify(payload)
+    if accepts_gzip():
+        response.set_data(gzip.compress(response.get_data(), DOCUMENT_COMPRESSION_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def blocks_within(blocks, budget):
+    """How many leading blocks fit in budget bytes, at least one."""
+    count = 0
+    for block in blocks:
+        if count and block.offset + block.length - blocks[0].offset > budget:
+            break
+        count += 1
+    return count
+
+
+@app.route('/project_blocks', methods=['GET'])
+@login_required
+def project_blocks():
+    """
+    Blocks [start, end) of a document opened with /load_project?blocks=1, as many as fit in
+    DOCUMENT_BLOCK_BATCH_BYTES. If the document changed since revision, nothing is returned and
+    the client reloads it whole.
+    """
+    project_name = request.args.get('project_name')
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
+    try:
+        start = int(request.args.get('start', 0))
+        end = request.args.get('end', type=int)
+        revision = request.args.get('revision', type=int)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid block range'}), 400
+    if not os.path.exists(project_store.document_path(project_name)):
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    if not can_access(os.path.join(PROJECTS_DIR, project_name), current_user):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+    content, current, blocks = project_store.blocks(project_name)
+    if revision is not None and revision != current:
+        return jsonify({'success': False, 'conflict': True, 'revision': current,
+                        'error': 'The document has changed since it was loaded'})
+    end = len(blocks) if end is None else min(end, len(blocks))
+    start = max(start, 0)
+    batch = blocks[start:end]
+    batch = batch[:blocks_within(batch, DOCUMENT_BLOCK_BATCH_BYTES)]
+    payload = []
+    for block in batch:
+        info = block_info(block)
+        info['html'] = content[block.start:block.end]
+        payload.append(info)
+    return compressed_json({'success': True, 'revision': current, 'start': start,
+                            'blocks': payload, 'total': len(blocks)})
+
+
 @app.route('/save_project', methods=['POST'])
 @login_required
 def save_project():
@@ -470,40 +2159,51 @@ def save_project():
 
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
 
     # Checking editing rights
     user = current_user
     if not can_user_edit_project(user, project_name):
         return jsonify({'success': False, 'error': 'You do not have permission to modify this project'})
 
-    # Checking if the user is the active editor
-    record = active_project_edits.get(project_name)
-    now = datetime.now()
-
-    if not record or record['editor'] != user.username:
+    # Checking if the user is the active editor (and updating the heartbeat)
+    if not lease_manager.refresh_editor(project_name, user.username):
         return jsonify({'success': False, 'error': 'Someone else is working on the project!'})
 
-    # Updating heartbeat
-    record['last_heartbeat'] = now
+    # Incremental save: a patch against a known revision
+    patch = request.form.get('patch')
+    if patch is not None:
+        try:
+            base_revision = int(request.form.get('base_revision'))
+            ops = json.loads(patch)
+            length = request.form.get('length')
+            expected_length = int(length) if length else None
+            revision = project_store.apply_patch(project_name, base_revision, ops, expected_length)
+            project_catalog.updated(project_name)
+            content_index.schedule(project_name)
+            return jsonify({'success': True, 'revision': revision})
+        except RevisionConflict as e:
+            # The client falls back to a full save
+            return jsonify({'success': False, 'conflict': True, 'revision': e.revision, 'error': str(e)})
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'conflict': True, 'error': f'Invalid patch: {e}'})
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)})
 
-    # Writing content
-    project_dir = os.path.join(PROJECTS_DIR, project_name)
-    if not os.path.exists(project_dir):
-        os.makedirs(project_dir)
+    if content is None:
+        return jsonify({'success': False, 'error': 'Content required'})
 
-    project_file = os.path.join(project_dir, 'index.html')
+    # Full save, possibly split into chunks
     try:
-        # If this is the first chunk – overwrite, otherwise append
-        mode = 'w' if chunk_number == 1 else 'a'
-        with open(project_file, mode, encoding='utf-8') as f:
-            f.write(content)
+        revision = project_store.write_chunk(project_name, chunk_number, total_chunks, content)
 
         # Additional logic upon completion of all chunks
         if chunk_number == total_chunks:
-            # For example, update the project timestamp, log the event, etc.
-            pass
+            project_catalog.updated(project_name)
+            content_index.schedule(project_name)
 
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'revision': revision})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -516,22 +2216,22 @@ def download_file():
     
     if not project_name or not file_name:
         return jsonify({'success': False, 'error': 'Project and file name are required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
 
     file_path = os.path.join(PROJECTS_DIR, project_name, file_name)
     
     if not os.path.exists(file_path):
         return jsonify({'success': False, 'error': 'File not found'}), 404
 
-    def generate():
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(65536)
-                if not chunk:
-                    break
-                yield chunk
+    if file_name == DOCUMENT_NAME:
+        # The snapshot on disk may be compressed or behind the revision log
+        response = Response(project_store.read(project_name)[0], mimetype='text/html')
+        response.headers["Content-Disposition"] = f"attachment; filename={file_name}"
+        return response
 
     mime_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
-    response = Response(stream_with_context(generate()), mimetype=mime_type)
+    response = file_response(file_path, mime_type)
     response.headers["Content-Disposition"] = f"attachment; filename={file_name}"
     return response
 
@@ -543,6 +2243,8 @@ def upload_file():
 
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
 
     if not file:
         return jsonify({'success': False, 'error': 'No file uploaded'})
@@ -551,28 +2253,933 @@ def upload_file():
     if not can_user_edit_project(user, project_name):
         return jsonify({'success': False, 'error': 'You do not have permission to modify this project'})
 
-    record = active_project_edits.get(project_name)
-    now = datetime.now()
-
-    if not record or record['editor'] != user.username:
+    if not lease_manager.refresh_editor(project_name, user.username):
         return jsonify({'success': False, 'error': 'Someone else is working on the project!'})
 
-    # Updating heartbeat
-    record['last_heartbeat'] = now
-
     project_path = os.path.join(PROJECTS_DIR, project_name)
     if not os.path.exists(project_path):
         return jsonify({'success': False, 'error': 'Project not found'})
 
+    filename = upload_filename(file.filename)
+    if not filename:
+        return jsonify({'success': False, 'error': 'Invalid file name'})
+
     try:
-        filename = file.filename
-        file.save(os.path.join(project_path, filename))
+        key_before = storage_manifest.key(project_name)
+        blob_store.save_stream(file.stream, os.path.join(project_path, filename))
+        storage_manifest.added(project_name, filename, key_before)
+        media_derivatives.schedule(os.path.join(project_path, filename))
         return jsonify({'success': True, 'filename': filename})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
         
 
+# ===================== Media blob store =====================
+# Uploaded files are stored once per content under blobs/<sha256[:2]>/<sha256>, and each project
+# file is a hard link to its blob, so the link count is the reference count: deleting a project
+# file never frees data another project still links, and a blob whose only remaining link is its
+# own entry in the store is removed. Files are always replaced by a new link, never rewritten in
+# place. Where the filesystem cannot hard link, files are copied as before. The store sits next to
+# PROJECTS_DIR (on the same filesystem), out of reach of any project name, and a blob is checked
+# against its digest before a new file is linked to it.
+# WORKSHOP_DEDUPLICATE_MEDIA=0 turns this off.
+app.config.setdefault('DEDUPLICATE_MEDIA', os.environ.get('WORKSHOP_DEDUPLICATE_MEDIA', '1') != '0')
+BLOBS_DIR = os.path.join(os.path.dirname(PROJECTS_DIR), 'blobs')
+LEGACY_BLOBS_DIR = os.path.join(PROJECTS_DIR, '.blobs')
+BLOB_GC_INTERVAL = 3600
+BLOB_GC_GRACE = 3600  # unlinked blobs younger than this may be about to get their link
+
+
+class BlobStore:
+    def __init__(self, root, enabled=True):
+        self.root = root
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._by_inode = None   # (st_dev, st_ino) -> blob path, built on first use
+        self._verified = set()  # (st_dev, st_ino) of blobs whose content matched their name
+        if os.path.isdir(LEGACY_BLOBS_DIR) and not os.path.exists(root):
+            try:
+                os.rename(LEGACY_BLOBS_DIR, root)  # stores created before the move
+            except OSError:
+                pass  # another worker process moved it first
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def temp_path(self):
+        """A path for staging an incoming file on the same filesystem as the blobs."""
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f'{os.getpid()}-{threading.get_ident()}-{time.time_ns()}')
+
+    def _scan(self):
+        index = {}
+        try:
+            prefixes = [e.path for e in os.scandir(self.root) if e.is_dir() and len(e.name) == 2]
+        except FileNotFoundError:
+            return index
+        for prefix in prefixes:
+            with os.scandir(prefix) as it:
+                for entry in it:
+                    try:
+                        # os.stat, not entry.stat(): on Windows the latter has no inode or link count
+                        st = os.stat(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    index[(st.st_dev, st.st_ino)] = entry.path
+        return index
+
+    def _lookup(self, st):
+        """Must be called with the lock held."""
+        key = (st.st_dev, st.st_ino)
+        if self._by_inode is None or key not in self._by_inode:
+            # Blobs added by other processes are only known after a rescan
+            self._by_inode = self._scan()
+        return self._by_inode.get(key)
+
+    def _drop_if_orphaned(self, st):
+        """st: stat of a link removed a moment ago. Removes its blob if nothing links to it any more."""
+        if st.st_nlink != 2:
+            return  # a plain file, or more project files still link the blob
+        with self._lock:
+            blob = self._lookup(st)
+            try:
+                if blob and os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+                    self._by_inode.pop((st.st_dev, st.st_ino), None)
+            except FileNotFoundError:
+                pass
+
+    # --- adding files ---
+    def save(self, source_path, digest, target_path):
+        """
+        Moves source_path (a staged file whose sha256 is digest) to target_path, deduplicated
+        against the store. source_path is consumed either way.
+        """
+        if not self.enabled:
+            self._replace(source_path, target_path)
+            return
+        blob = self.blob_path(digest)
+        link_path = f'{target_path}.{os.getpid()}.{threading.get_ident()}.link'
+        with self._lock:
+            try:
+                # Link first: a blob is only trusted to exist once we hold a link to it
+                os.link(blob, link_path)
+            except FileNotFoundError:
+                self._add_blob(source_path, blob, link_path)
+            except OSError:
+                os.replace(source_path, link_path)  # no hard links on this filesystem
+            else:
+                if self._intact(link_path, digest, os.path.getsize(source_path)):
+                    os.remove(source_path)
+                else:
+                    # Files already linked to the damaged blob keep it; new ones get the real content
+                    os.remove(link_path)
+                    self._add_blob(source_path, blob, link_path)
+        self._replace(link_path, target_path)
+
+    def _add_blob(self, source_path, blob, link_path):
+        """Must be called with the lock held."""
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(source_path, blob)
+        st = os.stat(blob)
+        self._verified.add((st.st_dev, st.st_ino))
+        if self._by_inode is not None:
+            self._by_inode[(st.st_dev, st.st_ino)] = blob
+        try:
+            os.link(blob, link_path)
+        except OSError:
+            shutil.copyfile(blob, link_path)  # no hard links on this filesystem
+
+    def _intact(self, path, digest, size):
+        """Whether the blob linked at path has the expected size and sha256; hashed once per process."""
+        st = os.stat(path)
+        if st.st_size != size:
+            return False
+        key = (st.st_dev, st.st_ino)
+        if key in self._verified:
+            return True
+        actual = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(TRANSMIT_BLOCK_SIZE)
+                if not block:
+                    break
+                actual.update(block)
+        if actual.hexdigest() != digest:
+            return False
+        self._verified.add(key)
+        return True
+
+    def _replace(self, source_path, target_path):
+        try:
+            previous = os.stat(target_path)
+        except FileNotFoundError:
+            previous = None
+        os.replace(source_path, target_path)
+        if previous is not None:
+            self._drop_if_orphaned(previous)
+
+    def save_stream(self, stream, target_path):
+        """Writes stream to target_path through the store; returns the number of bytes."""
+        tmp_path = self.temp_path()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    block = stream.read(TRANSMIT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    size += len(block)
+                    f.write(block)
+            self.save(tmp_path, digest.hexdigest(), target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return size
+
+    def save_file(self, source_path, target_path):
+        """Moves an existing file (e.g. a finished upload session) to target_path through the store."""
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            while True:
+                block = f.read(TRANSMIT_BLOCK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+        self.save(source_path, digest.hexdigest(), target_path)
+
+    # --- removing files ---
+    def remove(self, path):
+        st = os.stat(path)
+        os.remove(path)
+        self._drop_if_orphaned(st)
+
+    def remove_tree(self, path, ignore_errors=False):
+        """shutil.rmtree that releases the blobs the directory's files were linked to."""
+        linked = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        st = os.stat(entry.path)
+                        if st.st_nlink > 1:
+                            linked.append(st)
+        except FileNotFoundError:
+            if ignore_errors:
+                return
+            raise
+        shutil.rmtree(path, ignore_errors=ignore_errors)
+        for st in linked:
+            self._drop_if_orphaned(st)
+
+    def collect_garbage(self, grace=BLOB_GC_GRACE):
+        """Removes blobs nothing links to (left by files deleted outside the app) and stale temp files."""
+        cutoff = time.time() - grace
+        removed = 0
+        with self._lock:
+            for blob in self._scan().values():
+                try:
+                    st = os.stat(blob)
+                    if st.st_nlink == 1 and st.st_ctime < cutoff:
+                        os.remove(blob)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+            self._by_inode = None
+            self._verified.clear()
+        try:
+            for entry in os.scandir(os.path.join(self.root, 'tmp')):
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        return removed
+
+
+blob_store = BlobStore(BLOBS_DIR, app.config['DEDUPLICATE_MEDIA'])
+
+
+@background_worker
+def blob_collector():
+    while True:
+        time.sleep(BLOB_GC_INTERVAL)
+        try:
+            blob_store.collect_garbage()
+        except Exception as e:
+            app.logger.error("Blob collector error: %s", e)
+
+
+# ===================== Resumable uploads =====================
+# A session is a directory with the preallocated target file, its metadata and one empty marker
+# per received chunk, so any worker process can take chunks and answer status queries, and an
+# interrupted upload resumes with only the missing chunks. Sessions live inside PROJECTS_DIR so
+# that finalizing is a single os.replace on the same filesystem.
+UPLOAD_SESSIONS_DIR = os.path.join(PROJECTS_DIR, '.uploads')
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+UPLOAD_GC_INTERVAL = 3600
+UPLOAD_SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+app.config.setdefault('UPLOAD_MAX_SIZE', int(os.environ.get('WORKSHOP_UPLOAD_MAX_SIZE', 16 * 1024 ** 3)))
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_filename(name):
+    """Returns the bare file name to store an upload under, or None if it is not acceptable."""
+    name = os.path.basename((name or '').replace('\\', '/')).strip()
+    if not name or name.startswith('.') or name == DOCUMENT_NAME:
+        return None
+    return name
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class UploadSessions:
+    def __init__(self, root):
+        self.root = root
+
+    def _dir(self, session_id):
+        if not UPLOAD_SESSION_ID.match(session_id or ''):
+            raise UploadError('Upload session not found', 404)
+        return os.path.join(self.root, session_id)
+
+    def _load(self, session_id, user_id):
+        session_dir = self._dir(session_id)
+        try:
+            with open(os.path.join(session_dir, 'session.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError('Upload session not found', 404)
+        if meta['user_id'] != user_id:
+            raise UploadError('Upload session not found', 404)
+        return session_dir, meta
+
+    def _touch(self, session_dir):
+        os.utime(os.path.join(session_dir, 'session.json'))
+
+    def create(self, user_id, project_name, filename, size):
+        session_id = os.urandom(16).hex()
+        session_dir = os.path.join(self.root, session_id)
+        os.makedirs(os.path.join(session_dir, 'chunks'))
+        with open(os.path.join(session_dir, 'data'), 'wb') as f:
+            f.truncate(size)
+        meta = {'user_id': user_id, 'project': project_name, 'filename': filename,
+                'size': size, 'created': time.time()}
+        with open(os.path.join(session_dir, 'session.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return session_id
+
+    def received(self, session_dir):
+        ranges = []
+        for marker in os.listdir(os.path.join(session_dir, 'chunks')):
+            if marker.startswith('.'):
+                continue
+            start, length = marker.split('-')
+            ranges.append((int(start), int(start) + int(length)))
+        return merge_ranges(ranges)
+
+    def status(self, session_id, user_id):
+        session_dir, meta = self._load(session_id, user_id)
+        received = self.received(session_dir)
+        return {
+            'session_id': session_id,
+            'project_name': meta['project'],
+            'filename': meta['filename'],
+            'size': meta['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'received': received,
+            'complete': received == [[0, meta['size']]] or meta['size'] == 0,
+        }
+
+    def write_chunk(self, session_id, user_id, offset, length, stream, checksum=None):
+        """Streams one chunk into place; the marker is only created once the bytes are verified and on disk."""
+        session_dir, meta = self._load(session_id, user_id)
+        if length is None:
+            raise UploadError('Content-Length required', 411)
+        if length <= 0 or length > UPLOAD_MAX_CHUNK_SIZE:
+            raise UploadError('Chunk size must be between 1 and %d bytes' % UPLOAD_MAX_CHUNK_SIZE, 413)
+        if offset < 0 or offset + length > meta['size']:
+            raise UploadError('Chunk is outside of the file', 416)
+
+        digest = hashlib.sha256()
+        temp_path = os.path.join(session_dir, 'chunks', f'.{offset}-{length}.{os.getpid()}.{threading.get_ident()}')
+        try:
+            # Stage the chunk first, so a checksum mismatch or a dropped connection leaves the data file untouched.
+            with open(temp_path, 'wb') as temp:
+                remaining = length
+                while remaining:
+                    block = stream.read(min(TRANSMIT_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise UploadError('Chunk is shorter than Content-Length')
+                    digest.update(block)
+                    temp.write(block)
+                    remaining -= len(block)
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise UploadError('Chunk checksum mismatch', 422)
+            with open(temp_path, 'rb') as temp, open(os.path.join(session_dir, 'data'), 'r+b') as data:
+                data.seek(offset)
+                shutil.copyfileobj(temp, data, TRANSMIT_BLOCK_SIZE)
+                data.flush()
+                os.fsync(data.fileno())
+            open(os.path.join(session_dir, 'chunks', f'{offset}-{length}'), 'wb').close()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._touch(session_dir)
+        return digest.hexdigest()
+
+    def finalize(self, session_id, user_id):
+        session_dir, meta = self._load(session_id, user_id)
+        if meta['size'] and self.received(session_dir) != [[0, meta['size']]]:
+            raise UploadError('Upload is incomplete', 409)
+        project_path = os.path.join(PROJECTS_DIR, meta['project'])
+        if not os.path.isdir(project_path):
+            raise UploadError('Project not found', 404)
+        blob_store.save_file(os.path.join(session_dir, 'data'), os.path.join(project_path, meta['filename']))
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return meta
+
+    def abort(self, session_id, user_id):
+        session_dir, _ = self._load(session_id, user_id)
+        shutil.rmtree(session_dir, ignore_errors=True)
+
+    def collect_garbage(self, max_age=UPLOAD_SESSION_TTL):
+        """Removes sessions that have not received a chunk for max_age seconds."""
+        cutoff = time.time() - max_age
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for entry in entries:
+            if not entry.is_dir() or not UPLOAD_SESSION_ID.match(entry.name):
+                continue
+            try:
+                last_activity = os.stat(os.path.join(entry.path, 'session.json')).st_mtime
+            except OSError:
+                last_activity = entry.stat().st_mtime
+            if last_activity < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+upload_sessions = UploadSessions(UPLOAD_SESSIONS_DIR)
+
+
+@background_worker
+def upload_collector():
+    while True:
+        try:
+            upload_sessions.collect_garbage()
+        except Exception as e:
+            app.logger.error("Upload collector error: %s", e)
+        time.sleep(UPLOAD_GC_INTERVAL)
+
+
+def upload_error(e):
+    return jsonify({'success': False, 'error': str(e)}), e.status
+
+
+@app.route('/upload_sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    project_name = data.get('project_name')
+    filename = upload_filename(data.get('filename'))
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        size = -1
+
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'})
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'})
+    if not filename:
+        return jsonify({'success': False, 'error': 'Invalid file name'})
+    if size < 0:
+        return jsonify({'success': False, 'error': 'File size required'})
+    # The data file is preallocated to the declared size
+    if size > app.config['UPLOAD_MAX_SIZE']:
+        return jsonify({'success': False, 'error': 'File is too large'}), 413
+
+    user = current_user
+    if not can_user_edit_project(user, project_name):
+        return jsonify({'success': False, 'error': 'You do not have permission to modify this project'})
+
+    if not lease_manager.refresh_editor(project_name, user.username):
+        return jsonify({'success': False, 'error': 'Someone else is working on the project!'})
+
+    if project_name.startswith('.') or not os.path.isdir(os.path.join(PROJECTS_DIR, project_name)):
+        return jsonify({'success': False, 'error': 'Project not found'})
+
+    try:
+        session_id = upload_sessions.create(user.id, project_name, filename, size)
+        return jsonify({'success': True, **upload_sessions.status(session_id, user.id)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/upload_sessions/<session_id>', methods=['GET'])
+@login_required
+def upload_session_status(session_id):
+    try:
+        return jsonify({'success': True, **upload_sessions.status(session_id, current_user.id)})
+    except UploadError as e:
+        return upload_error(e)
+
+
+@app.route('/upload_sessions/<session_id>', methods=['PUT'])
+@login_required
+def upload_session_chunk(session_id):
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'error': 'Chunk offset required'}), 400
+    try:
+        digest = upload_sessions.write_chunk(session_id, current_user.id, offset, request.content_length,
+                                             request.stream, request.headers.get('X-Chunk-SHA256'))
+        return jsonify({'success': True, 'offset': offset, 'sha256': digest})
+    except UploadError as e:
+        return upload_error(e)
+
+
+@app.route('/upload_sessions/<session_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_session(session_id):
+    user = current_user
+    try:
+        status = upload_sessions.status(session_id, user.id)
+        # Edit rights are checked again, but not the lease: a multi-hour upload outlives the editor's turn.
+        if not can_user_edit_project(user, status['project_name']):
+            return jsonify({'success': False, 'error': 'You do not have permission to modify this project'})
+        key_before = storage_manifest.key(status['project_name'])
+        meta = upload_sessions.finalize(session_id, user.id)
+        storage_manifest.added(meta['project'], meta['filename'], key_before)
+        media_derivatives.schedule(os.path.join(PROJECTS_DIR, meta['project'], meta['filename']))
+        return jsonify({'success': True, 'filename': meta['filename']})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+
+@app.route('/upload_sessions/<session_id>', methods=['DELETE'])
+@login_required
+def abort_upload_session(session_id):
+    try:
+        upload_sessions.abort(session_id, current_user.id)
+        return jsonify({'success': True})
+    except UploadError as e:
+        return upload_error(e)
+
+
+# ==== Gemini service ====
+# One client per process, rebuilt only when /gemini_token stores a new token. Set
+# WORKSHOP_GEMINI_BACKEND=stub to answer locally without network access or quota.
+app.config.setdefault('GEMINI_BACKEND', os.environ.get('WORKSHOP_GEMINI_BACKEND', 'genai'))
+app.config.setdefault('GEMINI_MODEL', os.environ.get('WORKSHOP_GEMINI_MODEL', 'gemini-2.0-flash'))
+GEMINI_CACHE_SIZE = 256
+GEMINI_CACHE_TTL = 3600
+
+
+class GeminiError(Exception):
+    pass
+
+
+class GenaiBackend:
+    requires_token = True
+
+    def __init__(self, token):
+        self.client = genai.Client(api_key=token)
+
+    def generate(self, model, text):
+        return self.client.models.generate_content(model=model, contents=text).text
+
+    def stream(self, model, text):
+        for chunk in self.client.models.generate_content_stream(model=model, contents=text):
+            if chunk.text:
+                yield chunk.text
+
+
+class StubGeminiBackend:
+    """Answers instantly with a deterministic echo of the prompt; for offline testing."""
+    requires_token = False
+
+    def __init__(self, token):
+        self.token = token
+
+    def generate(self, model, text):
+        return ''.join(self.stream(model, text))
+
+    def stream(self, model, text):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        yield f'[{model} stub {digest}] '
+        for word in text.split()[:50]:
+            yield word + ' '
+
+
+GEMINI_BACKENDS = {
+    'genai': GenaiBackend,
+    'stub': StubGeminiBackend,
+}
+
+
+class ResultCache:
+    """A thread-safe LRU cache whose entries also expire ttl seconds after they were stored."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class GeminiService:
+    def __init__(self, cache_size=GEMINI_CACHE_SIZE, cache_ttl=GEMINI_CACHE_TTL):
+        self.cache = ResultCache(cache_size, cache_ttl)
+        self._stamp = ChangeStamp('gemini_token')
+        self._lock = threading.Lock()
+        self._backend = None
+        self._backend_key = None
+
+    def token_changed(self):
+        self._stamp.bump()
+
+    def backend(self):
+        """Returns the shared backend, rebuilding it if the backend setting or the stored token changed."""
+        name = app.config['GEMINI_BACKEND']
+        key = (name, self._stamp.current())
+        with self._lock:
+            if self._backend is not None and self._backend_key == key:
+                return self._backend
+            backend_class = GEMINI_BACKENDS[name]
+            token_entry = GeminiToken.query.first()
+            if token_entry is None and backend_class.requires_token:
+                raise GeminiError('Gemini token is not configured')
+            self._backend = backend_class(token_entry.token if token_entry else None)
+            self._backend_key = key
+            return self._backend
+
+    def cache_key(self, model, text):
+        return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+    def generate(self, text, model=None):
+        model = model or app.config['GEMINI_MODEL']
+        key = self.cache_key(model, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        result = self.backend().generate(model, text)
+        self.cache.put(key, result)
+        return result
+
+    def stream(self, text, model=None):
+        """
+        Returns an iterator over response fragments. The backend is resolved before the first
+        fragment, so configuration errors are raised here rather than in the middle of a response.
+        """
+        model = model or app.config['GEMINI_MODEL']
+        key = self.cache_key(model, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return iter([cached])
+        backend = self.backend()
+
+        def fragments():
+            parts = []
+            for part in backend.stream(model, text):
+                parts.append(part)
+                yield part
+            # Only complete responses are cached; an interrupted stream is simply dropped.
+            self.cache.put(key, ''.join(parts))
+
+        return fragments()
+
+
+gemini_service = GeminiService()
+
+
+# ==== Gemini job scheduler ====
+# Jobs live in a SQLite database shared by all worker processes, so a job can be submitted,
+# polled and cancelled through any of them. Upstream calls run on GEMINI_CONCURRENCY worker
+# threads per process, with at most GEMINI_CONCURRENCY jobs running on the host. Users are
+# served round-robin, so a burst from one user only delays that user's own requests. Clients
+# submit to /gemini_jobs and poll it; only the synchronous /gemini_api keeps a request thread
+# waiting for its job.
+app.config.setdefault('GEMINI_CONCURRENCY', int(os.environ.get('WORKSHOP_GEMINI_CONCURRENCY', 4)))
+app.config.setdefault('GEMINI_JOBS_DB', os.environ.get('WORKSHOP_GEMINI_JOBS_DB', os.path.join(app.instance_path, 'gemini_jobs.db')))
+GEMINI_USER_CONCURRENCY = 2
+GEMINI_USER_QUEUE_LIMIT = 8
+GEMINI_JOB_TIMEOUT = 120
+GEMINI_JOB_RETENTION = 300
+GEMINI_IDLE_POLL = 0.5  # how often idle workers look for jobs submitted through other processes
+GEMINI_FOLLOW_POLL = 0.2  # how often /gemini_api checks the job it waits for
+
+
+class GeminiBusy(GeminiError):
+    pass
+
+
+class GeminiJob(namedtuple('GeminiJob', ['seq', 'id', 'user_id', 'text', 'state', 'response', 'error',
+                                         'deadline', 'finished_at'])):
+    """A row of the gemini_job table."""
+    __slots__ = ()
+    FINISHED = ('done', 'error', 'cancelled', 'expired')
+    COLUMNS = 'seq, id, user_id, text, state, response, error, deadline, finished_at'
+
+    @property
+    def finished(self):
+        return self.state in self.FINISHED
+
+
+class GeminiJobStore:
+    """The job table in a SQLite database in WAL mode; every write is one short transaction."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self.connection()
+        conn.execute("""CREATE TABLE IF NOT EXISTS gemini_job (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, user_id INTEGER NOT NULL,
+            text TEXT NOT NULL, state TEXT NOT NULL, response TEXT NOT NULL DEFAULT '', error TEXT,
+            deadline REAL NOT NULL, finished_at REAL)""")
+        conn.execute('CREATE INDEX IF NOT EXISTS gemini_job_state ON gemini_job (state, user_id, seq)')
+        # Round-robin turns: the user with the lowest number is served next
+        conn.execute('CREATE TABLE IF NOT EXISTS gemini_turn (user_id INTEGER PRIMARY KEY, served INTEGER NOT NULL)')
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def job(self, conn, where, params):
+        row = conn.execute(f'SELECT {GeminiJob.COLUMNS} FROM gemini_job WHERE {where}', params).fetchone()
+        return GeminiJob(*row) if row else None
+
+
+class GeminiScheduler:
+    def __init__(self, service):
+        self.service = service
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._cond = threading.Condition()  # wakes this process's idle workers early
+
+    @property
+    def store(self):
+        with self._store_lock:
+            if self._store is None or self._store.path != app.config['GEMINI_JOBS_DB']:
+                self._store = GeminiJobStore(app.config['GEMINI_JOBS_DB'])
+            return self._store
+
+    def submit(self, user_id, text, timeout=GEMINI_JOB_TIMEOUT):
+        now = time.time()
+        job_id = os.urandom(16).hex()
+        with self.store.transaction() as conn:
+            self._expire(conn, now)
+            conn.execute('DELETE FROM gemini_job WHERE finished_at < ?', (now - GEMINI_JOB_RETENTION,))
+            pending = conn.execute("SELECT COUNT(*) FROM gemini_job WHERE state = 'queued' AND user_id = ?",
+                                   (user_id,)).fetchone()[0]
+            if pending >= GEMINI_USER_QUEUE_LIMIT:
+                raise GeminiBusy('Too many pending Gemini requests, please wait for the previous ones')
+            conn.execute("INSERT INTO gemini_job (id, user_id, text, state, deadline) VALUES (?, ?, ?, 'queued', ?)",
+                         (job_id, user_id, text, now + timeout))
+        with self._cond:
+            self._cond.notify_all()
+        return self.get(job_id, user_id)
+
+    def get(self, job_id, user_id):
+        return self.store.job(self.store.connection(), 'id = ? AND user_id = ?', (job_id, user_id))
+
+    def cancel(self, job, state='cancelled'):
+        """Finishes a queued or running job; a running one stops at its next fragment. Returns the updated job."""
+        self._finish(job, state, from_states=('queued', 'running'))
+        return self.store.job(self.store.connection(), 'seq = ?', (job.seq,))
+
+    def position(self, job):
+        """Number of jobs that will start before this one under round-robin order."""
+        if job.state != 'queued':
+            return 0
+        conn = self.store.connection()
+        index = conn.execute("SELECT COUNT(*) FROM gemini_job WHERE state = 'queued' AND user_id = ? AND seq < ?",
+                             (job.user_id, job.seq)).fetchone()[0]
+        others = conn.execute("""SELECT COUNT(*) FROM gemini_job WHERE state = 'queued' AND user_id != ?
+                                 GROUP BY user_id""", (job.user_id,)).fetchall()
+        return index + sum(min(count, index + 1) for count, in others)
+
+    def queue_length(self):
+        return self.store.connection().execute(
+            "SELECT COUNT(*) FROM gemini_job WHERE state = 'queued'").fetchone()[0]
+
+    def running(self):
+        return self.store.connection().execute(
+            "SELECT COUNT(*) FROM gemini_job WHERE state = 'running'").fetchone()[0]
+
+    @staticmethod
+    def _expire(conn, now):
+        # Also frees the slots of jobs whose worker process died while running them
+        conn.execute("""UPDATE gemini_job SET state = 'expired', finished_at = ?
+                        WHERE state IN ('queued', 'running') AND deadline < ?""", (now, now))
+
+    def _claim(self):
+        """Marks the next job in round-robin order as running and returns it, or None."""
+        now = time.time()
+        with self.store.transaction() as conn:
+            self._expire(conn, now)
+            running = dict(conn.execute(
+                "SELECT user_id, COUNT(*) FROM gemini_job WHERE state = 'running' GROUP BY user_id").fetchall())
+            if sum(running.values()) >= app.config['GEMINI_CONCURRENCY']:
+                return None
+            saturated = [user_id for user_id, count in running.items() if count >= GEMINI_USER_CONCURRENCY]
+            columns = ', '.join('j.' + column for column in GeminiJob._fields)
+            row = conn.execute(f"""SELECT {columns} FROM gemini_job j LEFT JOIN gemini_turn t ON t.user_id = j.user_id
+                WHERE j.state = 'queued' AND j.user_id NOT IN ({', '.join('?' * len(saturated))})
+                ORDER BY COALESCE(t.served, 0), j.seq LIMIT 1""", saturated).fetchone()
+            if row is None:
+                return None
+            job = GeminiJob(*row)._replace(state='running')
+            conn.execute("UPDATE gemini_job SET state = 'running' WHERE seq = ?", (job.seq,))
+            conn.execute("""INSERT INTO gemini_turn (user_id, served)
+                            VALUES (?, (SELECT COALESCE(MAX(served), 0) + 1 FROM gemini_turn))
+                            ON CONFLICT(user_id) DO UPDATE SET served = excluded.served""", (job.user_id,))
+            return job
+
+    def _append(self, job, part):
+        """Adds a fragment to the response. False if the job was cancelled or ran out of time."""
+        with self.store.transaction() as conn:
+            return conn.execute("""UPDATE gemini_job SET response = response || ?
+                                   WHERE seq = ? AND state = 'running' AND deadline >= ?""",
+                                (part, job.seq, time.time())).rowcount == 1
+
+    def _finish(self, job, state, error=None, from_states=('running',)):
+        with self.store.transaction() as conn:
+            conn.execute(f"""UPDATE gemini_job SET state = ?, error = ?, finished_at = ?
+                             WHERE seq = ? AND state IN ({', '.join('?' * len(from_states))})""",
+                         (state, error, time.time(), job.seq, *from_states))
+
+    def run_worker(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(GEMINI_IDLE_POLL)
+                continue
+            state, error = 'done', None
+            try:
+                with app.app_context():
+                    fragments = self.service.stream(job.text)
+                    try:
+                        for part in fragments:
+                            if not self._append(job, part):
+                                state = 'expired'  # no-op if the job was cancelled instead
+                                break
+                    finally:
+                        if hasattr(fragments, 'close'):
+                            fragments.close()
+            except Exception as e:
+                state, error = 'error', str(e)
+            try:
+                self._finish(job, state, error)
+            except sqlite3.Error:
+                pass  # the job expires at its deadline
+            with self._cond:
+                self._cond.notify_all()
+
+    def follow(self, job):
+        """Yields the job whenever its response grew, last when it has finished or run out of time."""
+        conn = self.store.connection()
+        length = 0
+        while True:
+            job = self.store.job(conn, 'seq = ?', (job.seq,))
+            if not job.finished and time.time() > job.deadline:
+                job = self.cancel(job, 'expired')
+            if job.finished or len(job.response) > length:
+                length = len(job.response)
+                yield job
+            if job.finished:
+                return
+            with self._cond:
+                self._cond.wait(GEMINI_FOLLOW_POLL)
+
+    def describe(self, job, since=0):
+        return {
+            'job_id': job.id,
+            'state': job.state,
+            'position': self.position(job),
+            'error': gemini_job_error(job),
+            'response': job.response[since:],
+            'length': len(job.response),
+        }
+
+
+gemini_scheduler = GeminiScheduler(gemini_service)
+
+
+@background_worker
+def gemini_workers():
+    for index in range(app.config['GEMINI_CONCURRENCY']):
+        threading.Thread(target=gemini_scheduler.run_worker, name=f'gemini_worker_{index}', daemon=True).start()
+
+
 # ==== Endpoint for setting the token ====
 
 class GeminiToken(db.Model):
@@ -591,63 +3198,690 @@ def GeminiSetToken():
     GeminiToken.query.delete()
     db.session.add(GeminiToken(token=token))
     db.session.commit()
+    gemini_service.token_changed()
+
+    return jsonify({'success': True, 'message': 'Token saved'})
+
+# ==== Endpoint for calling the Gemini API ====
+def gemini_job_error(job):
+    if job.state == 'expired':
+        return 'Gemini request timed out'
+    if job.state == 'cancelled':
+        return 'Gemini request was cancelled'
+    return job.error
+
+
+@app.route('/gemini_api', methods=['POST'])
+@login_required
+@roles_required("user", "admin")
+def GeminiAPI():
+    """
+    The synchronous API for older clients: the request is queued like any other job, and this
+    thread waits for it (at most GEMINI_JOB_TIMEOUT). Returns {'success', 'response'}, or with
+    "stream" set newline-delimited JSON: {"text": ...} per fragment, then {"done": true} or
+    {"error": ...}. New clients should submit to /gemini_jobs and poll instead.
+    """
+    if request.is_json:
+        data = request.get_json()
+        text = data.get('text')
+        stream = bool(data.get('stream'))
+    else:
+        text = request.form.get('text')
+        stream = request.form.get('stream') in ('1', 'true')
+
+    if not text:
+        return jsonify({'success': False, 'error': 'The "text" parameter is required'}), 400
+    try:
+        job = gemini_scheduler.submit(current_user.id, text)
+    except GeminiBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+
+    if not stream:
+        for job in gemini_scheduler.follow(job):
+            pass
+        if job.state != 'done':
+            return jsonify({'success': False, 'error': gemini_job_error(job)}), 500
+        return jsonify({'success': True, 'response': job.response})
+
+    def generate():
+        current, sent = job, 0
+        try:
+            for current in gemini_scheduler.follow(job):
+                if len(current.response) > sent:
+                    yield json.dumps({'text': current.response[sent:]}) + '\n'
+                    sent = len(current.response)
+            if current.state == 'done':
+                yield json.dumps({'done': True}) + '\n'
+            else:
+                yield json.dumps({'error': gemini_job_error(current)}) + '\n'
+        finally:
+            if not current.finished:
+                gemini_scheduler.cancel(current)  # the client went away
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/gemini_jobs', methods=['POST'])
+@login_required
+@roles_required("user", "admin")
+def submit_gemini_job():
+    data = request.get_json(silent=True) or request.form
+    text = data.get('text')
+    if not text:
+        return jsonify({'success': False, 'error': 'The "text" parameter is required'}), 400
+    try:
+        job = gemini_scheduler.submit(current_user.id, text)
+    except GeminiBusy as e:
+        return jsonify({'success': False, 'error': str(e)}), 429
+    return jsonify({'success': True, **gemini_scheduler.describe(job)}), 202
+
+
+@app.route('/gemini_jobs/<job_id>', methods=['GET'])
+@login_required
+def poll_gemini_job(job_id):
+    """Returns the job state and the response text after `since` characters."""
+    job = gemini_scheduler.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    since = request.args.get('since', 0, type=int)
+    return jsonify({'success': True, **gemini_scheduler.describe(job, since)})
+
+
+@app.route('/gemini_jobs/<job_id>', methods=['DELETE'])
+@login_required
+def cancel_gemini_job(job_id):
+    job = gemini_scheduler.get(job_id, current_user.id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    job = gemini_scheduler.cancel(job)
+    return jsonify({'success': True, **gemini_scheduler.describe(job)})
+
+
+# Helper function to check for "public" status
+def is_public_project(project):
+    return public_projects.contains(project)
+
+# Decorator that allows access either to authorized users or for public projects
+def public_or_login_required(view_func):
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        project = kwargs.get('project')
+        if current_user.is_authenticated or is_public_project(project):
+            return view_func(*args, **kwargs)
+        else:
+            return abort(403)  # Forbidden
+    return wrapper
+
+# ===================== Metrics =====================
+# Per-endpoint request metrics, exported in the Prometheus text format at /metrics. Every worker
+# process publishes its counters to instance/metrics/<pid>.json, and a scrape merges the files of
+# all live workers, so the numbers cover the whole server whichever worker answers.
+# Latency is measured until the response starts; streamed bodies are not included.
+app.config.setdefault('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+app.config.setdefault('METRICS_TOKEN', os.environ.get('WORKSHOP_METRICS_TOKEN'))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_PUBLISH_INTERVAL = 5
+METRICS_STALE_AFTER = 60  # seconds without a publish after which a worker is considered gone
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, endpoint, seconds, status, bytes_in, bytes_out, queries, query_seconds):
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = {
+                    'buckets': [0] * len(METRICS_BUCKETS), 'sum': 0.0, 'count': 0, 'statuses': {},
+                    'bytes_in': 0, 'bytes_out': 0, 'db_queries': 0, 'db_seconds': 0.0,
+                }
+            for index, bound in enumerate(METRICS_BUCKETS):
+                if seconds <= bound:
+                    route['buckets'][index] += 1
+                    break
+            route['sum'] += seconds
+            route['count'] += 1
+            status = str(status)
+            route['statuses'][status] = route['statuses'].get(status, 0) + 1
+            route['bytes_in'] += bytes_in
+            route['bytes_out'] += bytes_out
+            route['db_queries'] += queries
+            route['db_seconds'] += query_seconds
+
+    def snapshot(self):
+        with self._lock:
+            routes = json.loads(json.dumps(self._routes))
+        return {'routes': routes, 'gauges': process_gauges()}
+
+    def _path(self, pid):
+        return os.path.join(app.config['METRICS_DIR'], f'{pid}.json')
+
+    def publish(self):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+        path = self._path(os.getpid())
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Merges this process's live counters with those published by the other workers."""
+        snapshots = [self.snapshot()]
+        cutoff = time.time() - METRICS_STALE_AFTER
+        try:
+            entries = list(os.scandir(app.config['METRICS_DIR']))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith('.json') or entry.name == f'{os.getpid()}.json':
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        merged = {'routes': {}, 'gauges': Counter()}
+        for snapshot in snapshots:
+            merged['gauges'].update(snapshot['gauges'])
+            for endpoint, route in snapshot['routes'].items():
+                total = merged['routes'].get(endpoint)
+                if total is None:
+                    merged['routes'][endpoint] = route
+                    continue
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], route['buckets'])]
+                total['statuses'] = dict(Counter(total['statuses']) + Counter(route['statuses']))
+                for key in ('sum', 'count', 'bytes_in', 'bytes_out', 'db_queries', 'db_seconds'):
+                    total[key] += route[key]
+        return merged
+
+
+request_metrics = RequestMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + time.perf_counter() - started
+
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    # after_cursor_execute does not run for a failing statement; drop its start time so the
+    # pooled connection does not hand it to the next query
+    conn = context.connection
+    if conn is not None and context.statement is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        request_metrics.observe(
+            request.endpoint or 'unmatched',
+            time.perf_counter() - started,
+            response.status_code,
+            request.content_length or 0,
+            response.content_length or 0,
+            g.get('db_queries', 0),
+            g.get('db_seconds', 0.0),
+        )
+    return response
+
+
+def process_gauges():
+    """Gauges whose values are held by each worker process; a scrape reports their sum."""
+    return {
+        'workshop_edit_event_streams': sum(_edit_streams.values()),
+        'workshop_search_index_pending': content_index.pending(),
+    }
+
+
+def shared_gauges():
+    """Gauges read from state shared by all workers; a scrape reports them once, as read."""
+    queue_lengths = lease_manager.backend.queue_lengths()
+    return {
+        'workshop_edit_leases': len(queue_lengths),
+        'workshop_edit_waiters': sum(queue_lengths.values()),
+        'workshop_gemini_inflight': gemini_scheduler.running(),
+        'workshop_gemini_queue_length': gemini_scheduler.queue_length(),
+        'workshop_upload_sessions': len(os.listdir(UPLOAD_SESSIONS_DIR)) if os.path.isdir(UPLOAD_SESSIONS_DIR) else 0,
+    }
+
+
+GAUGE_HELP = {
+    'workshop_edit_leases': 'Projects with an active edit lease.',
+    'workshop_edit_waiters': 'Users waiting in edit queues.',
+    'workshop_edit_event_streams': 'Open /edit_events streams.',
+    'workshop_gemini_inflight': 'Gemini jobs being answered.',
+    'workshop_gemini_queue_length': 'Gemini jobs waiting for a worker.',
+    'workshop_search_index_pending': 'Projects waiting to be reindexed for content search.',
+    'workshop_upload_sessions': 'Unfinished resumable upload sessions.',
+}
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(merged, gauges):
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    routes = sorted(merged['routes'].items())
+    metric('workshop_http_request_duration_seconds', 'histogram', 'Time until the response starts, per endpoint.')
+    for endpoint, route in routes:
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS, route['buckets']):
+            cumulative += count
+            lines.append(f'workshop_http_request_duration_seconds_bucket{{endpoint="{_label(endpoint)}",le="{bound}"}} {cumulative}')
+        lines.append(f'workshop_http_request_duration_seconds_bucket{{endpoint="{_label(endpoint)}",le="+Inf"}} {route["count"]}')
+        lines.append(f'workshop_http_request_duration_seconds_sum{{endpoint="{_label(endpoint)}"}} {route["sum"]}')
+        lines.append(f'workshop_http_request_duration_seconds_count{{endpoint="{_label(endpoint)}"}} {route["count"]}')
+
+    metric('workshop_http_responses_total', 'counter', 'Responses by endpoint and status code.')
+    for endpoint, route in routes:
+        for status, count in sorted(route['statuses'].items()):
+            lines.append(f'workshop_http_responses_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+    for name, key, help_text in (
+            ('workshop_http_request_bytes_total', 'bytes_in', 'Request body bytes received.'),
+            ('workshop_http_response_bytes_total', 'bytes_out', 'Response body bytes with a known length.'),
+            ('workshop_db_queries_total', 'db_queries', 'SQLAlchemy queries run while handling requests.'),
+            ('workshop_db_query_seconds_total', 'db_seconds', 'Time spent in SQLAlchemy queries.')):
+        metric(name, 'counter', help_text)
+        for endpoint, route in routes:
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {route[key]}')
+
+    for name, value in sorted(gauges.items()):
+        metric(name, 'gauge', GAUGE_HELP.get(name, name))
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+@background_worker
+def metrics_publisher():
+    while True:
+        time.sleep(METRICS_PUBLISH_INTERVAL)
+        try:
+            request_metrics.publish()
+        except Exception as e:
+            app.logger.error("Metrics publisher error: %s", e)
+
+
+@app.route('/metrics')
+def metrics():
+    # Scrapers authenticate with "Authorization: Bearer <WORKSHOP_METRICS_TOKEN>", people as an admin
+    token = app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        if not current_user.is_authenticated or current_user.role != 'admin':
+            abort(403)
+    merged = request_metrics.collect()
+    gauges = dict(merged['gauges'])
+    gauges.update(shared_gauges())
+    response = Response(render_prometheus(merged, gauges), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# ===================== HTTP caching =====================
+# Cache lifetimes (seconds) per endpoint; after that, clients revalidate with ETag / Last-Modified.
+app.config.setdefault('CACHE_MAX_AGE', {
+    'styles': int(os.environ.get('WORKSHOP_STATIC_MAX_AGE', 3600)),
+    'serve_js': int(os.environ.get('WORKSHOP_STATIC_MAX_AGE', 3600)),
+    'serve_files': int(os.environ.get('WORKSHOP_FILES_MAX_AGE', 86400)),
+    'serve_workspace_file': int(os.environ.get('WORKSHOP_WORKSPACE_MAX_AGE', 300)),
+})
+app.config.setdefault('GZIP_CACHE_DIR', os.path.join(app.instance_path, 'gzip_cache'))
+GZIP_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = {'application/javascript', 'application/json', 'application/xml', 'image/svg+xml'}
+
+
+def cache_max_age(endpoint=None):
+    return app.config['CACHE_MAX_AGE'].get(endpoint or request.endpoint, 0)
+
+
+def is_compressible(mime_type):
+    return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+
+
+def accepts_gzip():
+    return 'gzip' in request.accept_encodings
+
+
+def file_etag(st):
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+def is_not_modified(etag, mtime):
+    """Evaluates If-None-Match (which takes precedence) or If-Modified-Since."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return int(mtime) <= request.if_modified_since.timestamp()
+    return False
+
+
+def set_cache_headers(response, etag, mtime, max_age, private=False):
+    response.set_etag(etag)
+    response.last_modified = int(mtime)
+    response.cache_control.max_age = max_age
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
 
-    return jsonify({'success': True, 'message': 'Token saved'})
 
-# ==== Endpoint for calling the Gemini API ====
-@app.route('/gemini_api', methods=['POST'])
-@login_required
-@roles_required("user", "admin")
-def GeminiAPI():
-    if request.is_json:
-        data = request.get_json()
-        text = data.get('text')
+def gzip_variant(path, st):
+    """Path of a gzip-compressed copy of path, created once per file version."""
+    cache_dir = app.config['GZIP_CACHE_DIR']
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    gz_path = os.path.join(cache_dir, f'{key}-{file_etag(st)}.gz')
+    if not os.path.exists(gz_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{gz_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, gz_path)
+    return gz_path
+
+
+def send_static_asset(directory, filename):
+    """
+    send_from_directory with the endpoint's cache lifetime, ETag / Last-Modified validation,
+    and a precompressed gzip variant for text assets when the client accepts it.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    max_age = cache_max_age()
+    mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if not (is_compressible(mime_type) and st.st_size >= GZIP_MIN_SIZE):
+        return send_file(path, mimetype=mime_type, max_age=max_age, conditional=True, etag=file_etag(st))
+
+    etag = file_etag(st) + ('-gz' if accepts_gzip() else '')
+    if is_not_modified(etag, st.st_mtime):
+        response = Response(status=304)
+    elif accepts_gzip():
+        response = send_file(gzip_variant(path, st), mimetype=mime_type, max_age=max_age, conditional=False, etag=False)
+        response.headers['Content-Encoding'] = 'gzip'
     else:
-        text = request.form.get('text')
+        response = send_file(path, mimetype=mime_type, max_age=max_age, conditional=False, etag=False)
+    response.vary.add('Accept-Encoding')
+    return set_cache_headers(response, etag, st.st_mtime, max_age)
+
+
+# ===================== File transmission =====================
+TRANSMIT_BLOCK_SIZE = 65536
 
-    if not text:
-        return jsonify({'success': False, 'error': 'The "text" parameter is required'}), 400
 
+def _read_range(f, length, block_size=TRANSMIT_BLOCK_SIZE):
+    """Fallback body: yields length bytes from the current position of f, then closes it."""
     try:
-        token_entry = GeminiToken.query.first()
-        if not token_entry:
-            return jsonify({'success': False, 'error': 'Gemini token is not configured'}), 500
-
-        from google import genai
-        client = genai.Client(api_key=token_entry.token)
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=text
-        )
-        return jsonify({'success': True, 'response': response.text})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            yield data
+            remaining -= len(data)
+    finally:
+        f.close()
 
 
-# Helper function to check for "public" status
-def is_public_project(project):
-    # Check SharedProject
-    shared = SharedProject.query.filter(SharedProject.project_path.like(f"%/{project}/%")).first()
-    if shared:
-        return True
+def file_response(path, mime_type, start=0, length=None, status=200):
+    """
+    Response with length bytes of path starting at offset start.
+    The open file goes to the server's wsgi.file_wrapper when there is one (gunicorn uses
+    sendfile(), waitress serves it from its own buffers), so the bytes are not copied through
+    Python; the server sends from the file's current position up to Content-Length.
+    Servers without a file_wrapper (the development server) get a generator.
+    """
+    f = open(path, 'rb')
+    try:
+        if length is None:
+            length = os.fstat(f.fileno()).st_size - start
+        f.seek(start)
+    except Exception:
+        f.close()
+        raise
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        body = file_wrapper(f, TRANSMIT_BLOCK_SIZE)
+    else:
+        body = _read_range(f, length)
+    # direct_passthrough hands the file_wrapper object to the server unchanged
+    response = Response(body, status=status, mimetype=mime_type, direct_passthrough=True)
+    response.headers['Content-Length'] = str(length)
+    return response
 
-    # Check MainMenu
-    main = MainMenu.query.first()
-    if main and f"/{project}/" in main.project_path:
-        return True
 
-    return False
+# ===================== Media derivatives =====================
+# Downscaled previews of project media, served for /workspace/<project>/<file>?variant=thumb:
+# a JPEG thumbnail for images (needs Pillow) and a poster frame for videos (needs ffmpeg on PATH).
+# Uploads queue their thumbnail for a small worker pool, and anything not generated yet is made
+# on the first request. Derivatives are keyed by the file's inode and version, so a deduplicated
+# file shared by several projects has one thumbnail, and a replaced file gets a new one.
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:
+    Image = None
+
+
+class UndecodableMedia(Exception):
+    pass
+
+
+# Failures that retrying will not fix; they leave a .failed marker. Anything else (a full disk,
+# an ffmpeg timeout) is logged and tried again on the next request.
+DERIVATIVE_DECODE_ERRORS = (UndecodableMedia, subprocess.CalledProcessError)
+if Image is not None:
+    DERIVATIVE_DECODE_ERRORS += (UnidentifiedImageError, Image.DecompressionBombError)
+
+app.config.setdefault('DERIVATIVE_CACHE_DIR', os.path.join(app.instance_path, 'derivatives'))
+app.config.setdefault('DERIVATIVE_WORKERS', int(os.environ.get('WORKSHOP_DERIVATIVE_WORKERS', 2)))
+THUMB_MAX_SIZE = 320
+THUMB_QUALITY = 80
+VIDEO_POSTER_OFFSET = 1     # seconds into the video
+DERIVATIVE_TIMEOUT = 60
+DERIVATIVE_MAX_AGE = 30 * 86400
+DERIVATIVE_GC_INTERVAL = 3600
+
+
+class MediaDerivatives:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.ffmpeg = shutil.which('ffmpeg')
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._in_progress = {}  # key -> lock held while the derivative is generated
+
+    def kind(self, mime_type):
+        if mime_type.startswith('image/') and mime_type != 'image/svg+xml' and Image is not None:
+            return 'image'
+        if mime_type.startswith('video/') and self.ffmpeg:
+            return 'video'
+        return None
+
+    def _paths(self, path, st):
+        inode = hashlib.sha1(f'{st.st_dev}:{st.st_ino}'.encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(self.cache_dir, inode[:2], f'{inode}-{file_etag(st)}-thumb')
+        return base + '.jpg', base + '.failed'
+
+    def thumbnail(self, path, mime_type=None):
+        """Path of the thumbnail of path, generated now if needed; None if there is none."""
+        mime_type = mime_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        kind = self.kind(mime_type)
+        if kind is None:
+            return None
+        st = os.stat(path)
+        target, failed = self._paths(path, st)
+        if os.path.exists(target):
+            return target
+        if os.path.exists(failed):
+            return None  # known to be unreadable, do not retry on every request
+        with self._lock:
+            lock = self._in_progress.setdefault(target, threading.Lock())
+        try:
+            with lock:
+                if os.path.exists(target):
+                    return target
+                if os.path.exists(failed):
+                    return None  # failed while we waited for the lock
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp_path = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+                try:
+                    if kind == 'image':
+                        self._image_thumbnail(path, tmp_path)
+                    else:
+                        self._video_poster(path, tmp_path)
+                    os.replace(tmp_path, target)
+                    return target
+                except DERIVATIVE_DECODE_ERRORS as e:
+                    app.logger.warning("No thumbnail for %s: %s", path, e)
+                    open(failed, 'w').close()
+                    return None
+                except Exception as e:
+                    app.logger.warning("Thumbnail of %s failed, will retry: %s", path, e)
+                    return None
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        finally:
+            with self._lock:
+                self._in_progress.pop(target, None)
+
+    @staticmethod
+    def _image_thumbnail(source, target):
+        with Image.open(source) as image:
+            # draft() lets JPEG decode at a reduced scale, which is most of the work for camera photos
+            image.draft('RGB', (THUMB_MAX_SIZE, THUMB_MAX_SIZE))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((THUMB_MAX_SIZE, THUMB_MAX_SIZE))
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(target, 'JPEG', quality=THUMB_QUALITY, optimize=True)
+
+    def _video_poster(self, source, target):
+        scale = f'scale={THUMB_MAX_SIZE}:{THUMB_MAX_SIZE}:force_original_aspect_ratio=decrease'
+        # Videos shorter than the offset produce no frame; take the first one then
+        for offset in (VIDEO_POSTER_OFFSET, 0):
+            subprocess.run([self.ffmpeg, '-v', 'error', '-y', '-ss', str(offset), '-i', source,
+                            '-frames:v', '1', '-vf', scale, '-f', 'image2', '-c:v', 'mjpeg', target],
+                           stdin=subprocess.DEVNULL, capture_output=True, timeout=DERIVATIVE_TIMEOUT, check=True)
+            if os.path.getsize(target):
+                return
+        raise UndecodableMedia('no video frame')
+
+    # --- background generation ---
+    def schedule(self, path):
+        if self.kind(mimetypes.guess_type(path)[0] or 'application/octet-stream') is None:
+            return
+        with self._lock:
+            if path in self._queued:
+                return
+            self._queued.add(path)
+        self._queue.put(path)
+
+    def run_worker(self):
+        while True:
+            path = self._queue.get()
+            with self._lock:
+                self._queued.discard(path)
+            try:
+                if os.path.exists(path):
+                    self.thumbnail(path)
+            except Exception as e:
+                app.logger.error("Derivative worker error: %s", e)
+
+    def collect_garbage(self, max_age=DERIVATIVE_MAX_AGE):
+        """Removes derivatives not used for max_age seconds (mostly those of replaced or deleted files)."""
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            prefixes = [e.path for e in os.scandir(self.cache_dir) if e.is_dir()]
+        except FileNotFoundError:
+            return 0
+        for prefix in prefixes:
+            for entry in os.scandir(prefix):
+                try:
+                    st = entry.stat()
+                    if max(st.st_atime, st.st_mtime) < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+media_derivatives = MediaDerivatives(app.config['DERIVATIVE_CACHE_DIR'])
+
+
+@background_worker
+def derivative_workers():
+    for index in range(app.config['DERIVATIVE_WORKERS']):
+        threading.Thread(target=media_derivatives.run_worker, name=f'derivative_worker_{index}', daemon=True).start()
+    while True:
+        time.sleep(DERIVATIVE_GC_INTERVAL)
+        try:
+            media_derivatives.collect_garbage()
+        except Exception as e:
+            app.logger.error("Derivative cache cleanup error: %s", e)
+
+
+def thumbnail_response(path, mime_type):
+    """The thumbnail of path; images without one are sent as they are, anything else is a 404."""
+    thumb = media_derivatives.thumbnail(path, mime_type)
+    if thumb is None:
+        if mime_type.startswith('image/'):
+            return None
+        abort(404)
+    st = os.stat(thumb)
+    etag = file_etag(st)
+    max_age = cache_max_age()
+    private = current_user.is_authenticated
+    if is_not_modified(etag, st.st_mtime):
+        return set_cache_headers(Response(status=304), etag, st.st_mtime, max_age, private)
+    try:
+        # Touch the access time for collect_garbage on filesystems mounted with noatime
+        os.utime(thumb, (time.time(), st.st_mtime))
+    except OSError:
+        pass
+    return set_cache_headers(file_response(thumb, 'image/jpeg', 0, st.st_size), etag, st.st_mtime, max_age, private)
 
-# Decorator that allows access either to authorized users or for public projects
-def public_or_login_required(view_func):
-    @wraps(view_func)
-    def wrapper(*args, **kwargs):
-        project = kwargs.get('project')
-        if current_user.is_authenticated or is_public_project(project):
-            return view_func(*args, **kwargs)
-        else:
-            return abort(403)  # Forbidden
-    return wrapper
 
 # Serving project files
 @app.route('/workspace/<project>/<filename>')
@@ -656,60 +3890,66 @@ def serve_workspace_file(project, filename):
     path = os.path.join(PROJECTS_DIR, project, filename)
     if not os.path.exists(path):
         return abort(404)
-    file_size = os.path.getsize(path)
+    if filename == DOCUMENT_NAME:
+        # The snapshot on disk may be compressed or behind the revision log
+        return document_response(project)
     mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if request.args.get('variant') == 'thumb':
+        response = thumbnail_response(path, mime_type)
+        if response is not None:
+            return response
+    st = os.stat(path)
+    file_size = st.st_size
+    etag = file_etag(st)
+    max_age = cache_max_age()
+    # Responses for logged-in users must not be shared by proxies
+    private = current_user.is_authenticated
+
+    if is_not_modified(etag, st.st_mtime):
+        return set_cache_headers(Response(status=304), etag, st.st_mtime, max_age, private)
+
     range_header = request.headers.get('Range', None)
+    # If-Range: only honour the range if the client's copy is still current
+    if range_header and 'If-Range' in request.headers:
+        if_range = request.if_range
+        if if_range.etag is not None:
+            current = if_range.etag == etag
+        else:
+            current = if_range.date is not None and int(st.st_mtime) <= if_range.date.timestamp()
+        if not current:
+            range_header = None
 
     if range_header:
         range_match = re.search(r'bytes=(\d+)-(\d*)', range_header)
         if range_match:
             start = int(range_match.group(1))
             end_str = range_match.group(2)
-            end = int(end_str) if end_str else file_size - 1
+            end = min(int(end_str), file_size - 1) if end_str else file_size - 1
         else:
             start, end = 0, file_size - 1
+        if start >= file_size or end < start:
+            response = Response(status=416)
+            response.headers.add('Content-Range', f'bytes */{file_size}')
+            return response
         length = end - start + 1
 
-        def generate():
-            with open(path, 'rb') as f:
-                f.seek(start)
-                remaining = length
-                chunk_size = 65536
-                while remaining > 0:
-                    data = f.read(min(chunk_size, remaining))
-                    if not data:
-                        break
-                    yield data
-                    remaining -= len(data)
-
-        response = Response(stream_with_context(generate()), status=206, mimetype=mime_type)
+        response = file_response(path, mime_type, start, length, status=206)
         response.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
         response.headers.add('Accept-Ranges', 'bytes')
-        response.headers.add('Content-Length', str(length))
-        return response
+        return set_cache_headers(response, etag, st.st_mtime, max_age, private)
 
     else:
-        def generate():
-            with open(path, 'rb') as f:
-                chunk_size = 65536
-                while True:
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    yield data
-
-        response = Response(stream_with_context(generate()), mimetype=mime_type)
+        response = file_response(path, mime_type, 0, file_size)
         response.headers.add('Accept-Ranges', 'bytes')
-        response.headers.add('Content-Length', str(file_size))
-        return response
+        return set_cache_headers(response, etag, st.st_mtime, max_age, private)
 
 @app.route('/styles.css')
 def styles():
-    return send_from_directory(app.template_folder, 'styles.css')
+    return send_static_asset(app.template_folder, 'styles.css')
 
 @app.route('/js/<path:filename>')
 def serve_js(filename):
-    return send_from_directory(os.path.join(app.template_folder, 'js'), filename)
+    return send_static_asset(os.path.join(app.template_folder, 'js'), filename)
 
 # ===================== Authentication Routes =====================
 @app.route('/login', methods=['GET', 'POST'])
@@ -761,6 +4001,7 @@ def set_main_menu():
     MainMenu.query.delete()
     db.session.add(MainMenu(project_path=project_path))
     db.session.commit()
+    public_projects.changed()
 
     return jsonify({'success': True, 'message': 'Main screen updated'}), 200
 
@@ -775,18 +4016,21 @@ def get_main_project_name():
     return jsonify({'success': False, 'error': 'Main project is not set'}), 404
 
 
+def main_menu_path():
+    main = MainMenu.query.first()
+    return main.project_path if main else None
+
+
 @app.route('/')
 def home():
-
-    main = MainMenu.query.first()
-    if main and os.path.isfile(main.project_path):
-        try:
-            with open(main.project_path, 'r', encoding='utf-8') as f:
-                project_content = f.read()
-            return render_template('main_menu.html', project_content=project_content)
-        except Exception as e:
-            # If reading suddenly fails
-            return render_template('error.html', error=str(e)), 500
+    try:
+        page = page_cache.page('home', main_menu_path,
+                               lambda content: render_template('main_menu.html', project_content=content))
+    except Exception as e:
+        # If reading suddenly fails
+        return render_template('error.html', error=str(e)), 500
+    if page is not None:
+        return page_response(page)
 
     # If the main screen is not set — redirect to login
     return redirect(url_for('login'))
@@ -858,6 +4102,7 @@ def manage_visibility():
             )
             db.session.add(new_vis)
             db.session.commit()
+            acl_index.add_grant(project_file, role, user.id)
             return jsonify({'success': True, 'message': 'Individual access added'})
         else:
             # Role-based access: overwrite the single role for everyone
@@ -874,6 +4119,7 @@ def manage_visibility():
             )
             db.session.add(new_vis)
             db.session.commit()
+            acl_index.set_role_grant(project_file, role)
             return jsonify({'success': True, 'message': 'Role-based visibility updated'})
 
     # DELETE: delete specific access
@@ -893,6 +4139,7 @@ def manage_visibility():
 
         db.session.delete(vis)
         db.session.commit()
+        acl_index.remove_grant(project_file, vis.role, vis.user_id)
         return jsonify({'success': True, 'message': 'Access removed'})
 
 
@@ -904,15 +4151,156 @@ ROLE_PERMISSIONS = {
 }
 
 
-def load_visibility_map():
+# ===================== Access control index =====================
+class AclIndex:
     """
-    Load all visibility records grouped by project_path.
-    Returns a dict: { project_path: [visibility_records, ...], ... }
+    In-memory index of ProjectVisibility. Answers can_access / can_edit for a (user, project)
+    with a few set lookups, and is updated in place by the routes that change grants.
+    Rebuilt from the database only when another process bumped the stamp, which is checked
+    once per request rather than on every query.
     """
-    vis_map = defaultdict(list)
-    for v in ProjectVisibility.query.all():
-        vis_map[v.project_path].append(v)
-    return vis_map
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._stamp = ChangeStamp('acl')
+        self._loaded_stamp = None
+        self._reset()
+
+    def _reset(self):
+        self._grants = {}               # project_path -> Counter of (role, user_id)
+        self._project_users = {}        # project_path -> ids of users with an individual grant
+        self._admin_locked = set()      # projects with any admin record
+        self._role_editable = set()     # projects with a role-based user/viewer record
+        self._role_visible = {role: set() for role in ROLE_PERMISSIONS}  # role -> projects visible by role
+
+    def _ensure_loaded(self):
+        stamp = self._stamp.current_for_request()
+        if stamp == self._loaded_stamp:
+            return
+        self._reset()
+        for v in ProjectVisibility.query.all():
+            self._grants.setdefault(v.project_path, Counter())[(v.role, v.user_id)] += 1
+        for project_path in list(self._grants):
+            self._reindex(project_path)
+        self._loaded_stamp = stamp
+
+    def _reindex(self, project_path):
+        """Recomputes the derived sets of one project from its grants."""
+        grants = self._grants.get(project_path)
+        self._project_users.pop(project_path, None)
+        self._admin_locked.discard(project_path)
+        self._role_editable.discard(project_path)
+        for visible in self._role_visible.values():
+            visible.discard(project_path)
+        if not grants:
+            self._grants.pop(project_path, None)
+            return
+        for role, user_id in grants:
+            if user_id is not None:
+                self._project_users.setdefault(project_path, set()).add(user_id)
+            if role == 'admin':
+                self._admin_locked.add(project_path)
+            if user_id is None:
+                if role in ('user', 'viewer'):
+                    self._role_editable.add(project_path)
+                for user_role, permitted in ROLE_PERMISSIONS.items():
+                    if permitted and role in permitted:
+                        self._role_visible[user_role].add(project_path)
+
+    def _changed(self):
+        # The in-place update only stands for the whole index if no other process changed
+        # grants since it was loaded; otherwise the next query reloads
+        self._loaded_stamp = self._stamp.bump_from(self._loaded_stamp)
+
+    # --- queries ---
+    def can_access(self, project_path, user):
+        with self._lock:
+            self._ensure_loaded()
+            # Public if no records
+            if project_path not in self._grants:
+                return True
+            # Individual grant override
+            if user.id in self._project_users.get(project_path, ()):
+                return True
+            # Admin sees everything
+            if user.role == 'admin':
+                return True
+            # Role-based grants
+            return project_path in self._role_visible.get(user.role, ())
+
+    def can_edit(self, project_path, user):
+        with self._lock:
+            self._ensure_loaded()
+            if user.role == 'admin':
+                return True
+            if project_path not in self._grants:
+                return user.role == 'user'
+            if user.id in self._project_users.get(project_path, ()):
+                return True
+            if project_path in self._admin_locked:
+                return False
+            return user.role == 'user' and project_path in self._role_editable
+
+    # --- updates (call after the database commit) ---
+    def add_grant(self, project_path, role, user_id):
+        with self._lock:
+            self._ensure_loaded()
+            self._grants.setdefault(project_path, Counter())[(role, user_id)] += 1
+            self._reindex(project_path)
+            self._changed()
+
+    def set_role_grant(self, project_path, role):
+        """Role-based records are single per project: replaces any existing one."""
+        with self._lock:
+            self._ensure_loaded()
+            grants = self._grants.setdefault(project_path, Counter())
+            for key in [k for k in grants if k[1] is None]:
+                del grants[key]
+            grants[(role, None)] += 1
+            self._reindex(project_path)
+            self._changed()
+
+    def remove_grant(self, project_path, role, user_id):
+        with self._lock:
+            self._ensure_loaded()
+            grants = self._grants.get(project_path)
+            if grants and grants[(role, user_id)] > 0:
+                grants[(role, user_id)] -= 1
+                if grants[(role, user_id)] == 0:
+                    del grants[(role, user_id)]
+                self._reindex(project_path)
+            self._changed()
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._ensure_loaded()
+            affected = [path for path, users in self._project_users.items() if user_id in users]
+            for project_path in affected:
+                grants = self._grants[project_path]
+                for key in [k for k in grants if k[1] == user_id]:
+                    del grants[key]
+                self._reindex(project_path)
+            self._changed()
+
+    def rename_project(self, old_path, new_path):
+        with self._lock:
+            self._ensure_loaded()
+            grants = self._grants.pop(old_path, None)
+            self._reindex(old_path)
+            if grants:
+                self._grants[new_path] = grants
+                self._reindex(new_path)
+            self._changed()
+
+    def remove_project(self, project_path):
+        with self._lock:
+            self._ensure_loaded()
+            self._grants.pop(project_path, None)
+            self._reindex(project_path)
+            self._changed()
+
+
+acl_index = AclIndex()
 
 
 def can_access(project_path: str, user) -> bool:
@@ -920,55 +4308,24 @@ def can_access(project_path: str, user) -> bool:
     Determine if `user` can access project at `project_path`.
     Individual grants always override role restrictions.
     """
-    visibilities = VISIBILITY_MAP.get(project_path, [])
-    # Public if no records
-    if not visibilities:
-        return True
-    # Individual grant override
-    if any(v.user_id == user.id for v in visibilities):
-        return True
-    # Admin sees everything
-    if user.role == 'admin':
-        return True
-    # Role-based grants
-    permitted = ROLE_PERMISSIONS.get(user.role, []) or []
-    if any(v.user_id is None and v.role in permitted for v in visibilities):
-        return True
-    # No access
-    return False
+    return acl_index.can_access(project_path, user)
 
 from collections import defaultdict
 
 @app.route('/library', methods=['GET'])
 @login_required
 def library():
-    # Load directory listing safely
-    try:
-        all_projects = [p for p in os.listdir(PROJECTS_DIR)
-                        if os.path.isdir(os.path.join(PROJECTS_DIR, p))]
-    except FileNotFoundError:
-        all_projects = []
-
-    # Preload all visibility records
-    global VISIBILITY_MAP
-    VISIBILITY_MAP = load_visibility_map()
-
-    # Filter projects by access
-    allowed_projects = [p for p in all_projects
-                        if can_access(os.path.join(PROJECTS_DIR, p), current_user)]
-
-    # Sort and paginate
-    favorites = load_favorites()
-    favorite_projects = [p for p in allowed_projects if p in favorites]
-    other_projects = [p for p in allowed_projects if p not in favorites]
-    projects_to_display = favorite_projects + other_projects
+    user = current_user
 
+    # The catalog is already sorted favorites first; filter by access and paginate
     page = int(request.args.get('page', 1))
     per_page = 20
     start = (page - 1) * per_page
-    end = start + per_page
-    page_items = projects_to_display[start:end]
-    has_more = end < len(projects_to_display)
+    favorites = favorites_store.names(user)
+    entries, has_more = project_catalog.library_page(
+        lambda name: can_access(os.path.join(PROJECTS_DIR, name), user), start, per_page,
+        favorites if favorites_store.per_user else None)
+    page_items = [entry.name for entry in entries]
 
     return render_template(
         'index.html',
@@ -983,28 +4340,12 @@ def library():
 def search_projects():
     query = request.args.get('query', '').strip().lower()
     try:
-        # Load project list
-        all_projects = [p for p in os.listdir(PROJECTS_DIR)
-                        if os.path.isdir(os.path.join(PROJECTS_DIR, p))]
-
-        # Preload visibility records
-        global VISIBILITY_MAP
-        VISIBILITY_MAP = load_visibility_map()
-
-        allowed = []
-        for project_name in all_projects:
-            # Apply search filter
-            if query and query not in project_name.lower():
-                continue
-
-            project_path = os.path.join(PROJECTS_DIR, project_name)
-            if can_access(project_path, current_user):
-                allowed.append(project_name)
-
-        allowed.sort()
+        user = current_user
         offset = int(request.args.get('offset', 0))
         limit = int(request.args.get('limit', 10))
-        paginated = allowed[offset: offset + limit]
+        entries = project_catalog.search(
+            query, lambda name: can_access(os.path.join(PROJECTS_DIR, name), user), offset, limit)
+        paginated = [entry.name for entry in entries]
 
         return jsonify({'success': True, 'projects': paginated})
 
@@ -1012,6 +4353,208 @@ def search_projects():
         return jsonify({'success': False, 'error': str(e)}), 500
         
 
+# ===================== Full-text content search =====================
+# An SQLite FTS5 index over the text of every index.html, kept under instance/.
+app.config.setdefault('SEARCH_INDEX_DB', os.path.join(app.instance_path, 'search_index.db'))
+SEARCH_RESYNC_INTERVAL = 600  # seconds between full checks for documents changed outside the app
+
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'pre', 'blockquote', 'section', 'article', 'table', 'ul', 'ol', 'hr'}
+    SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(markup):
+    """Visible text of an HTML document, with whitespace collapsed."""
+    parser = _TextExtractor()
+    parser.feed(markup)
+    parser.close()
+    return ' '.join(''.join(parser.parts).split())
+
+
+class ContentSearchIndex:
+    """
+    Persistent inverted index of project documents. Saves queue a reindex of the project,
+    which a background worker applies (coalescing bursts of autosaves). A periodic sync
+    picks up documents changed outside the app.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS indexed_doc (project TEXT PRIMARY KEY, version TEXT NOT NULL)')
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS doc_text USING fts5(
+            project UNINDEXED, body, tokenize = 'unicode61 remove_diacritics 2')""")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    # --- updates ---
+    def schedule(self, project_name):
+        """Queues a reindex of the project (called after saves)."""
+        with self._pending_lock:
+            self._pending.add(project_name)
+        self._wakeup.set()
+
+    def pending(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def index_project(self, project_name):
+        conn = self._connection()
+        try:
+            # Checked against the file stamps so that a resync of unchanged projects neither
+            # replays their documents nor pushes them through the document cache
+            version = repr(project_store.stamp(project_name))
+            row = conn.execute('SELECT version FROM indexed_doc WHERE project = ?', (project_name,)).fetchone()
+            if row and row[0] == version:
+                return
+            content, _ = project_store.read(project_name)
+        except FileNotFoundError:
+            self.remove_project(project_name)
+            return
+        text = html_to_text(content)
+        with conn:
+            conn.execute('DELETE FROM doc_text WHERE project = ?', (project_name,))
+            conn.execute('INSERT INTO doc_text (project, body) VALUES (?, ?)', (project_name, text))
+            conn.execute('INSERT OR REPLACE INTO indexed_doc (project, version) VALUES (?, ?)', (project_name, version))
+
+    def remove_project(self, project_name):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM doc_text WHERE project = ?', (project_name,))
+            conn.execute('DELETE FROM indexed_doc WHERE project = ?', (project_name,))
+
+    def rename_project(self, old_name, new_name):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM doc_text WHERE project = ?', (new_name,))
+            conn.execute('DELETE FROM indexed_doc WHERE project = ?', (new_name,))
+            conn.execute('UPDATE doc_text SET project = ? WHERE project = ?', (new_name, old_name))
+            conn.execute('UPDATE indexed_doc SET project = ? WHERE project = ?', (new_name, old_name))
+
+    def sync(self):
+        """Indexes new or changed documents and drops documents of projects that are gone."""
+        projects = set(project_catalog.names())
+        indexed = {row[0] for row in self._connection().execute('SELECT project FROM indexed_doc')}
+        for project_name in indexed - projects:
+            self.remove_project(project_name)
+        for project_name in projects:
+            self.index_project(project_name)
+
+    def run(self):
+        """Background loop: applies queued reindexes, and resyncs everything now and then."""
+        next_sync = 0
+        while True:
+            self._wakeup.wait(timeout=SEARCH_RESYNC_INTERVAL)
+            self._wakeup.clear()
+            try:
+                if time.time() >= next_sync:
+                    next_sync = time.time() + SEARCH_RESYNC_INTERVAL
+                    self.sync()
+                with self._pending_lock:
+                    pending, self._pending = self._pending, set()
+                for project_name in pending:
+                    self.index_project(project_name)
+            except Exception as e:
+                app.logger.error("Search index error: %s", e)
+
+    # --- queries ---
+    @staticmethod
+    def _match_expression(query):
+        """Turns free text into an FTS5 query: all words must match, the last one as a prefix."""
+        words = query.split()
+        if not words:
+            return None
+        terms = ['"{}"'.format(w.replace('"', '""')) for w in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, query, allowed, offset=0, limit=10, batch_size=50):
+        """Ranked hits passing allowed(project_name); returns (hits, has_more)."""
+        expression = self._match_expression(query)
+        if expression is None:
+            return [], False
+        conn = self._connection()
+        hits, seen, position = [], 0, 0
+        while True:
+            rows = conn.execute(
+                """SELECT project, snippet(doc_text, 1, char(2), char(3), '…', 16), bm25(doc_text)
+                   FROM doc_text WHERE doc_text MATCH ? ORDER BY bm25(doc_text) LIMIT ? OFFSET ?""",
+                (expression, batch_size, position)).fetchall()
+            for project_name, snippet, score in rows:
+                if not allowed(project_name):
+                    continue
+                if seen >= offset + limit:
+                    return hits, True
+                if seen >= offset:
+                    snippet = html.escape(snippet).replace('\x02', '<mark>').replace('\x03', '</mark>')
+                    hits.append({'project': project_name, 'snippet': snippet, 'score': round(-score, 4)})
+                seen += 1
+            if len(rows) < batch_size:
+                return hits, False
+            position += batch_size
+
+
+content_index = ContentSearchIndex(app.config['SEARCH_INDEX_DB'])
+
+
+@background_worker
+def content_indexer():
+    content_index.run()
+
+
+@app.route('/search_content', methods=['GET'])
+@login_required
+def search_content():
+    query = request.args.get('query', '').strip()
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = min(int(request.args.get('limit', 10)), 50)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid offset or limit'}), 400
+
+    user = current_user
+    try:
+        hits, has_more = content_index.search(
+            query, lambda name: can_access(os.path.join(PROJECTS_DIR, name), user), offset, limit)
+        return jsonify({'success': True, 'results': hits, 'has_more': has_more})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/search_user')
 @login_required
 @roles_required('user', 'admin')
@@ -1044,6 +4587,7 @@ def admin():
             )
             db.session.add(new_user)
             db.session.commit()
+            user_cache.invalidate()
             flash(f"User {form.username.data} created!", "success")
     users = User.query.all()
     return render_template("admin.html", form=form, users=users)
@@ -1059,13 +4603,188 @@ def delete_user():
         if user.id == current_user.id:
             flash("You cannot delete yourself", "danger")
         else:
+            # Drop individual grants explicitly: otherwise the relationship would null user_id
+            # and turn them into role-based grants for everyone
+            ProjectVisibility.query.filter_by(user_id=user.id).delete()
             db.session.delete(user)
             db.session.commit()
+            acl_index.remove_user(user.id)
+            user_cache.invalidate()
             flash("User deleted", "success")
     else:
         flash("User not found", "warning")
     return redirect(url_for("admin"))
 
+# ===================== Storage manifest =====================
+# Per-project listing of uploaded files with the metadata storage.js shows, kept in the same
+# sorted-list form as the project catalog so a page is a bisect plus a slice. A project is
+# rescanned when its directory mtime changes: every file is written through os.replace (see
+# BlobStore), so additions, overwrites and deletions by any process all touch the directory.
+STORAGE_PAGE_SIZE = 200
+STORAGE_MAX_PAGE_SIZE = 1000
+STORAGE_SORTS = {
+    'name': lambda e: (e.name.lower(), e.name),
+    'size': lambda e: (e.size, e.name),
+    'mtime': lambda e: (e.mtime, e.name),
+}
+
+
+class StorageEntry:
+    __slots__ = ('name', 'size', 'mtime', 'mime')
+
+    def __init__(self, name, size, mtime, mime):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mime = mime
+
+    @classmethod
+    def from_stat(cls, name, st):
+        return cls(name, st.st_size, st.st_mtime, mimetypes.guess_type(name)[0] or 'application/octet-stream')
+
+    def to_dict(self):
+        return {'name': self.name, 'size': self.size, 'mtime': self.mtime, 'mime': self.mime}
+
+
+class _ProjectFiles:
+    __slots__ = ('key', 'entries', 'orders')
+
+    def __init__(self, key):
+        self.key = key
+        self.entries = {}
+        self.orders = {sort: SortedList(key=key_func) for sort, key_func in STORAGE_SORTS.items()}
+
+    def add(self, entry):
+        self.remove(entry.name)
+        self.entries[entry.name] = entry
+        for order in self.orders.values():
+            order.add(entry)
+
+    def remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            for order in self.orders.values():
+                order.remove(entry)
+
+
+def storage_file_listed(name):
+    """Uploaded files only: the document and the store's dotfiles are not storage."""
+    return not name.startswith('.') and name.lower() != DOCUMENT_NAME
+
+
+def encode_storage_cursor(sort, descending, entry):
+    key = list(STORAGE_SORTS[sort](entry))
+    raw = json.dumps([sort, descending, key], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_storage_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, descending, key = json.loads(raw)
+        if sort not in STORAGE_SORTS or not isinstance(key, list) or len(key) != 2:
+            raise ValueError
+        return sort, bool(descending), tuple(key)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+class StorageManifest:
+    def __init__(self, projects_dir):
+        self.projects_dir = projects_dir
+        self._lock = threading.Lock()
+        self._projects = {}
+
+    def _key(self, project_name):
+        return os.stat(os.path.join(self.projects_dir, project_name)).st_mtime_ns
+
+    def _scan(self, project_name, key):
+        files = _ProjectFiles(key)
+        with os.scandir(os.path.join(self.projects_dir, project_name)) as it:
+            for entry in it:
+                if storage_file_listed(entry.name) and entry.is_file():
+                    files.add(StorageEntry.from_stat(entry.name, entry.stat()))
+        return files
+
+    def _files(self, project_name):
+        """Must be called with the lock held."""
+        try:
+            key = self._key(project_name)
+        except FileNotFoundError:
+            self._projects.pop(project_name, None)
+            raise
+        files = self._projects.get(project_name)
+        if files is None or files.key != key:
+            files = self._projects[project_name] = self._scan(project_name, key)
+        return files
+
+    def page(self, project_name, sort='name', descending=False, cursor=None, limit=STORAGE_PAGE_SIZE):
+        """Returns (entries, next_cursor) in the requested order, starting after cursor."""
+        if cursor:
+            sort, descending, after = decode_storage_cursor(cursor)
+        elif sort not in STORAGE_SORTS:
+            raise ValueError('Unknown sort order')
+        with self._lock:
+            order = self._files(project_name).orders[sort]
+            if descending:
+                stop = order.bisect_key_left(after) if cursor else len(order)
+                page = list(order.islice(max(stop - limit, 0), stop, reverse=True))
+                has_more = stop > limit
+            else:
+                start = order.bisect_key_right(after) if cursor else 0
+                page = list(order.islice(start, start + limit))
+                has_more = start + limit < len(order)
+        next_cursor = encode_storage_cursor(sort, descending, page[-1]) if has_more and page else None
+        return [entry.to_dict() for entry in page], next_cursor
+
+    # --- hooks for routes that change files ---
+    # Routes read key() before changing the directory and pass it to added() / removed(). The
+    # entry is patched only if the cached listing was current at that point; otherwise another
+    # process changed the directory too, and the listing is rescanned on the next page().
+    def key(self, project_name):
+        try:
+            return self._key(project_name)
+        except OSError:
+            return None
+
+    def _current(self, project_name, key_before):
+        """The cached listing if it was up to date before the change, else None. Must be called with the lock held."""
+        files = self._projects.get(project_name)
+        if files is not None and files.key != key_before:
+            del self._projects[project_name]
+            return None
+        return files
+
+    def added(self, project_name, filename, key_before):
+        """Records a file written into the project (new or overwritten in place)."""
+        if not storage_file_listed(filename):
+            return
+        with self._lock:
+            files = self._current(project_name, key_before)
+            if files is None:
+                return
+            try:
+                files.add(StorageEntry.from_stat(filename, os.stat(os.path.join(self.projects_dir, project_name, filename))))
+                files.key = self._key(project_name)
+            except OSError:
+                self._projects.pop(project_name, None)
+
+    def removed(self, project_name, filenames, key_before):
+        with self._lock:
+            files = self._current(project_name, key_before)
+            if files is None:
+                return
+            for filename in filenames:
+                files.remove(filename)
+            try:
+                files.key = self._key(project_name)
+            except OSError:
+                self._projects.pop(project_name, None)
+
+
+storage_manifest = StorageManifest(PROJECTS_DIR)
+
+
 # ===========================================
 # Endpoint for Storage_api
 # ===========================================
@@ -1087,21 +4806,33 @@ def storage_api():
 
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
 
     project_path = os.path.join(PROJECTS_DIR, project_name)
     if not os.path.exists(project_path):
         return jsonify({'success': False, 'error': 'Project not found'}), 404
 
     if request.method == 'GET':
+        limit = min(max(request.args.get('limit', STORAGE_PAGE_SIZE, type=int), 1), STORAGE_MAX_PAGE_SIZE)
         try:
-            # Get only files, excluding index.html (case-insensitive)
-            files = [
-                f for f in os.listdir(project_path)
-                if os.path.isfile(os.path.join(project_path, f)) and f.lower() != 'index.html'
-            ]
-            return jsonify({'success': True, 'files': files})
+            entries, next_cursor = storage_manifest.page(
+                project_name,
+                sort=request.args.get('sort', 'name'),
+                descending=request.args.get('order') == 'desc',
+                cursor=request.args.get('cursor'),
+                limit=limit,
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
+        return jsonify({
+            'success': True,
+            'files': [entry['name'] for entry in entries],
+            'entries': entries,
+            'next_cursor': next_cursor,
+        })
 
 
     elif request.method == 'DELETE':
@@ -1117,15 +4848,19 @@ def storage_api():
             files_to_delete = [files_to_delete]
 
         errors = []
+        deleted = []
+        key_before = storage_manifest.key(project_name)
         for filename in files_to_delete:
             file_path = os.path.join(project_path, filename)
             try:
                 if os.path.exists(file_path):
-                    os.remove(file_path)
+                    blob_store.remove(file_path)
+                    deleted.append(filename)
                 else:
                     errors.append(f"File {filename} not found.")
             except Exception as e:
                 errors.append(f"Error deleting {filename}: {str(e)}")
+        storage_manifest.removed(project_name, deleted, key_before)
         if errors:
             return jsonify({'success': False, 'error': errors}), 500
         return jsonify({'success': True})
@@ -1138,6 +4873,8 @@ def storage_open():
     project_name = request.args.get('project_name')
     if not project_name:
         return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Invalid project name'}), 400
 
     project_path = os.path.join(PROJECTS_DIR, project_name)
     if not os.path.exists(project_path):
@@ -1154,28 +4891,391 @@ def storage_open():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ===================== Project archives =====================
+# GET /export_project streams a zip of the document and the project's files as it is generated:
+# every member is written with its sizes and CRC in the local header (a file is read twice,
+# once for the CRC), so the archive needs neither seeking nor a temporary file. POST
+# /import_project reads an archive from the request body sequentially and extracts it into a
+# staging directory that is renamed into place once the whole archive checked out. Under
+# `serve`, waitress has already spooled the body to a temporary file (in the system temp
+# directory) by then, so an import briefly needs room for the archive as well as its contents.
+app.config.setdefault('IMPORT_MAX_SIZE', 16 * 1024 ** 3)   # total uncompressed bytes
+app.config.setdefault('IMPORT_MAX_FILES', 10000)
+ARCHIVE_STAGING_DIR = os.path.join(PROJECTS_DIR, '.imports')
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP_END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+ZIP64_END_LOCATOR = struct.Struct('<IIQI')
+ZIP_LOCAL_SIGNATURE = 0x04034b50
+ZIP_CENTRAL_SIGNATURE = 0x02014b50
+ZIP_DESCRIPTOR_SIGNATURE = 0x08074b50
+ZIP_UTF8_FLAG = 0x800
+ZIP_DESCRIPTOR_FLAG = 0x08
+ZIP_LIMIT = 0xFFFFFFFF
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def zip_dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800))  # the format starts in 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipStreamWriter:
+    """Produces a zip archive (with zip64 records where needed) as a sequence of byte strings."""
+
+    def __init__(self):
+        self.offset = 0
+        self._central = []
+
+    def _entry(self, name, mtime, method, crc, compressed_size, size, chunks):
+        encoded = name.encode('utf-8')
+        dos_time, dos_date = zip_dos_time(mtime)
+        zip64 = size >= ZIP_LIMIT or compressed_size >= ZIP_LIMIT
+        extra = struct.pack('<HHQQ', 1, 16, size, compressed_size) if zip64 else b''
+        header = ZIP_LOCAL_HEADER.pack(
+            ZIP_LOCAL_SIGNATURE, 45 if zip64 else 20, ZIP_UTF8_FLAG, method, dos_time, dos_date, crc,
+            ZIP_LIMIT if zip64 else compressed_size, ZIP_LIMIT if zip64 else size, len(encoded), len(extra))
+        self._central.append((encoded, method, dos_time, dos_date, crc, compressed_size, size, self.offset))
+        self.offset += len(header) + len(encoded) + len(extra) + compressed_size
+        yield header + encoded + extra
+        yield from chunks
+
+    def add_bytes(self, name, data, mtime, compress=True):
+        if compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+        else:
+            payload = data
+        return self._entry(name, mtime, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                           zlib.crc32(data), len(payload), len(data), [payload])
+
+    def add_gzip(self, name, data, mtime):
+        """Member from a single-member gzip stream; its deflate data is copied without recompressing."""
+        flags = data[3]
+        start = 10
+        if flags & 4:  # FEXTRA
+            start += 2 + struct.unpack('<H', data[start:start + 2])[0]
+        for flag in (8, 16):  # FNAME, FCOMMENT: zero-terminated
+            if flags & flag:
+                start = data.index(b'\0', start) + 1
+        if flags & 2:  # FHCRC
+            start += 2
+        crc, size = struct.unpack('<II', data[-8:])
+        payload = data[start:-8]
+        return self._entry(name, mtime, zipfile.ZIP_DEFLATED, crc, len(payload), size, [payload])
+
+    def add_file(self, name, path, compress=False):
+        """Member generator for a file on disk; raises OSError before anything is produced."""
+        st = os.stat(path)
+        crc, size, compressed_size = 0, 0, 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(TRANSMIT_BLOCK_SIZE)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                if compressor:
+                    compressed_size += len(compressor.compress(block))
+        if compressor:
+            compressed_size += len(compressor.flush())
+        else:
+            compressed_size = size
+        return self._entry(name, st.st_mtime, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                           crc, compressed_size, size, self._file_chunks(path, crc, size, compress))
+
+    @staticmethod
+    def _file_chunks(path, expected_crc, expected_size, compress):
+        crc, size = 0, 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+        with open(path, 'rb') as f:
+            while size < expected_size:
+                block = f.read(min(TRANSMIT_BLOCK_SIZE, expected_size - size))
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                yield compressor.compress(block) if compressor else block
+        if compressor:
+            yield compressor.flush()
+        if crc != expected_crc or size != expected_size:
+            # The header is already sent; a broken stream is better than an archive with wrong data
+            raise ArchiveError(f'{path} changed during export')
+
+    def finish(self):
+        central = []
+        for encoded, method, dos_time, dos_date, crc, compressed_size, size, offset in self._central:
+            zip64_fields = [value for value in (size, compressed_size, offset) if value >= ZIP_LIMIT]
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b''
+            central.append(ZIP_CENTRAL_HEADER.pack(
+                ZIP_CENTRAL_SIGNATURE, (3 << 8) | 45, 45 if zip64_fields else 20, ZIP_UTF8_FLAG, method,
+                dos_time, dos_date, crc, min(compressed_size, ZIP_LIMIT), min(size, ZIP_LIMIT),
+                len(encoded), len(extra), 0, 0, 0, 0o100644 << 16, min(offset, ZIP_LIMIT)) + encoded + extra)
+        central = b''.join(central)
+        count, start = len(self._central), self.offset
+        tail = b''
+        if count >= 0xFFFF or start >= ZIP_LIMIT or len(central) >= ZIP_LIMIT:
+            zip64_end = start + len(central)
+            tail = (ZIP64_END_RECORD.pack(0x06064b50, 44, (3 << 8) | 45, 45, 0, 0, count, count, len(central), start)
+                    + ZIP64_END_LOCATOR.pack(0x07064b50, 0, zip64_end, 1))
+        tail += ZIP_END_RECORD.pack(0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                    min(len(central), ZIP_LIMIT), min(start, ZIP_LIMIT), 0)
+        self.offset += len(central) + len(tail)
+        return central + tail
+
+
+def export_project_chunks(project_name):
+    """Yields the zip archive of a project: index.html from the project store, then every storage file."""
+    project_path = os.path.join(PROJECTS_DIR, project_name)
+    writer = ZipStreamWriter()
+    document, _ = project_store.read_gzip(project_name)
+    yield from writer.add_gzip(DOCUMENT_NAME, document, os.stat(project_store.document_path(project_name)).st_mtime)
+    with os.scandir(project_path) as it:
+        names = sorted(entry.name for entry in it if storage_file_listed(entry.name) and entry.is_file())
+    for name in names:
+        mime_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        try:
+            member = writer.add_file(name, os.path.join(project_path, name), compress=is_compressible(mime_type))
+        except FileNotFoundError:
+            continue  # deleted since the listing
+        yield from member
+    yield writer.finish()
+
+
+class ZipStreamReader:
+    """Reads the members of a zip archive front to back from a non-seekable stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffer = b''
+
+    def _read_some(self, limit):
+        if self._buffer:
+            data, self._buffer = self._buffer[:limit], self._buffer[limit:]
+            return data
+        return self.stream.read(min(limit, TRANSMIT_BLOCK_SIZE))
+
+    def _read(self, size):
+        parts = []
+        while size:
+            data = self._read_some(size)
+            if not data:
+                raise ArchiveError('The archive is truncated')
+            parts.append(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def members(self):
+        """Yields (name, chunks) per file member; chunks must be consumed before the next member."""
+        while True:
+            header = self._read(4)
+            (signature,) = struct.unpack('<I', header)
+            if signature != ZIP_LOCAL_SIGNATURE:
+                if signature == ZIP_CENTRAL_SIGNATURE:
+                    return  # the central directory repeats what was already read
+                raise ArchiveError('Not a zip archive')
+            fields = ZIP_LOCAL_HEADER.unpack(header + self._read(ZIP_LOCAL_HEADER.size - 4))
+            _, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length = fields
+            raw_name = self._read(name_length)
+            extra = self._read(extra_length)
+            name = raw_name.decode('utf-8' if flags & ZIP_UTF8_FLAG else 'cp437', errors='replace')
+            zip64 = False
+            while len(extra) >= 4:
+                tag, length = struct.unpack('<HH', extra[:4])
+                if tag == 1:
+                    zip64 = True
+                    values = list(struct.unpack(f'<{length // 8}Q', extra[4:4 + length - length % 8]))
+                    if size == ZIP_LIMIT and values:
+                        size = values.pop(0)
+                    if compressed_size == ZIP_LIMIT and values:
+                        compressed_size = values.pop(0)
+                extra = extra[4 + length:]
+            if flags & 0x1:
+                raise ArchiveError(f'{name}: encrypted archives are not supported')
+            if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise ArchiveError(f'{name}: unsupported compression method')
+            descriptor = bool(flags & ZIP_DESCRIPTOR_FLAG)
+            if descriptor and method == zipfile.ZIP_STORED:
+                raise ArchiveError(f'{name}: uncompressed members without sizes are not supported')
+            yield name, self._member_chunks(name, method, descriptor, crc, compressed_size, size, zip64)
+
+    def _member_chunks(self, name, method, descriptor, crc, compressed_size, size, zip64):
+        actual_crc, actual_size = 0, 0
+        if method == zipfile.ZIP_STORED:
+            remaining = compressed_size
+            while remaining:
+                data = self._read_some(remaining)
+                if not data:
+                    raise ArchiveError('The archive is truncated')
+                remaining -= len(data)
+                actual_crc = zlib.crc32(data, actual_crc)
+                actual_size += len(data)
+                yield data
+        else:
+            decompressor = zlib.decompressobj(-15)
+            remaining = None if descriptor else compressed_size
+            while not decompressor.eof:
+                data = self._read_some(TRANSMIT_BLOCK_SIZE if remaining is None else min(remaining, TRANSMIT_BLOCK_SIZE))
+                if not data:
+                    raise ArchiveError('The archive is truncated')
+                if remaining is not None:
+                    remaining -= len(data)
+                while data:
+                    output = decompressor.decompress(data, TRANSMIT_BLOCK_SIZE)
+                    data = decompressor.unconsumed_tail
+                    if output:
+                        actual_crc = zlib.crc32(output, actual_crc)
+                        actual_size += len(output)
+                        yield output
+            self._buffer = decompressor.unused_data + self._buffer
+            if remaining:
+                self._read(remaining)
+        if descriptor:
+            (value,) = struct.unpack('<I', self._read(4))
+            if value == ZIP_DESCRIPTOR_SIGNATURE:
+                (value,) = struct.unpack('<I', self._read(4))
+            crc = value
+            size = struct.unpack('<QQ' if zip64 else '<II', self._read(16 if zip64 else 8))[1]
+        if actual_crc != crc or actual_size != size:
+            raise ArchiveError(f'{name}: checksum mismatch')
+
+
+def archive_member_path(name, prefix):
+    """
+    Maps an archive member name to a file name in the project, or None to skip it. Projects are
+    flat, so a member may only be nested in a single top-level folder (prefix, shared by all).
+    Returns (file_name, prefix).
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or name.endswith('/') or parts[0] == '__MACOSX':
+        return None, prefix
+    if name.startswith('/') or '..' in parts or ':' in parts[0]:
+        raise ArchiveError(f'{name}: unsafe path')
+    if len(parts) == 2:
+        if prefix is None:
+            prefix = parts[0]
+        if parts[0] != prefix:
+            raise ArchiveError(f'{name}: nested folders are not supported')
+        parts = parts[1:]
+    if len(parts) != 1:
+        raise ArchiveError(f'{name}: nested folders are not supported')
+    file_name = parts[0]
+    if file_name.startswith('.'):
+        return None, prefix
+    if file_name.lower() == DOCUMENT_NAME:
+        file_name = DOCUMENT_NAME
+    elif upload_filename(file_name) != file_name:
+        raise ArchiveError(f'{name}: invalid file name')
+    return file_name, prefix
+
+
+def import_project_archive(project_name, stream, max_size, max_files):
+    """Extracts the archive into a staging directory and moves it to the new project. Returns the file count."""
+    os.makedirs(ARCHIVE_STAGING_DIR, exist_ok=True)
+    staging = os.path.join(ARCHIVE_STAGING_DIR, f'{os.getpid()}-{time.time_ns()}')
+    os.makedirs(staging)
+    try:
+        total, seen, prefix = 0, set(), None
+        for name, chunks in ZipStreamReader(stream).members():
+            file_name, prefix = archive_member_path(name, prefix)
+            if file_name is None:
+                for _ in chunks:
+                    pass
+                continue
+            if file_name in seen:
+                raise ArchiveError(f'{name}: duplicate file')
+            seen.add(file_name)
+            if len(seen) > max_files:
+                raise ArchiveError(f'The archive has more than {max_files} files')
+            target = os.path.join(staging, file_name)
+            # Media goes through the blob store like uploads; the document is per project anyway
+            tmp_path = target if file_name == DOCUMENT_NAME else blob_store.temp_path()
+            digest = hashlib.sha256()
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for data in chunks:
+                        total += len(data)
+                        if total > max_size:
+                            raise ArchiveError(f'The archive unpacks to more than {max_size} bytes')
+                        digest.update(data)
+                        f.write(data)
+                if tmp_path != target:
+                    blob_store.save(tmp_path, digest.hexdigest(), target)
+            finally:
+                if tmp_path != target and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        if DOCUMENT_NAME not in seen:
+            raise ArchiveError(f'The archive has no {DOCUMENT_NAME}')
+        project_path = os.path.join(PROJECTS_DIR, project_name)
+        if os.path.exists(project_path):
+            raise ArchiveError('Project already exists')
+        os.rename(staging, project_path)
+        return len(seen)
+    finally:
+        blob_store.remove_tree(staging, ignore_errors=True)
+
+
+@app.route('/export_project', methods=['GET'])
+@login_required
+def export_project():
+    project_name = request.args.get('project_name')
+    if not is_project_name(project_name):
+        return jsonify({'success': False, 'error': 'Project name required'}), 400
+    project_path = os.path.join(PROJECTS_DIR, project_name)
+    if not os.path.exists(project_store.document_path(project_name)):
+        return jsonify({'success': False, 'error': 'Project not found'}), 404
+    if not can_access(project_path, current_user):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    response = Response(export_project_chunks(project_name), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(project_name)}.zip"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/import_project', methods=['POST'])
+@login_required
+@roles_required("user", "admin")
+def import_project():
+    project_name = (request.args.get('project_name') or '').strip()
+    if not project_name:
+        return jsonify({'success': False, 'error': 'Project name required'}), 400
+    if not PROJECT_NAME_PATTERN.match(project_name):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid characters. Allowed: letters, numbers, spaces, - and _'
+        }), 400
+    if os.path.exists(os.path.join(PROJECTS_DIR, project_name)):
+        return jsonify({'success': False, 'error': 'Project already exists'}), 409
+    if request.mimetype == 'multipart/form-data':
+        return jsonify({'success': False, 'error': 'Send the archive as the request body'}), 400
+    max_size = app.config['IMPORT_MAX_SIZE']
+    if request.content_length and request.content_length > max_size:
+        return jsonify({'success': False, 'error': f'The archive is larger than {max_size} bytes'}), 413
+    try:
+        count = import_project_archive(project_name, request.stream, max_size, app.config['IMPORT_MAX_FILES'])
+    except ArchiveError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    project_catalog.added(project_name)
+    content_index.schedule(project_name)
+    return jsonify({'success': True, 'project': project_name, 'files': count})
+
+
 from wtforms import BooleanField
 from sqlalchemy import case, func
-from sortedcontainers import SortedList
 
 
 # Endpoint for serving files from the files folder
 @app.route('/files/<path:filename>', methods=['GET'])
 def serve_files(filename):
-    # Base directory for files
-    base_dir = os.path.join(os.getcwd(), 'templates', 'files')
-    # Form the full path to the file
-    file_path = os.path.join(base_dir, filename)
-    
-    # If the requested file does not exist or is a directory, return 404
-    if not os.path.exists(file_path) or os.path.isdir(file_path):
-        abort(404)
-    
-    # Serve the file from the corresponding directory.
-    # as_attachment=False — the file will be opened inline (if the browser can display it)
-    directory = os.path.dirname(file_path)
-    file_name = os.path.basename(file_path)
-    return send_from_directory(directory, file_name, as_attachment=False)
+    # Base directory for files; the file is opened inline (if the browser can display it)
+    return send_static_asset(os.path.join(app.template_folder, 'files'), filename)
 
 
 # ------------------- Public Access  -------------------
@@ -1185,24 +5285,168 @@ class SharedProject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     share_id = db.Column(db.String(100), unique=True, nullable=False)  # Access identifier, set by the user
     project_path = db.Column(db.String(200), nullable=False)  # Absolute path to the project file
+    project_name = db.Column(db.String(200), index=True)  # Project directory name, for lookups by project
+
+
+def migrate_shared_projects():
+    """Adds and backfills SharedProject.project_name in databases created before the column existed."""
+    columns = [row[1] for row in db.session.execute(db.text('PRAGMA table_info(shared_project)'))]
+    if 'project_name' not in columns:
+        db.session.execute(db.text('ALTER TABLE shared_project ADD COLUMN project_name VARCHAR(200)'))
+        db.session.execute(db.text('CREATE INDEX IF NOT EXISTS ix_shared_project_project_name ON shared_project (project_name)'))
+    for shared in SharedProject.query.filter(SharedProject.project_name.is_(None)):
+        shared.project_name = os.path.basename(os.path.dirname(shared.project_path))
+    db.session.commit()
+
+
+class PublicProjects:
+    """
+    The names of the projects anonymous visitors may read: shared projects and the main screen.
+    Loaded once, and reloaded after /access and /get_main change it (in any worker process).
+    """
+
+    def __init__(self):
+        self._names = None
+        self._lock = threading.Lock()
+        self._stamp = ChangeStamp('public_projects')
+        self._loaded_stamp = None
+
+    def _load(self):
+        names = {name for (name,) in db.session.query(SharedProject.project_name)}
+        main = MainMenu.query.first()
+        if main:
+            names.add(os.path.basename(os.path.dirname(main.project_path)))
+        return frozenset(names)
+
+    def contains(self, project_name):
+        stamp = self._stamp.current()
+        if self._names is None or stamp != self._loaded_stamp:
+            with self._lock:
+                if self._names is None or stamp != self._loaded_stamp:
+                    self._names = self._load()
+                    self._loaded_stamp = stamp
+        return project_name in self._names
+
+    def changed(self):
+        self._stamp.bump()
+
+    def version(self):
+        return self._stamp.current()
+
+
+public_projects = PublicProjects()
+
+
+# Rendered public pages: / and /open/<share_id>
+PAGE_CACHE_SIZE = 128
+
+
+class CachedPage:
+    __slots__ = ('version', 'html', 'gzipped', 'etag')
+
+    def __init__(self, version, html_bytes):
+        self.version = version
+        self.html = html_bytes
+        self.gzipped = gzip.compress(html_bytes, 6) if len(html_bytes) >= GZIP_MIN_SIZE else None
+        self.etag = hashlib.sha1(html_bytes).hexdigest()[:20]
+
+
+class PageCache:
+    """
+    Rendered pages with their gzip variant and ETag. A page is reused while its document is
+    unchanged; which document a page shows is looked up again only after /access or /get_main
+    changed the public projects.
+    """
+
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        self.size = size
+        self._pages = OrderedDict()
+        self._targets = {}
+        self._targets_version = None
+        self._lock = threading.Lock()
+
+    def _target(self, key, resolve):
+        version = public_projects.version()
+        with self._lock:
+            if version != self._targets_version:
+                self._targets.clear()
+                self._pages.clear()
+                self._targets_version = version
+            path = self._targets.get(key)
+        if path is None:
+            # Unknown keys are not remembered, so probing random share ids cannot grow the cache
+            path = resolve()
+            if path is not None:
+                with self._lock:
+                    if self._targets_version == version:
+                        self._targets[key] = path
+        return path
+
+    def page(self, key, resolve, render):
+        """Returns the CachedPage for key, or None if resolve() finds no document to show."""
+        path = self._target(key, resolve)
+        if path is None or not os.path.isfile(path):
+            return None
+        version = document_version(path)
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached is not None and cached.version == version:
+                self._pages.move_to_end(key)
+                return cached
+        page = CachedPage(version, render(read_document(path)).encode('utf-8'))
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+        return page
+
+
+page_cache = PageCache()
+
+
+def document_version(path):
+    project_name = project_store.project_from_path(path)
+    if project_name is not None:
+        return project_store.version(project_name)
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def page_response(page):
+    """Sends a cached page; clients revalidate with the ETag on every visit."""
+    if request.if_none_match.contains_weak(page.etag):
+        response = Response(status=304)
+    elif page.gzipped is not None and accepts_gzip():
+        response = Response(page.gzipped, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(page.html, mimetype='text/html')
+    response.set_etag(page.etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def shared_project_path(share_id):
+    shared = SharedProject.query.filter_by(share_id=share_id).first()
+    return shared.project_path if shared else None
 
 
 @app.route('/open/<share_id>', methods=['GET'])
 def open_shared_project(share_id):
-    shared = SharedProject.query.filter_by(share_id=share_id).first()
-    if shared:
-        if os.path.exists(shared.project_path):
-            try:
-                with open(shared.project_path, 'r', encoding='utf-8') as f:
-                    project_content = f.read()
-                # Render the template without the toolbar and project list
-                return render_template('shared_project.html', project_content=project_content)
-            except Exception as e:
-                return render_template('error.html', error=str(e)), 500
-        else:
-            return render_template('error.html', error='Project file not found'), 404
-    else:
-        return render_template('error.html', error='Public access for this identifier was not found. Please select a project for public access.'), 404
+    try:
+        # Render the template without the toolbar and project list
+        page = page_cache.page(('share', share_id), lambda: shared_project_path(share_id),
+                               lambda content: render_template('shared_project.html', project_content=content))
+    except Exception as e:
+        return render_template('error.html', error=str(e)), 500
+    if page is not None:
+        return page_response(page)
+    if shared_project_path(share_id):
+        return render_template('error.html', error='Project file not found'), 404
+    return render_template('error.html', error='Public access for this identifier was not found. Please select a project for public access.'), 404
 
 
 @app.route('/access', methods=['GET', 'POST', 'DELETE'])
@@ -1227,7 +5471,7 @@ def manage_access():
     
     if request.method == 'GET':
         # Check if the project is open for public access
-        shared = SharedProject.query.filter_by(project_path=project_file).first()
+        shared = SharedProject.query.filter_by(project_name=project_name).first()
         if shared:
             share_url = url_for('open_shared_project', share_id=shared.share_id, _external=True)
             return jsonify({'success': True, 'access': True, 'share_url': share_url})
@@ -1249,19 +5493,21 @@ def manage_access():
         if SharedProject.query.filter_by(share_id=share_id).first():
             return jsonify({'success': False, 'error': 'This share_id is already in use'})
         
-        new_shared = SharedProject(share_id=share_id, project_path=project_file)
+        new_shared = SharedProject(share_id=share_id, project_path=project_file, project_name=project_name)
         db.session.add(new_shared)
         db.session.commit()
+        public_projects.changed()
         share_url = url_for('open_shared_project', share_id=share_id, _external=True)
         return jsonify({'success': True, 'message': 'Access granted', 'share_url': share_url})
     
     elif request.method == 'DELETE':
         # Revoke public access – delete the record from the database
-        shared = SharedProject.query.filter_by(project_path=project_file).first()
+        shared = SharedProject.query.filter_by(project_name=project_name).first()
         if not shared:
             return jsonify({'success': False, 'error': 'Public access for this project not found'})
         db.session.delete(shared)
         db.session.commit()
+        public_projects.changed()
         return jsonify({'success': True, 'message': 'Public access closed'})
 
 @app.route('/get_project_name/<share_id>', methods=['GET'])
@@ -1364,14 +5610,25 @@ def pomidoro():
 
 
 # ------------------- Application Start -------------------
+# `python main.py serve` runs a supervisor that owns the listening socket and starts --workers
+# waitress processes with --threads threads each, all accepting on that socket. A reload (SIGHUP,
+# or `python main.py reload` from any shell) starts a fresh set of workers, waits until they are
+# ready, then lets the old ones finish their requests: no connection is refused meanwhile.
+SERVE_GRACEFUL_TIMEOUT = 30
+SERVE_POLL_INTERVAL = 1
+WORKER_READY = b'WORKSHOP_WORKER_READY'
+
+
 def load_user_config():
     with open('user_config.json', 'r') as f:
         return json.load(f)
 
-if __name__ == '__main__':
+
+def init_database():
     user_data = load_user_config()
     with app.app_context():
         db.create_all()
+        migrate_shared_projects()
         if not User.query.filter_by(username=user_data["username"]).first():
             admin_user = User(
                 username=user_data["username"],
@@ -1380,4 +5637,214 @@ if __name__ == '__main__':
             )
             db.session.add(admin_user)
             db.session.commit()
-    app.run(host='0.0.0.0', port=8000, debug=False, use_reloader=False)
\ No newline at end of file
+
+
+class WorkerProcess:
+    def __init__(self, sock, threads, env):
+        args = [sys.executable, os.path.abspath(__file__), 'serve', '--worker', '--threads', str(threads)]
+        if os.name == 'nt':
+            # Windows cannot inherit sockets by descriptor; the socket is duplicated through stdin instead.
+            self.process = subprocess.Popen(args + ['--socket', 'stdin'], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, env=env,
+                                            creationflags=subprocess.CREATE_NO_WINDOW)
+            shared = sock.share(self.process.pid)
+            self.process.stdin.write(len(shared).to_bytes(4, 'big') + shared)
+            self.process.stdin.flush()
+        else:
+            self.process = subprocess.Popen(args + ['--socket', str(sock.fileno())], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, env=env, pass_fds=(sock.fileno(),))
+        self.ready = threading.Event()
+        threading.Thread(target=self._forward_output, daemon=True).start()
+
+    def _forward_output(self):
+        for line in self.process.stdout:
+            if line.strip() == WORKER_READY:
+                self.ready.set()
+            else:
+                sys.stdout.buffer.write(line)
+                sys.stdout.flush()
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        """Asks the worker to finish its in-flight requests and exit, by closing its stdin."""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+
+class Supervisor:
+    def __init__(self, host, port, workers, threads):
+        self.sock = socket.create_server((host, port), backlog=2048)
+        self.workers = workers
+        self.threads = threads
+        self.env = dict(os.environ)
+        if workers > 1:
+            # Edit leases have to be shared between the worker processes.
+            self.env.setdefault('WORKSHOP_LEASE_BACKEND', 'sqlite')
+        self.current = []
+        self.retiring = []
+        self.reload_stamp = ChangeStamp('reload')
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def spawn(self):
+        return [WorkerProcess(self.sock, self.threads, self.env) for _ in range(self.workers)]
+
+    def reload(self):
+        print('Reloading workers', flush=True)
+        fresh = self.spawn()
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT
+        for worker in fresh:
+            worker.ready.wait(max(0, deadline - time.monotonic()))
+        if not all(worker.ready.is_set() and worker.alive for worker in fresh):
+            print('New workers failed to start, keeping the running ones', file=sys.stderr, flush=True)
+            for worker in fresh:
+                worker.stop()
+            self.retiring += fresh
+            return
+        for worker in self.current:
+            worker.stop()
+        self.retiring += self.current
+        self.current = fresh
+
+    def request_reload(self, *args):
+        self._reload_requested = True
+
+    def request_stop(self, *args):
+        self._stop_requested = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        host, port = self.sock.getsockname()[:2]
+        print(f'Serving on http://{host}:{port} with {self.workers} worker(s) x {self.threads} threads', flush=True)
+        self.current = self.spawn()
+        seen_stamp = self.reload_stamp.current()
+        try:
+            while not self._stop_requested:
+                time.sleep(SERVE_POLL_INTERVAL)
+                if self._stop_requested:
+                    break
+                stamp = self.reload_stamp.current()
+                if self._reload_requested or stamp != seen_stamp:
+                    self._reload_requested = False
+                    seen_stamp = stamp
+                    self.reload()
+                self.retiring = [worker for worker in self.retiring if worker.alive]
+                for index, worker in enumerate(self.current):
+                    if not worker.alive:
+                        print(f'Worker exited with code {worker.process.returncode}, restarting', file=sys.stderr, flush=True)
+                        self.current[index] = WorkerProcess(self.sock, self.threads, self.env)
+        except KeyboardInterrupt:
+            pass
+        workers = self.current + self.retiring
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            try:
+                worker.process.wait(SERVE_GRACEFUL_TIMEOUT + 5)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+        self.sock.close()
+
+
+def run_worker(socket_arg, threads):
+    from waitress import create_server
+
+    # Ctrl+C reaches the whole process group; shutting down is the supervisor's decision.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    if socket_arg == 'stdin':
+        size = int.from_bytes(sys.stdin.buffer.read(4), 'big')
+        sock = socket.fromshare(sys.stdin.buffer.read(size))
+    else:
+        sock = socket.socket(fileno=int(socket_arg))
+    if app.config['EDIT_STREAM_LIMIT'] is None:
+        app.config['EDIT_STREAM_LIMIT'] = edit_stream_limit(threads)
+    # waitress reads a whole request body before the app sees it, spooling anything over
+    # inbuf_overflow to a temporary file, and refuses bodies over max_request_body_size; the
+    # limit follows the largest body a route accepts (archive imports and legacy uploads).
+    body_limit = max(app.config['IMPORT_MAX_SIZE'], app.config['UPLOAD_MAX_SIZE'])
+    server = create_server(app, sockets=[sock], threads=threads, max_request_body_size=body_limit)
+
+    def shutdown():
+        for channel in list(server._map.values()):
+            channel.close()
+
+    def watch_supervisor():
+        # EOF on stdin: the supervisor asked us to stop, or is gone.
+        sys.stdin.buffer.read()
+        stopping.set()
+
+    def drain():
+        stopping.wait()
+        server.accepting = False
+        server.pull_trigger()
+        dispatcher = server.task_dispatcher
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT
+        while time.monotonic() < deadline and (
+                dispatcher.active_count or dispatcher.queue
+                or any(channel.requests for channel in list(server.active_channels.values()))):
+            time.sleep(0.2)
+        server.trigger.pull_trigger(shutdown)
+        time.sleep(5)
+        os._exit(0)
+
+    threading.Thread(target=watch_supervisor, daemon=True).start()
+    threading.Thread(target=drain, daemon=True).start()
+    sys.stdout.buffer.write(WORKER_READY + b'\n')
+    sys.stdout.flush()
+    server.run()
+    server.task_dispatcher.shutdown()
+
+
+def serve(args):
+    if args.worker:
+        run_worker(args.socket, args.threads)
+        return
+    init_database()
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        args.server = 'dev'
+        print('waitress is not installed, falling back to the development server', file=sys.stderr)
+    if args.server == 'dev':
+        app.run(host=args.host, port=args.port, debug=False, use_reloader=False, threaded=True)
+        return
+    Supervisor(args.host, args.port, args.workers, args.threads).run()
+
+
+def main_cli(argv):
+    parser = argparse.ArgumentParser(description='Workspace server')
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help='run the server (default)')
+    serve_parser.add_argument('--host', default=os.environ.get('WORKSHOP_HOST', '0.0.0.0'))
+    serve_parser.add_argument('--port', type=int, default=int(os.environ.get('WORKSHOP_PORT', 8000)))
+    serve_parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKSHOP_WORKERS', 1)),
+                              help='number of worker processes')
+    serve_parser.add_argument('--threads', type=int, default=int(os.environ.get('WORKSHOP_THREADS', 64)),
+                              help='threads per worker; every open editor holds one for its event stream, '
+                                   'up to all but a quarter (at least 8) of them, further editors poll')
+    serve_parser.add_argument('--server', choices=('waitress', 'dev'), default=os.environ.get('WORKSHOP_SERVER', 'waitress'))
+    serve_parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--socket', help=argparse.SUPPRESS)
+    commands.add_parser('reload', help='gracefully restart the workers of a running server')
+
+    args = parser.parse_args(argv)
+    if args.command == 'reload':
+        ChangeStamp('reload').bump()
+        print('Reload requested')
+        return
+    if args.command is None:
+        args = parser.parse_args(['serve'])
+    serve(args)
+
+
+if __name__ == '__main__':
+    main_cli(sys.argv[1:])
@@ -110,6 +110,78 @@ $(document).ready(function() {
   }
 
 
+  // -- [Gemini Jobs] --
+
+  function showGeminiError($answerDiv, prefix, message) {
+    $answerDiv.append('<p class="gemini-error">' + prefix + ': ' + escapeHtml(message) + '</p>');
+  }
+
+  var GEMINI_POLL_INTERVAL = 700;
+
+  /**
+   * Submits a query to /gemini_jobs and polls the job, rendering the answer into $answerDiv
+   * as it arrives. No request is held open on the server while the job waits or runs.
+   */
+  function requestGemini(text, $answerDiv, waitingMessage, onComplete) {
+    onComplete = onComplete || function() {};
+
+    var $item = null;
+    var answer = '';
+
+    function finish(prefix, error) {
+      waitingMessage.remove();
+      if (error) showGeminiError($answerDiv, prefix, error);
+      onComplete();
+    }
+
+    function update(job) {
+      if (job.state === 'queued') {
+        waitingMessage.text(job.position > 0
+          ? 'Waiting in queue (' + job.position + ' ahead)...'
+          : 'Waiting for a response from Gemini...');
+      }
+      if (job.response) {
+        if (!$item) {
+          waitingMessage.remove();
+          $item = $('<div class="gemini-answer-item"></div>').appendTo($answerDiv);
+        }
+        answer += job.response;
+        $item.html(formatGeminiResponse(answer));
+      }
+    }
+
+    function poll(job) {
+      update(job);
+      if (job.state === 'done') return finish();
+      if (job.state !== 'queued' && job.state !== 'running') {
+        return finish('Gemini error', job.error || 'Gemini request failed');
+      }
+      setTimeout(function() {
+        $.get('/gemini_jobs/' + job.job_id, { since: job.length })
+          .done(function(data) {
+            if (data.success) poll(data);
+            else finish('Gemini error', data.error);
+          })
+          .fail(function(xhr, status, error) {
+            finish('Server error', (xhr.responseJSON && xhr.responseJSON.error) || error);
+          });
+      }, GEMINI_POLL_INTERVAL);
+    }
+
+    $.ajax({
+      url: '/gemini_jobs',
+      type: 'POST',
+      contentType: 'application/json',
+      data: JSON.stringify({ text: text })
+    }).done(function(data) {
+      if (data.success) poll(data);
+      else finish('Gemini error', data.error);
+    }).fail(function(xhr, status, error) {
+      finish('Gemini error', (xhr.responseJSON && xhr.responseJSON.error) || error);
+    });
+  }
+
+
   // -- [Improved Interaction Logic] --
 
   function processFollowupQuery(container) {
@@ -134,28 +206,10 @@ $(document).ready(function() {
     // Combine contexts. Full page history comes first.
     var combinedMessage = fullPageContext + "---CURRENT CONVERSATION CONTEXT---\n" + previousContext + "\n\n---CURRENT QUERY---\n" + query;
 
-    $.ajax({
-      url: '/gemini_api',
-      type: 'POST',
-      data: { text: combinedMessage },
-      success: function(response) {
-        waitingMessage.remove();
-        if (response.success) {
-          var formatted = formatGeminiResponse(response.response);
-          $answerDiv.append('<div class="gemini-answer-item">' + formatted + '</div>');
-        } else {
-          $answerDiv.append('<p class="gemini-error">Gemini error: ' + escapeHtml(response.error) + '</p>');
-        }
-      },
-      error: function(xhr, status, error) {
-        waitingMessage.remove();
-        $answerDiv.append('<p class="gemini-error">Server error: ' + escapeHtml(error) + '</p>');
-      },
-      complete: function() {
-        inputField.prop('disabled', false).val('');
-        $(container).find('.gemini-send').prop('disabled', false);
-        inputField.css('height', 'auto').focus();
-      }
+    requestGemini(combinedMessage, $answerDiv, waitingMessage, function() {
+      inputField.prop('disabled', false).val('');
+      $(container).find('.gemini-send').prop('disabled', false);
+      inputField.css('height', 'auto').focus();
     });
   }
 
@@ -196,24 +250,7 @@ $(document).ready(function() {
     var waitingMessage = $('<p class="gemini-waiting">Waiting for a response from Gemini...</p>');
     $answerDiv.append(waitingMessage);
 
-    $.ajax({
-      url: '/gemini_api',
-      type: 'POST',
-      data: { text: finalQuery }, // Send query with full page context
-      success: function(response) {
-        waitingMessage.remove();
-        if (response.success) {
-          var formatted = formatGeminiResponse(response.response);
-          $answerDiv.append('<div class="gemini-answer-item">' + formatted + '</div>');
-        } else {
-          $answerDiv.append('<p class="gemini-error">Gemini error: ' + escapeHtml(response.error) + '</p>');
-        }
-      },
-      error: function(xhr, status, error) {
-        waitingMessage.remove();
-        $answerDiv.append('<p class="gemini-error">Server error: ' + escapeHtml(error) + '</p>');
-      }
-    });
+    requestGemini(finalQuery, $answerDiv, waitingMessage); // Send query with full page context
     observeContainerRemoval(newContainer);
   }
 
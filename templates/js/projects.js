@@ -4,11 +4,19 @@ $(document).ready(function(){
   window.canEdit = false;       // true – edit mode, false – view only
   window.heartbeatInterval = null;
   window.autoRefreshInterval = null;
+  window.editEventSource = null;
 
   // Additional variables for autosave
   var autoSaveTimer = null;
   var autoSaveXHR = null;
 
+  // Last content known to be stored on the server, used as the base for delta saves
+  var savedDocument = { project: null, revision: null, content: null };
+
+  function rememberSavedDocument(project, revision, content) {
+    savedDocument = { project: project, revision: revision, content: content };
+  }
+
   // Function to cancel autosave (timer and AJAX request)
   function cancelAutoSave() {
     if (autoSaveTimer) {
@@ -61,10 +69,116 @@ $('#projects-container')
     showContextMenu(projectName, e.pageX, e.pageY);
   });
 
+// Fetches the document itself; the server sends it gzip-compressed when it is stored that way
+function fetchProjectDocument(project) {
+  return $.ajax({
+    url: '/project_document',
+    data: { project_name: project },
+    dataType: 'text'
+  }).then(function (content, status, xhr) {
+    return { content: content, revision: parseInt(xhr.getResponseHeader('X-Revision'), 10) };
+  });
+}
+
+// Long documents arrive block by block: /load_project?blocks=1 sends the first screenful and the
+// list of top-level blocks, the rest is fetched from /project_blocks as the reader scrolls down.
+// Until every block is in, the editor holds a partial document and must not be saved.
+var blockLoader = null;
+
+function startBlockLoader(project, data) {
+  stopBlockLoader();
+  var loader = {
+    project: project,
+    revision: data.revision,
+    next: data.loaded,
+    total: data.blocks.length,
+    parts: [data.content],
+    request: null,
+    observer: null
+  };
+  if (loader.next >= loader.total) {
+    rememberSavedDocument(project, data.revision, data.content);
+    return;
+  }
+  blockLoader = loader;
+  // The sentinel sits after the editor so it never becomes part of the saved HTML
+  var $sentinel = $('<div id="editor-block-sentinel"></div>').insertAfter('#editor');
+  if ('IntersectionObserver' in window) {
+    loader.observer = new IntersectionObserver(function (entries) {
+      if (entries[0].isIntersecting) loadMoreBlocks();
+    }, { rootMargin: '1000px 0px' });
+    loader.observer.observe($sentinel[0]);
+  } else {
+    loadMoreBlocks();
+  }
+}
+
+// Returns true if a partial document was being loaded
+function stopBlockLoader() {
+  var loader = blockLoader;
+  if (!loader) return false;
+  blockLoader = null;
+  if (loader.observer) loader.observer.disconnect();
+  if (loader.request) loader.request.abort();
+  $('#editor-block-sentinel').remove();
+  return true;
+}
+
+function documentIsPartial(project) {
+  return !!blockLoader && blockLoader.project === project;
+}
+
+function loadMoreBlocks() {
+  var loader = blockLoader;
+  if (!loader || loader.request) return;
+  loader.request = $.get('/project_blocks', {
+    project_name: loader.project,
+    revision: loader.revision,
+    start: loader.next
+  }).done(function (data) {
+    if (blockLoader !== loader) return;
+    loader.request = null;
+    if (data.conflict) {
+      // The document changed meanwhile: the remaining blocks no longer fit, take it whole
+      stopBlockLoader();
+      fetchProjectDocument(loader.project).done(function (doc) {
+        if (window.currentProject !== loader.project || blockLoader) return;
+        $('#editor').html(doc.content);
+        rememberSavedDocument(loader.project, doc.revision, doc.content);
+      });
+      return;
+    }
+    if (!data.success || !data.blocks.length) {
+      console.error("Error loading document blocks:", data.error);
+      return;
+    }
+    var html = $.map(data.blocks, function (block) { return block.html; }).join('');
+    $('#editor')[0].insertAdjacentHTML('beforeend', html);
+    loader.parts.push(html);
+    loader.next += data.blocks.length;
+    if (loader.next >= loader.total) {
+      stopBlockLoader();
+      rememberSavedDocument(loader.project, loader.revision, loader.parts.join(''));
+    } else if (!loader.observer || sentinelNearViewport()) {
+      // The observer only fires on changes; keep going while the sentinel is still in reach
+      loadMoreBlocks();
+    }
+  }).fail(function (xhr, status) {
+    if (blockLoader === loader) loader.request = null;
+    if (status !== 'abort') console.error("Error loading document blocks:", status);
+  });
+}
+
+function sentinelNearViewport() {
+  var sentinel = document.getElementById('editor-block-sentinel');
+  return !!sentinel && sentinel.getBoundingClientRect().top < window.innerHeight + 1000;
+}
+
 function openProject(project) {
   if (typeof cancelAutoSave === 'function') cancelAutoSave();
 
   if (window.heartbeatInterval) clearInterval(window.heartbeatInterval);
+  closeEditEvents();
   if (window.autoRefreshInterval) {
     clearInterval(window.autoRefreshInterval);
     window.autoRefreshInterval = null;
@@ -72,10 +186,36 @@ function openProject(project) {
 
   window.currentProject = project;
 
-  $.get('/load_project', { project_name: project })
+  stopBlockLoader();
+
+  // Session state and the block list first. Editors and documents that fit on one screen get the
+  // whole document from /project_document; everyone else gets the first screenful of blocks and
+  // the rest on scroll. Both come gzip-compressed.
+  $.get('/load_project', { project_name: project, content: 0, blocks: 1 })
+    .then(function (data) {
+      if (!data.success) return data;
+      var whole = function () {
+        return fetchProjectDocument(project).then(function (doc) {
+          return $.extend(data, doc, { loaded: data.blocks.length });
+        });
+      };
+      if (data.can_edit || data.loaded >= data.blocks.length) return whole();
+      return $.get('/project_blocks', {
+        project_name: project,
+        revision: data.revision,
+        start: 0,
+        end: data.loaded
+      }).then(function (first) {
+        if (!first.success) return whole();  // changed since /load_project
+        var html = $.map(first.blocks, function (block) { return block.html; }).join('');
+        return $.extend(data, { content: html, loaded: first.blocks.length });
+      });
+    })
     .done(function (data) {
+      if (window.currentProject !== project) return;
       if (data.success) {
         $('#editor').html(data.content);
+        startBlockLoader(project, data);
 
         $('#main-header').fadeOut(200, function () {
           $(this).text(project).fadeIn(200);
@@ -87,7 +227,7 @@ function openProject(project) {
 
         window.canEdit = data.can_edit;
         handleEditModeChange(data);
-        window.heartbeatInterval = setInterval(sendHeartbeat, 3000);
+        openEditEvents(project);
 
         // Update the project list
         const $projectEl = $('.project-item[data-project="' + project + '"]');
@@ -155,28 +295,66 @@ function handleEditModeChange(data) {
   }
 }
 
+function applyEditState(data) {
+  if (data.notify) {
+    if (data.can_edit) {
+      enableEditingMode();
+      if (data.became_editor_after_queue) {
+        alert("The previous editor has left, you can now edit the project.");
+      }
+    } else if (data.in_queue) {
+      enableViewOnlyMode();
+      alert("The project is currently being edited by " + (data.editor || "another user") + ". You have been added to the editing queue.");
+    } else {
+      enableViewOnlyMode();
+    }
+  } else if (window.canEdit && !data.can_edit) {
+    // The lock was lost (e.g. after a long disconnect)
+    enableViewOnlyMode();
+  }
+  window.canEdit = data.can_edit;
+}
+
 function sendHeartbeat() {
   if (!window.currentProject) return;
   $.post('/heartbeat', { project_name: window.currentProject }, function(data) {
     if (data.success) {
-      if (data.notify) {
-        if (data.can_edit) {
-          enableEditingMode();
-          if (data.became_editor_after_queue) {
-            alert("The previous editor has left, you can now edit the project.");
-          }
-        } else if (data.in_queue) {
-          enableViewOnlyMode();
-          alert("The project is currently being edited by " + (data.editor || "another user") + ". You have been added to the editing queue.");
-        } else {
-          enableViewOnlyMode();
-        }
-      }
-      window.canEdit = data.can_edit;
+      applyEditState(data);
     }
   });
 }
 
+// Lock and queue changes are pushed over Server-Sent Events; the open stream itself keeps
+// our lock alive. Browsers without EventSource (or a failing stream) fall back to polling.
+function openEditEvents(project) {
+  if (!window.EventSource) {
+    window.heartbeatInterval = setInterval(sendHeartbeat, 3000);
+    return;
+  }
+  var source = new EventSource('/edit_events?project_name=' + encodeURIComponent(project));
+  var onEvent = function(e) {
+    if (window.currentProject !== project) return;
+    applyEditState(JSON.parse(e.data));
+  };
+  ['state', 'handover', 'queue', 'editor_left'].forEach(function(name) {
+    source.addEventListener(name, onEvent);
+  });
+  source.onerror = function() {
+    if (source.readyState === EventSource.CLOSED && window.editEventSource === source) {
+      window.editEventSource = null;
+      window.heartbeatInterval = setInterval(sendHeartbeat, 3000);
+    }
+  };
+  window.editEventSource = source;
+}
+
+function closeEditEvents() {
+  if (window.editEventSource) {
+    window.editEventSource.close();
+    window.editEventSource = null;
+  }
+}
+
 
 
 function showContextMenu(project, x, y) {
@@ -208,12 +386,13 @@ function enableEditingMode() {
     window.autoRefreshInterval = null;
   }
 
-  // 2) pull the latest content
+  // 2) pull the latest content; a partly loaded document stays read-only until then
+  if (stopBlockLoader()) $('#editor').attr('contenteditable', false);
   if (window.currentProject) {
-    $.get('/get_project_content', { project_name: window.currentProject }, function(data) {
-      if (data.success) {
-        $('#editor').html(data.content);
-      }
+    fetchProjectDocument(window.currentProject).done(function(data) {
+      $('#editor').html(data.content);
+      rememberSavedDocument(window.currentProject, data.revision, data.content);
+    }).always(function() {
       // 3) only after loading - enable the editor and autosave
       activateEditor();
     });
@@ -246,9 +425,69 @@ function enableViewOnlyMode() {
 }
 
 
-  // Save function with chunk support.
+  // Number of code points in a string (the server counts offsets in code points)
+  function codePointLength(str) {
+    var pairs = str.match(/[\uD800-\uDBFF][\uDC00-\uDFFF]/g);
+    return pairs ? str.length - pairs.length : str.length;
+  }
+
+  // Builds a single [start, end, text] splice turning oldText into newText
+  function buildPatch(oldText, newText) {
+    var prefix = 0;
+    var maxPrefix = Math.min(oldText.length, newText.length);
+    while (prefix < maxPrefix && oldText.charCodeAt(prefix) === newText.charCodeAt(prefix)) prefix++;
+    // Do not split a surrogate pair
+    if (prefix > 0 && /[\uD800-\uDBFF]/.test(oldText.charAt(prefix - 1))) prefix--;
+
+    var suffix = 0;
+    var maxSuffix = maxPrefix - prefix;
+    while (suffix < maxSuffix &&
+           oldText.charCodeAt(oldText.length - 1 - suffix) === newText.charCodeAt(newText.length - 1 - suffix)) suffix++;
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(oldText.charAt(oldText.length - suffix))) suffix--;
+
+    var start = codePointLength(oldText.substring(0, prefix));
+    var end = start + codePointLength(oldText.substring(prefix, oldText.length - suffix));
+    return [[start, end, newText.substring(prefix, newText.length - suffix)]];
+  }
+
+  // Save function: sends only the changes when the stored revision is known,
+  // otherwise (or on a revision conflict) falls back to a full chunked save.
   // Returns jqXHR to allow for request cancellation.
   function saveProject(project, content, callback) {
+    if (documentIsPartial(project)) {
+      if (callback) callback({ success: false, error: "The document is still loading" });
+      return null;
+    }
+    if (savedDocument.project === project && savedDocument.revision !== null && savedDocument.revision !== undefined) {
+      if (savedDocument.content === content) {
+        if (callback) callback({ success: true, revision: savedDocument.revision });
+        return null;
+      }
+      return $.post('/save_project', {
+        project_name: project,
+        base_revision: savedDocument.revision,
+        patch: JSON.stringify(buildPatch(savedDocument.content, content)),
+        length: codePointLength(content)
+      }, function(data) {
+        if (data.success) {
+          rememberSavedDocument(project, data.revision, content);
+          if (callback) callback(data);
+        } else if (data.conflict) {
+          savedDocument.revision = null;
+          saveFullProject(project, content, callback);
+        } else {
+          if (callback) callback(data);
+        }
+      });
+    }
+    return saveFullProject(project, content, callback);
+  }
+
+  function saveFullProject(project, content, callback) {
+    var done = function(data) {
+      if (data.success) rememberSavedDocument(project, data.revision, content);
+      if (callback) callback(data);
+    };
     var maxChunkSize = 100 * 1024; // 100 KB
     if (content.length > maxChunkSize) {
       var chunks = [];
@@ -267,10 +506,10 @@ function enableViewOnlyMode() {
             if (index < totalChunks - 1) {
               sendChunk(index + 1);
             } else {
-              if (callback) callback(data);
+              done(data);
             }
           } else {
-            if (callback) callback(data);
+            done(data);
           }
         });
       }
@@ -282,7 +521,7 @@ function enableViewOnlyMode() {
         chunk_number: 1,
         total_chunks: 1
       }, function(data) {
-        if (callback) callback(data);
+        done(data);
       });
     }
   }
@@ -308,12 +547,31 @@ $('#search-projects').on('input', function () {
 
         container.append(projectItem);
       });
+      appendContentMatches(query);
     } else {
       alert(data.error);
     }
   });
 });
 
+// Projects whose text matches the query, listed under the name matches with a snippet.
+// Clicks are handled by the delegated .project-item handler.
+function appendContentMatches(query) {
+  if (query.length < 3) return;
+  $.get('/search_content', { query: query, offset: 0, limit: 10 }, function (data) {
+    if (!data.success || $('#search-projects').val().trim() !== query) return;
+    var container = $('#projects-container');
+    data.results.forEach(function (hit) {
+      if (container.find('.project-item').filter(function () { return $(this).data('project') === hit.project; }).length) return;
+      var item = $('<div class="project-item content-match"><span class="proj-name"></span><div class="proj-snippet"></div></div>');
+      item.attr('data-project', hit.project);
+      item.find('.proj-name').text(hit.project);
+      item.find('.proj-snippet').html(hit.snippet);  // snippet is escaped by the server, only <mark> is markup
+      container.append(item);
+    });
+  });
+}
+
   // Fixing the "Load More" button - it no longer reloads the page and appends new projects
   $('#load_more').on('click', function(e){
     e.preventDefault(); // prevents page reload
@@ -447,6 +705,40 @@ $('#ctx-delete').click(function () {
     });
   });
   
+$('#ctx-export').click(function() {
+  var project = $('#context-menu').data('project');
+  $('#context-menu').fadeOut(200);
+  // The archive is streamed by the server, the browser saves it as a regular download
+  window.location.href = '/export_project?project_name=' + encodeURIComponent(project);
+});
+
+$('#import-project').click(function() {
+  $('#import-project-file').val('').click();
+});
+
+$('#import-project-file').on('change', function() {
+  var file = this.files[0];
+  if (!file) return;
+  var name = prompt("Enter the name of the imported project", file.name.replace(/\.zip$/i, ''));
+  if (!name) return;
+  // The archive is sent as the raw request body so the server can unpack it while it arrives
+  fetch('/import_project?project_name=' + encodeURIComponent(name.trim()), {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/zip' },
+    body: file
+  }).then(function(response) {
+    return response.json();
+  }).then(function(data) {
+    if (data.success) {
+      openProject(data.project);
+    } else {
+      alert(data.error);
+    }
+  }).catch(function(err) {
+    alert("Request error: " + err);
+  });
+});
+
 $('#new-project').click(function() {
   var name = prompt("Enter the name of the new project");
   if (name) {
@@ -22,259 +22,245 @@ $(document).ready(function() {
         });
     }
 
-    // Function to open the "Storage" modal window
-    function openStorageModal() {
-        if (!window.currentProject) {
-            alert("Select a project");
-            return;
+    // Cursor of the next page of the storage listing (null when everything is shown)
+    var storageNextCursor = null;
+
+    function formatFileSize(bytes) {
+        if (bytes < 1024) return bytes + ' B';
+        var units = ['KB', 'MB', 'GB', 'TB'];
+        var i = -1;
+        do {
+            bytes /= 1024;
+            i++;
+        } while (bytes >= 1024 && i < units.length - 1);
+        return bytes.toFixed(1) + ' ' + units[i];
+    }
+
+    // Builds a table row from a listing entry ({name, size, mtime, mime})
+    function storageRowHtml(entry) {
+        var filename = entry.name;
+        var row = '<tr data-filename="'+filename+'">';
+        row += '<td><input type="checkbox" class="file-checkbox"></td>';
+        row += '<td>';
+        // Previews are small server-side thumbnails, never the originals
+        if (entry.mime.indexOf('image/') === 0 || entry.mime.indexOf('video/') === 0) {
+            var thumbUrl = '/workspace/' + encodeURIComponent(window.currentProject) + '/' + encodeURIComponent(filename) + '?variant=thumb';
+            row += '<img class="storage-thumb" loading="lazy" src="' + thumbUrl + '" onerror="this.remove()"> ';
+        }
+        row += filename+'</td>';
+        row += '<td>'+formatFileSize(entry.size)+'</td>';
+        row += '<td>'+new Date(entry.mtime * 1000).toLocaleString()+'</td>';
+        row += '<td>';
+        // "Embed" button (keeping the old logic)
+        row += '<button class="embed-file-btn">Embed</button> ';
+        // If the file is a video, add a button to create a player marker (will be the "Player" button)
+        if (entry.mime.indexOf('video/') === 0) {
+            row += '<button class="player-file-btn">Player</button> ';
+        }
+        row += '<button class="download-file-btn">Download</button> ';
+        row += '<button class="delete-file-btn">Delete</button>';
+        row += '</td>';
+        row += '</tr>';
+        return row;
+    }
+
+    // Requests one page of the listing; cursor is null for the first page
+    function loadStoragePage(cursor, callback) {
+        var params = {
+            project_name: window.currentProject,
+            sort: $('#storage-sort').val() || 'name',
+            order: $('#storage-order').val() || 'asc'
+        };
+        if (cursor) {
+            params.cursor = cursor;
         }
-        // Requesting the list of files for the current project
         $.ajax({
             url: '/storage_api',
             type: 'GET',
-            data: { project_name: window.currentProject },
+            data: params,
             success: function(response) {
                 if (response.success) {
-                    var modalHtml = '<div id="storage-modal-overlay"></div>';
-                    modalHtml += '<div id="storage-modal">';
-                    modalHtml += '<div id="storage-modal-header"><h3>File Storage</h3><button id="storage-modal-close">×</button></div>';
-                    modalHtml += '<div id="storage-modal-body">';
-                    if (response.files.length === 0) {
-                        modalHtml += '<p>No files found.</p>';
-                    } else {
-                        modalHtml += '<table id="storage-file-table"><thead><tr><th><input type="checkbox" id="select-all-files"></th><th>Filename</th><th>Actions</th></tr></thead><tbody>';
-                        $.each(response.files, function(index, filename) {
-                            var ext = filename.split('.').pop().toLowerCase();
-                            modalHtml += '<tr data-filename="'+filename+'">';
-                            modalHtml += '<td><input type="checkbox" class="file-checkbox"></td>';
-                            modalHtml += '<td>'+filename+'</td>';
-                            modalHtml += '<td>';
-                            // "Embed" button (keeping the old logic)
-                            modalHtml += '<button class="embed-file-btn">Embed</button> ';
-                            // If the file is a video, add a button to create a player marker (will be the "Player" button)
-                            if (["mp4", "webm", "avi", "mov"].indexOf(ext) >= 0) {
-                                modalHtml += '<button class="player-file-btn">Player</button> ';
-                            }
-                            modalHtml += '<button class="download-file-btn">Download</button> ';
-                            modalHtml += '<button class="delete-file-btn">Delete</button>';
-                            modalHtml += '</td>';
-                            modalHtml += '</tr>';
-                        });
-                        modalHtml += '</tbody></table>';
-                        modalHtml += '<div id="storage-bulk-actions">';
-                        modalHtml += '<button id="embed-selected-btn">Embed Selected</button> ';
-                        modalHtml += '<button id="delete-selected-btn">Delete Selected</button>';
-                        modalHtml += '</div>';
-                    }
-                    
-                    modalHtml += '</div>'; // #storage-modal-body
-                    modalHtml += '</div>'; // #storage-modal
+                    storageNextCursor = response.next_cursor;
+                    callback(response.entries);
+                } else {
+                    alert("Error: " + response.error);
+                }
+            },
+            error: function(err) {
+                alert("Request error: " + err.responseText);
+            }
+        });
+    }
 
-                    $('body').append(modalHtml);
+    // Appends rows to the table and updates the "Load more" button
+    function appendStorageRows(entries) {
+        var tbody = '';
+        $.each(entries, function(index, entry) {
+            tbody += storageRowHtml(entry);
+        });
+        $('#storage-file-table tbody').append(tbody);
+        if ($('#storage-file-table tbody tr[data-filename]').length === 0) {
+            $('#storage-file-table tbody').html('<tr><td colspan="5">No files found.</td></tr>');
+        }
+        $('#storage-load-more').toggle(!!storageNextCursor);
+    }
 
-                    // Closing the modal window
-                    $('#storage-modal-close, #storage-modal-overlay').on('click', function() {
-                        $('#storage-modal, #storage-modal-overlay').remove();
-                    });
+    // Function to open the "Storage" modal window
+    function openStorageModal() {
+        if (!window.currentProject) {
+            alert("Select a project");
+            return;
+        }
+        // Requesting the first page of files for the current project
+        loadStoragePage(null, function(entries) {
+            var modalHtml = '<div id="storage-modal-overlay"></div>';
+            modalHtml += '<div id="storage-modal">';
+            modalHtml += '<div id="storage-modal-header"><h3>File Storage</h3><button id="storage-modal-close">×</button></div>';
+            modalHtml += '<div id="storage-modal-body">';
+            modalHtml += '<div id="storage-sort-controls">Sort by ';
+            modalHtml += '<select id="storage-sort"><option value="name">Name</option><option value="size">Size</option><option value="mtime">Modified</option></select> ';
+            modalHtml += '<select id="storage-order"><option value="asc">Ascending</option><option value="desc">Descending</option></select>';
+            modalHtml += '</div>';
+            modalHtml += '<table id="storage-file-table"><thead><tr><th><input type="checkbox" id="select-all-files"></th><th>Filename</th><th>Size</th><th>Modified</th><th>Actions</th></tr></thead><tbody></tbody></table>';
+            modalHtml += '<button id="storage-load-more">Load more</button>';
+            modalHtml += '<div id="storage-bulk-actions">';
+            modalHtml += '<button id="embed-selected-btn">Embed Selected</button> ';
+            modalHtml += '<button id="delete-selected-btn">Delete Selected</button>';
+            modalHtml += '</div>';
+            modalHtml += '</div>'; // #storage-modal-body
+            modalHtml += '</div>'; // #storage-modal
 
-                    // "Select All" handler
-                    $('#select-all-files').on('change', function() {
-                        $('.file-checkbox').prop('checked', $(this).prop('checked'));
-                    });
+            $('body').append(modalHtml);
+            appendStorageRows(entries);
 
-                    // Handler for single embedding
-                    $('.embed-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        embedFile(filename);
-                        $('#storage-modal, #storage-modal-overlay').remove();
-                    });
+            // Closing the modal window
+            $('#storage-modal-close, #storage-modal-overlay').on('click', function() {
+                $('#storage-modal, #storage-modal-overlay').remove();
+            });
 
-                    // Handler for the "Player" button (for video files)
-                    $('.player-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
-                        var newVideo = { title: filename, file: fileUrl };
-                        
-                        // Check if a player button already exists in the editor
-                        var $marker = $('#editor').find('#video-player-button');
-                        if ($marker.length === 0) {
-                            var playerData = { videos: [newVideo] };
-                            var jsonData = JSON.stringify(playerData);
-                            var buttonHtml = '<button id="video-player-button" data-videos=\'' + jsonData + '\' contenteditable="false" class="video-btn">Watch</button>';
-                            $('#editor').append(buttonHtml);
-                        } else {
-                            var existingData = $marker.attr('data-videos');
-                            try {
-                                var oldData = existingData ? JSON.parse(existingData) : { videos: [] };
-                                if (!oldData.videos || !Array.isArray(oldData.videos)) {
-                                    oldData.videos = [];
-                                }
-                                oldData.videos.push(newVideo);
-                                $marker.attr('data-videos', JSON.stringify(oldData));
-                            } catch (e) {
-                                console.error("Error parsing player data:", e);
-                            }
-                        }
-                        alert("Video added. To watch, click the 'Watch' button in the editor.");
-                    });
+            // Changing the sort order reloads the list from the first page
+            $('#storage-sort, #storage-order').on('change', function() {
+                refreshStorageList();
+            });
 
-                    // Handler for downloading a file
-                    $('.download-file-btn').on('click', function(e) {
-                        e.preventDefault();
-                        var filename = $(this).closest('tr').data('filename');
-                        var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
-                        var a = document.createElement('a');
-                        a.href = fileUrl;
-                        a.download = filename;
-                        document.body.appendChild(a);
-                        a.click();
-                        document.body.removeChild(a);
-                    });
+            // Next page of the listing
+            $('#storage-load-more').on('click', function() {
+                loadStoragePage(storageNextCursor, appendStorageRows);
+            });
 
-                    // Handler for single deletion
-                    $('.delete-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        if (confirm("Delete file " + filename + "?")) {
-                            deleteFiles([filename], function() {
-                                refreshStorageList();
-                            });
-                        }
-                    });
+            // "Select All" handler
+            $('#select-all-files').on('change', function() {
+                $('.file-checkbox').prop('checked', $(this).prop('checked'));
+            });
 
-                    // Bulk embedding of selected files
-                    $('#embed-selected-btn').on('click', function() {
-                        var selectedFiles = [];
-                        $('.file-checkbox:checked').each(function() {
-                            var filename = $(this).closest('tr').data('filename');
-                            selectedFiles.push(filename);
-                        });
-                        if (selectedFiles.length === 0) {
-                            alert("Select at least one file to embed.");
-                        } else {
-                            $.each(selectedFiles, function(index, filename) {
-                                embedFile(filename);
-                            });
-                            $('#storage-modal, #storage-modal-overlay').remove();
-                        }
-                    });
+            // Handler for single embedding
+            $('#storage-file-table').on('click', '.embed-file-btn', function() {
+                var filename = $(this).closest('tr').data('filename');
+                embedFile(filename);
+                $('#storage-modal, #storage-modal-overlay').remove();
+            });
 
-                    // Bulk deletion of selected files
-                    $('#delete-selected-btn').on('click', function() {
-                        var selectedFiles = [];
-                        $('.file-checkbox:checked').each(function() {
-                            var filename = $(this).closest('tr').data('filename');
-                            selectedFiles.push(filename);
-                        });
-                        if (selectedFiles.length === 0) {
-                            alert("Select at least one file to delete.");
-                        } else {
-                            if (confirm("Delete selected files?")) {
-                                deleteFiles(selectedFiles, function() {
-                                    refreshStorageList();
-                                });
-                            }
+            // Handler for the "Player" button (for video files)
+            $('#storage-file-table').on('click', '.player-file-btn', function() {
+                var filename = $(this).closest('tr').data('filename');
+                var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
+                var newVideo = { title: filename, file: fileUrl };
+                
+                // Check if a player button already exists in the editor
+                var $marker = $('#editor').find('#video-player-button');
+                if ($marker.length === 0) {
+                    var playerData = { videos: [newVideo] };
+                    var jsonData = JSON.stringify(playerData);
+                    var buttonHtml = '<button id="video-player-button" data-videos=\'' + jsonData + '\' contenteditable="false" class="video-btn">Watch</button>';
+                    $('#editor').append(buttonHtml);
+                } else {
+                    var existingData = $marker.attr('data-videos');
+                    try {
+                        var oldData = existingData ? JSON.parse(existingData) : { videos: [] };
+                        if (!oldData.videos || !Array.isArray(oldData.videos)) {
+                            oldData.videos = [];
                         }
+                        oldData.videos.push(newVideo);
+                        $marker.attr('data-videos', JSON.stringify(oldData));
+                    } catch (e) {
+                        console.error("Error parsing player data:", e);
+                    }
+                }
+                alert("Video added. To watch, click the 'Watch' button in the editor.");
+            });
+
+            // Handler for downloading a file
+            $('#storage-file-table').on('click', '.download-file-btn', function(e) {
+                e.preventDefault();
+                var filename = $(this).closest('tr').data('filename');
+                var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
+                var a = document.createElement('a');
+                a.href = fileUrl;
+                a.download = filename;
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+            });
+
+            // Handler for single deletion
+            $('#storage-file-table').on('click', '.delete-file-btn', function() {
+                var filename = $(this).closest('tr').data('filename');
+                if (confirm("Delete file " + filename + "?")) {
+                    deleteFiles([filename], function() {
+                        refreshStorageList();
                     });
+                }
+            });
 
-                    // Handler for the button to open the folder in the explorer
-                    $('#open-storage-folder-btn').on('click', function() {
-                        openProjectFolder();
+            // Bulk embedding of selected files
+            $('#embed-selected-btn').on('click', function() {
+                var selectedFiles = [];
+                $('.file-checkbox:checked').each(function() {
+                    var filename = $(this).closest('tr').data('filename');
+                    selectedFiles.push(filename);
+                });
+                if (selectedFiles.length === 0) {
+                    alert("Select at least one file to embed.");
+                } else {
+                    $.each(selectedFiles, function(index, filename) {
+                        embedFile(filename);
                     });
+                    $('#storage-modal, #storage-modal-overlay').remove();
+                }
+            });
+
+            // Bulk deletion of selected files
+            $('#delete-selected-btn').on('click', function() {
+                var selectedFiles = [];
+                $('.file-checkbox:checked').each(function() {
+                    var filename = $(this).closest('tr').data('filename');
+                    selectedFiles.push(filename);
+                });
+                if (selectedFiles.length === 0) {
+                    alert("Select at least one file to delete.");
                 } else {
-                    alert("Error: " + response.error);
+                    if (confirm("Delete selected files?")) {
+                        deleteFiles(selectedFiles, function() {
+                            refreshStorageList();
+                        });
+                    }
                 }
-            },
-            error: function(err) {
-                alert("Request error: " + err.responseText);
-            }
+            });
+
+            // Handler for the button to open the folder in the explorer
+            $('#open-storage-folder-btn').on('click', function() {
+                openProjectFolder();
+            });
         });
     }
 
-    // Function to refresh the file list in the modal window
+    // Function to refresh the file list in the modal window (back to the first page)
     function refreshStorageList() {
         if (!window.currentProject) return;
-        $.ajax({
-            url: '/storage_api',
-            type: 'GET',
-            data: { project_name: window.currentProject },
-            success: function(response) {
-                if (response.success) {
-                    var tbody = '';
-                    if (response.files.length === 0) {
-                        tbody = '<tr><td colspan="3">No files found.</td></tr>';
-                    } else {
-                        $.each(response.files, function(index, filename) {
-                            var ext = filename.split('.').pop().toLowerCase();
-                            tbody += '<tr data-filename="'+filename+'">';
-                            tbody += '<td><input type="checkbox" class="file-checkbox"></td>';
-                            tbody += '<td>'+filename+'</td>';
-                            tbody += '<td>';
-                            tbody += '<button class="embed-file-btn">Embed</button> ';
-                            if (["mp4", "webm", "avi", "mov"].indexOf(ext) >= 0) {
-                                tbody += '<button class="player-file-btn">Player</button> ';
-                            }
-                            tbody += '<button class="download-file-btn">Download</button> ';
-                            tbody += '<button class="delete-file-btn">Delete</button>';
-                            tbody += '</td>';
-                            tbody += '</tr>';
-                        });
-                    }
-                    $('#storage-file-table tbody').html(tbody);
-                    $('#select-all-files').prop('checked', false);
-                    $('.embed-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        embedFile(filename);
-                        $('#storage-modal, #storage-modal-overlay').remove();
-                    });
-                    $('.player-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
-                        var newVideo = { title: filename, file: fileUrl };
-                        var $marker = $('#editor').find('#video-player-button');
-                        if ($marker.length === 0) {
-                            var playerData = { videos: [newVideo] };
-                            var jsonData = JSON.stringify(playerData);
-                            var buttonHtml = '<button id="video-player-button" data-videos=\'' + jsonData + '\' contenteditable="false" class="video-btn">Watch</button>';
-                            $('#editor').append(buttonHtml);
-                        } else {
-                            var existingData = $marker.attr('data-videos');
-                            try {
-                                var oldData = existingData ? JSON.parse(existingData) : { videos: [] };
-                                if (!oldData.videos || !Array.isArray(oldData.videos)) {
-                                    oldData.videos = [];
-                                }
-                                oldData.videos.push(newVideo);
-                                $marker.attr('data-videos', JSON.stringify(oldData));
-                            } catch (e) {
-                                console.error("Error parsing player data:", e);
-                            }
-                        }
-                        alert("Video added. To watch, click the 'Watch' button in the editor.");
-                    });
-                    $('.download-file-btn').on('click', function(e) {
-                        e.preventDefault();
-                        var filename = $(this).closest('tr').data('filename');
-                        var fileUrl = "/workspace/" + window.currentProject + "/" + filename;
-                        var a = document.createElement('a');
-                        a.href = fileUrl;
-                        a.download = filename;
-                        document.body.appendChild(a);
-                        a.click();
-                        document.body.removeChild(a);
-                    });
-                    $('.delete-file-btn').on('click', function() {
-                        var filename = $(this).closest('tr').data('filename');
-                        if (confirm("Delete file " + filename + "?")) {
-                            deleteFiles([filename], function() {
-                                refreshStorageList();
-                            });
-                        }
-                    });
-                }
-            },
-            error: function(err) {
-                alert("Error updating list: " + err.responseText);
-            }
+        loadStoragePage(null, function(entries) {
+            $('#storage-file-table tbody').empty();
+            $('#select-all-files').prop('checked', false);
+            appendStorageRows(entries);
         });
     }
 
@@ -94,9 +94,201 @@ $(document).ready(function() {
     `;
   }
 
+  // Insert the uploaded file into the editor
+  function insertUploadedFile(data) {
+    if (!data.success) {
+      alert(data.error);
+      return;
+    }
+    var ext = data.filename.split('.').pop().toLowerCase();
+    var fileUrl = "/workspace/" + window.currentProject + "/" + data.filename;
+    var tag = "";
+
+    if (["mp3", "wav", "ogg"].indexOf(ext) >= 0) {
+      var idx = $('#editor').find('audio').length;
+      var ids = {
+        audioId:      'audio' + idx,
+        progressBarId:'progress-bar' + idx,
+        currentTimeId:'current-time' + idx,
+        durationId:   'duration' + idx
+      };
+
+      tag = buildAudioTag(fileUrl, ids);
+      insertAtCursor(tag);
+      var audioEl = document.getElementById(ids.audioId);
+      audioEl.onloadedmetadata = function() {
+        document.getElementById(ids.durationId).textContent = formatTime(audioEl.duration);
+      };
+
+    } else if (["jpg","jpeg","png","gif"].indexOf(ext) >= 0) {
+      tag = "<br><img src='" + fileUrl + "' style='max-width:100%; display:block; margin:10px auto;' class='resizable draggable'><br>";
+      insertAtCursor(tag);
+
+    } else if (["mp4","webm","avi","mov"].indexOf(ext) >= 0) {
+      tag = "<br><video controls style='max-width:100%; display:block; margin:10px auto;'>" +
+            "<source src='" + fileUrl + "' type='video/" + ext + "'>" +
+            "Your browser does not support the video tag." +
+            "</video><br>";
+      insertAtCursor(tag);
+
+    } else {
+      tag = "<br><a href='" + fileUrl + "' target='_blank'>" + data.filename + "</a><br>";
+      insertAtCursor(tag);
+    }
+  }
+
+  // Files larger than one chunk go through a resumable upload session
+  var UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+  var UPLOAD_PARALLEL_CHUNKS = 3;
+  var UPLOAD_MAX_RETRIES = 6;
+
+  function uploadSessionKey(projectName, file) {
+    return 'upload:' + projectName + ':' + file.name + ':' + file.size + ':' + (file.lastModified || 0);
+  }
+
+  // SHA-256 of a chunk as hex, or null where WebCrypto is unavailable (plain http)
+  function chunkDigest(blob) {
+    if (!window.crypto || !window.crypto.subtle || !blob.arrayBuffer) {
+      return Promise.resolve(null);
+    }
+    return blob.arrayBuffer()
+      .then(function(buffer) { return window.crypto.subtle.digest('SHA-256', buffer); })
+      .then(function(hash) {
+        return Array.from(new Uint8Array(hash)).map(function(b) {
+          return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+      })
+      .catch(function() { return null; });
+  }
+
+  function isReceived(received, start, end) {
+    return received.some(function(range) { return range[0] <= start && range[1] >= end; });
+  }
+
+  function uploadResumable(projectName, file, onProgress, onDone) {
+    var key = uploadSessionKey(projectName, file);
+
+    function createSession(callback) {
+      $.ajax({
+        url: '/upload_sessions',
+        type: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({ project_name: projectName, filename: file.name, size: file.size })
+      }).done(function(data) {
+        if (!data.success) return onDone(data);
+        localStorage.setItem(key, data.session_id);
+        callback(data);
+      }).fail(function(xhr) {
+        onDone(xhr.responseJSON || { success: false, error: 'Could not start the upload' });
+      });
+    }
+
+    // Pick up a session left by an interrupted upload of the same file
+    function openSession(callback) {
+      var sessionId = localStorage.getItem(key);
+      if (!sessionId) return createSession(callback);
+      $.get('/upload_sessions/' + sessionId).done(function(data) {
+        if (data.success) return callback(data);
+        localStorage.removeItem(key);
+        createSession(callback);
+      }).fail(function() {
+        localStorage.removeItem(key);
+        createSession(callback);
+      });
+    }
+
+    openSession(function(session) {
+      var chunkSize = session.chunk_size;
+      var pending = [];
+      var uploaded = 0;
+      var active = 0;
+      var failed = false;
+
+      for (var offset = 0; offset < file.size; offset += chunkSize) {
+        var end = Math.min(offset + chunkSize, file.size);
+        if (isReceived(session.received, offset, end)) uploaded += end - offset;
+        else pending.push(offset);
+      }
+      onProgress(file.size ? uploaded / file.size : 1);
+
+      function fail(data) {
+        if (failed) return;
+        failed = true;
+        onDone(data);
+      }
+
+      function finalize() {
+        $.post('/upload_sessions/' + session.session_id + '/finalize').done(function(data) {
+          if (data.success) localStorage.removeItem(key);
+          onDone(data);
+        }).fail(function(xhr) {
+          fail(xhr.responseJSON || { success: false, error: 'Could not finish the upload' });
+        });
+      }
+
+      function sendChunk(offset, attempt) {
+        var blob = file.slice(offset, Math.min(offset + chunkSize, file.size));
+        active++;
+        chunkDigest(blob).then(function(digest) {
+          $.ajax({
+            url: '/upload_sessions/' + session.session_id + '?offset=' + offset,
+            type: 'PUT',
+            data: blob,
+            processData: false,
+            contentType: 'application/octet-stream',
+            headers: digest ? { 'X-Chunk-SHA256': digest } : {}
+          }).done(function() {
+            active--;
+            uploaded += blob.size;
+            onProgress(uploaded / file.size);
+            next();
+          }).fail(function(xhr) {
+            // Client errors other than a corrupted chunk will not go away by retrying
+            var retryable = xhr.status === 0 || xhr.status === 422 || xhr.status >= 500;
+            if (retryable && attempt < UPLOAD_MAX_RETRIES) {
+              // The chunk stays counted as active during the backoff, so that other chunks
+              // finishing meanwhile do not finalize an upload that is still missing it
+              setTimeout(function() {
+                active--;
+                sendChunk(offset, attempt + 1);
+              }, 1000 * Math.pow(2, attempt));
+            } else {
+              active--;
+              fail(xhr.responseJSON || { success: false, error: 'Upload interrupted. Select the file again to resume.' });
+            }
+          });
+        });
+      }
+
+      function next() {
+        if (failed) return;
+        if (!pending.length && !active) return finalize();
+        while (active < UPLOAD_PARALLEL_CHUNKS && pending.length) {
+          sendChunk(pending.shift(), 0);
+        }
+      }
+
+      next();
+    });
+  }
+
   window.uploadFile = function(formData) {
     var progressBar = $('#upload-progress .progress-bar');
     $('#upload-progress').show();
+
+    function done(data) {
+      $('#upload-progress').fadeOut(500, function(){ progressBar.css('width','0%'); });
+      insertUploadedFile(data);
+    }
+
+    var file = formData.get('file');
+    if (file && file.size > UPLOAD_CHUNK_SIZE && window.localStorage) {
+      uploadResumable(formData.get('project_name'), file, function(fraction) {
+        progressBar.css('width', (fraction * 100) + '%');
+      }, done);
+      return;
+    }
+
     $.ajax({
       xhr: function() {
         var xhr = new window.XMLHttpRequest();
@@ -113,48 +305,7 @@ $(document).ready(function() {
       data: formData,
       processData: false,
       contentType: false,
-      success: function(data) {
-        $('#upload-progress').fadeOut(500, function(){ progressBar.css('width','0%'); });
-        if(data.success) {
-          var ext = data.filename.split('.').pop().toLowerCase();
-          var fileUrl = "/workspace/" + window.currentProject + "/" + data.filename;
-          var tag = "";
-
-          if (["mp3", "wav", "ogg"].indexOf(ext) >= 0) {
-            var idx = $('#editor').find('audio').length;
-            var ids = {
-              audioId:      'audio' + idx,
-              progressBarId:'progress-bar' + idx,
-              currentTimeId:'current-time' + idx,
-              durationId:   'duration' + idx
-            };
-
-            tag = buildAudioTag(fileUrl, ids);
-            insertAtCursor(tag);
-            var audioEl = document.getElementById(ids.audioId);
-            audioEl.onloadedmetadata = function() {
-              document.getElementById(ids.durationId).textContent = formatTime(audioEl.duration);
-            };
-
-          } else if (["jpg","jpeg","png","gif"].indexOf(ext) >= 0) {
-            tag = "<br><img src='" + fileUrl + "' style='max-width:100%; display:block; margin:10px auto;' class='resizable draggable'><br>";
-            insertAtCursor(tag);
-
-          } else if (["mp4","webm","avi","mov"].indexOf(ext) >= 0) {
-            tag = "<br><video controls style='max-width:100%; display:block; margin:10px auto;'>" +
-                  "<source src='" + fileUrl + "' type='video/" + ext + "'>" +
-                  "Your browser does not support the video tag." +
-                  "</video><br>";
-            insertAtCursor(tag);
-
-          } else {
-            tag = "<br><a href='" + fileUrl + "' target='_blank'>" + data.filename + "</a><br>";
-            insertAtCursor(tag);
-          }
-        } else {
-          alert(data.error);
-        }
-      }
+      success: done
     });
   };
 